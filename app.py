@@ -1,16 +1,45 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Security
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Security
 from fastapi.security.api_key import APIKeyHeader
-from fastapi.responses import JSONResponse
-import whisper
-import openai
-from pydub import AudioSegment
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+import httpx
+import numpy as np
 import os
+import time
+
+# Momento en que se empieza a importar la aplicación, para medir cuánto tarda en estar lista
+PROCESS_STARTED_AT = time.time()
+
 import tempfile
 import asyncio
-from typing import List
+import contextvars
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from contextlib import AsyncExitStack, asynccontextmanager, closing, contextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
 import logging
 import warnings
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
+from multipart.multipart import MultipartParser, parse_options_header
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -26,11 +55,74 @@ warnings.filterwarnings("ignore", category=UserWarning, module="whisper")
 app = FastAPI(title="AudioTrans API", description="API para transcripción de audio con OpenAI")
 
 # Configuración de API Key
-API_KEY = os.getenv("API_KEY", "audio-trans-secret-key-2024")
+# Claves de la API: 'nombre:clave[:cuota[:peso]]' separadas por comas. La cuota es el cómputo
+# (segundos de audio × factor del modelo) que puede consumir cada clave por QUOTA_WINDOW_SECONDS
+# y el peso, su parte de la capacidad cuando varias claves esperan a la vez
+API_KEYS = os.getenv("API_KEYS", "")
+API_KEY = os.getenv("API_KEY", "" if API_KEYS.strip() else "audio-trans-secret-key-2024")  # clave 'default'
+API_KEY_QUOTA = float(os.getenv("API_KEY_QUOTA", "0"))  # cuota de API_KEY; 0 = sin límite
+QUOTA_WINDOW_SECONDS = max(1, int(os.getenv("QUOTA_WINDOW_SECONDS", "86400")))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")  # cualquier API compatible
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "4000"))  # tokens máximos de cada respuesta
+OPENAI_CONTEXT_TOKENS = int(os.getenv("OPENAI_CONTEXT_TOKENS", "16385"))  # ventana de contexto del modelo
+OPENAI_MAX_CONCURRENCY = max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", "4")))  # peticiones simultáneas
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))  # segundos por petición
 
 # Configuración del modelo Whisper
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")  # modelo por defecto
+# Modelos que cada petición puede elegir con el parámetro 'model' (siempre incluye WHISPER_MODEL)
+WHISPER_MODELS = list(dict.fromkeys(
+    [WHISPER_MODEL] + [m.strip() for m in os.getenv("WHISPER_MODELS", "").split(",") if m.strip()]
+))
+# Segundos de cómputo por segundo de audio de cada modelo (coste relativo de la inferencia)
+MODEL_COST_FACTORS = {"tiny": 0.1, "base": 0.2, "small": 0.5, "medium": 1.0, "large": 2.0}
+MODEL_COST_FACTORS.update(
+    (name.strip(), float(factor))
+    for name, factor in (entry.split("=", 1) for entry in os.getenv("MODEL_COST_FACTORS", "").split(",") if "=" in entry)
+)
+SAMPLE_RATE = 16000  # Frecuencia de muestreo que espera Whisper
+WARMUP_CLIP_SECONDS = 2  # duración del clip sintético de calentamiento
+# Idioma por defecto; vacío = se detecta una vez por archivo, en el primer tramo con voz,
+# y se reutiliza en todos sus segmentos. Cada petición puede indicarlo con 'language'
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "").strip().lower()
+# Caracteres finales de cada segmento que se pasan como initial_prompt al siguiente (0 = desactivado).
+# Solo se aplica cuando los segmentos se transcriben en orden (un proceso, sin micro-batching)
+CONTEXT_PROMPT_CHARS = max(0, int(os.getenv("CONTEXT_PROMPT_CHARS", "200")))
+
+# Segmentación: "silence" corta en pausas y descarta silencios largos, "fixed" corta cada SEGMENT_DURATION
+SEGMENTATION_MODE = os.getenv("SEGMENTATION_MODE", "silence").lower()
+SEGMENT_DURATION = int(os.getenv("SEGMENT_DURATION", "300"))  # segundos objetivo por segmento
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-40"))  # dBFS bajo los que se considera silencio
+MIN_SILENCE_TO_DROP = float(os.getenv("MIN_SILENCE_TO_DROP", "2.0"))  # segundos de silencio que se eliminan
+SPEECH_PADDING = 0.25  # segundos de margen que se conservan alrededor de la voz
+VAD_FRAME_SECONDS = 0.03  # tamaño de trama para medir energía
+CUT_SEARCH_SECONDS = 30  # ventana antes del objetivo donde se busca la pausa para cortar
+
+# Transcripción paralela: procesos worker (cada uno con su propia copia del modelo)
+# e hilos de torch por worker. Con 1 worker se transcribe en el propio proceso
+WHISPER_WORKERS = max(1, int(os.getenv("WHISPER_WORKERS", "1")))
+TORCH_THREADS_PER_WORKER = max(1, int(os.getenv("TORCH_THREADS_PER_WORKER", str(max(1, (os.cpu_count() or 1) // WHISPER_WORKERS)))))
+# Hilos inter-op de torch (operaciones independientes en paralelo); 0 = valor por defecto de torch
+TORCH_INTEROP_THREADS = max(0, int(os.getenv("TORCH_INTEROP_THREADS", "0")))
+
+# Micro-batching: agrupa ventanas de 30 s de todas las peticiones en curso en una sola pasada
+# por el encoder y el decoder. Solo en modo de un proceso (WHISPER_WORKERS=1)
+WHISPER_BATCHING = os.getenv("WHISPER_BATCHING", "false").lower() in ("1", "true", "yes")
+BATCH_MAX_SIZE = max(1, int(os.getenv("BATCH_MAX_SIZE", "8")))  # ventanas por lote
+BATCH_MAX_WAIT_MS = max(0, int(os.getenv("BATCH_MAX_WAIT_MS", "50")))  # espera máxima para completar un lote
+WINDOW_SECONDS = 30  # ventana que Whisper procesa de una vez
+if WHISPER_BATCHING and WHISPER_WORKERS > 1:
+    logger.warning("WHISPER_BATCHING solo funciona con WHISPER_WORKERS=1. Se desactiva.")
+    WHISPER_BATCHING = False
+
+# Inferencia en CPU: "int8" aplica cuantización dinámica a las capas lineales del modelo
+WHISPER_QUANTIZATION = os.getenv("WHISPER_QUANTIZATION", "none").lower()
+if WHISPER_QUANTIZATION not in ("none", "int8"):
+    logger.warning(f"WHISPER_QUANTIZATION '{WHISPER_QUANTIZATION}' no reconocido. Usando 'none'.")
+    WHISPER_QUANTIZATION = "none"
 
 # Configuración de tamaño máximo de archivo (en bytes)
 def parse_file_size(size_str: str) -> int:
@@ -54,238 +146,3930 @@ def parse_file_size(size_str: str) -> int:
 
 MAX_FILE_SIZE = parse_file_size(os.getenv("MAX_FILE_SIZE", "100MB"))
 
+# Tamaño de bloque al guardar la subida en disco; acota la memoria usada por cada subida
+UPLOAD_CHUNK_SIZE = parse_file_size(os.getenv("UPLOAD_CHUNK_SIZE", "1MB"))
+
+# Margen para cabeceras multipart y campos de formulario sobre MAX_FILE_SIZE
+MULTIPART_OVERHEAD = 64 * 1024
+
+# /transcribe en etapas solapadas: ffmpeg decodifica mientras llega la subida y cada segmento
+# pasa a Whisper en cuanto está listo. PIPELINE_QUEUE_SEGMENTS acota los segmentos decodificados en espera
+PIPELINED_TRANSCRIBE = os.getenv("PIPELINED_TRANSCRIBE", "true").lower() in ("1", "true", "yes")
+PIPELINE_QUEUE_SEGMENTS = max(1, int(os.getenv("PIPELINE_QUEUE_SEGMENTS", "2")))
+MP4_PROBE_BYTES = 64 * 1024  # bytes iniciales en los que se busca la caja 'moov'
+# Archivos ya guardados (/jobs, /transcribe/batch, /transcribe/stream...): ffmpeg entrega el PCM por
+# una tubería y cada segmento se corta al completarse, así la memoria no depende de la duración;
+# false = decodificar el archivo entero de una vez (unos 230MB por hora de audio)
+WINDOWED_DECODE = os.getenv("WINDOWED_DECODE", "true").lower() in ("1", "true", "yes")
+
+# Configuración del pool de inferencia (decodificación, Whisper y OpenAI fuera del event loop)
+MAX_CONCURRENT_JOBS = max(1, int(os.getenv("MAX_CONCURRENT_JOBS", "1")))
+MAX_QUEUED_JOBS = max(0, int(os.getenv("MAX_QUEUED_JOBS", "4")))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "30"))
+# Segmentos que se transcriben a la vez entre todas las peticiones; los pendientes esperan en una
+# cola justa por clave. Por defecto, la capacidad de los workers o del micro-batching; en un solo
+# proceso, 1: cada modelo solo ejecuta una inferencia a la vez (ModelRegistry.inference_lock)
+SEGMENT_CONCURRENCY = max(1, int(os.getenv("SEGMENT_CONCURRENCY", "0")) or (
+    WHISPER_WORKERS if WHISPER_WORKERS > 1 else BATCH_MAX_SIZE if WHISPER_BATCHING else 1
+))
+
+# Directorio base para datos de trabajo (montado como volumen en Docker)
+TEMP_DIR = os.getenv("TEMP_DIR", os.path.join(tempfile.gettempdir(), "audiotrans"))
+
+# Espacio temporal de las peticiones síncronas: un directorio por petición bajo SCRATCH_DIR
+# (puede ser un tmpfs) y una cuota global; las peticiones nuevas esperan si está agotada
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(TEMP_DIR, "scratch"))
+SCRATCH_QUOTA = parse_file_size(os.getenv("SCRATCH_QUOTA", "2GB"))  # 0 = sin límite
+SCRATCH_SWEEP_INTERVAL = int(os.getenv("SCRATCH_SWEEP_INTERVAL", "300"))  # segundos entre barridos de huérfanos
+
+# Configuración de la API de trabajos asíncronos
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(TEMP_DIR, "jobs"))
+# false = este proceso no carga modelos: solo encola trabajos (/jobs) y sirve sus resultados,
+# que ejecutan workers independientes (worker.py) a través de SPOOL_DIR
+INFERENCE_ENABLED = os.getenv("INFERENCE_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_WORKERS = max(0, int(os.getenv("JOB_WORKERS", "1" if INFERENCE_ENABLED else "0")))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))  # segundos que se conserva un resultado
+JOB_CLEANUP_INTERVAL = int(os.getenv("JOB_CLEANUP_INTERVAL", "300"))  # segundos entre limpiezas
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))  # segundos entre consultas de un worker sin trabajo
+# Spool de trabajos en un directorio compartido por la API y los workers (mismo volumen y misma
+# ruta en todos los contenedores); vacío = base SQLite en JOBS_DIR, solo para este proceso
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
+SPOOL_LEASE_SECONDS = int(os.getenv("SPOOL_LEASE_SECONDS", "120"))  # sin renovar, el trabajo vuelve a la cola
+
+# Transcripción por lotes (/transcribe/batch): archivos por petición y directorio del que se
+# aceptan rutas locales en el manifiesto (vacío = solo archivos subidos)
+BATCH_MAX_FILES = max(1, int(os.getenv("BATCH_MAX_FILES", "200")))
+BATCH_INPUT_DIR = os.getenv("BATCH_INPUT_DIR", "")
+# Cada archivo se limita a MAX_FILE_SIZE y el lote entero, que está a la vez en disco, a SCRATCH_QUOTA
+BATCH_MAX_BODY_SIZE = BATCH_MAX_FILES * MAX_FILE_SIZE
+if SCRATCH_QUOTA:
+    BATCH_MAX_BODY_SIZE = min(BATCH_MAX_BODY_SIZE, SCRATCH_QUOTA)
+BATCH_MAX_BODY_SIZE += MULTIPART_OVERHEAD
+
+# Trazas por petición (cabecera X-Trace-Id y /traces) y perfiles de muestreo bajo demanda
+# (cabecera X-Profile), solo para los clientes de ADMIN_CLIENTS (nombres de API_KEYS; 'default' = API_KEY)
+TRACE_HISTORY = max(1, int(os.getenv("TRACE_HISTORY", "200")))  # trazas recientes que se conservan en memoria
+ADMIN_CLIENTS = {name.strip() for name in os.getenv("ADMIN_CLIENTS", "").split(",") if name.strip()}
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(TEMP_DIR, "profiles"))
+PROFILE_INTERVAL_MS = max(1.0, float(os.getenv("PROFILE_INTERVAL_MS", "10")))  # milisegundos entre muestras
+
+# Caché de transcripciones (por hash del audio) y de respuestas de OpenAI (por hash de la transcripción)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(TEMP_DIR, "cache"))
+TRANSCRIPT_CACHE_MAX_SIZE = parse_file_size(os.getenv("TRANSCRIPT_CACHE_MAX_SIZE", "500MB"))
+CHAT_CACHE_MAX_SIZE = parse_file_size(os.getenv("CHAT_CACHE_MAX_SIZE", "100MB"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))  # segundos sin uso antes de expirar
+
+# Checkpoints por segmento (en la misma caché): una petición repetida solo transcribe lo que falta
+SEGMENT_CACHE_MAX_SIZE = parse_file_size(os.getenv("SEGMENT_CACHE_MAX_SIZE", "200MB"))
+SEGMENT_MAX_ATTEMPTS = max(1, int(os.getenv("SEGMENT_MAX_ATTEMPTS", "3")))  # intentos por segmento fallido
+
+# Memoria máxima para modelos residentes (por proceso); 0 = sin límite
+MODEL_MEMORY_BUDGET = parse_file_size(os.getenv("MODEL_MEMORY_BUDGET", "4GB"))
+
 if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY no está configurada. Asegúrate de configurarla para usar OpenAI Chat.")
 
-openai.api_key = OPENAI_API_KEY
-
 logger.info(f"Configuración cargada:")
-logger.info(f"  - Modelo Whisper: {WHISPER_MODEL}")
+logger.info(f"  - Modelo Whisper: {WHISPER_MODEL} (permitidos: {', '.join(WHISPER_MODELS)})")
 logger.info(f"  - Tamaño máximo de archivo: {MAX_FILE_SIZE / (1024*1024):.1f}MB")
+logger.info(f"  - Segmentación: {SEGMENTATION_MODE} ({SEGMENT_DURATION}s por segmento)")
+logger.info(f"  - Workers de transcripción: {WHISPER_WORKERS} ({TORCH_THREADS_PER_WORKER} hilos de torch c/u)")
+logger.info(f"  - Cuantización: {WHISPER_QUANTIZATION}")
+if WHISPER_BATCHING:
+    logger.info(f"  - Micro-batching: hasta {BATCH_MAX_SIZE} ventanas, espera máxima {BATCH_MAX_WAIT_MS}ms")
+logger.info(f"  - Trabajos concurrentes: {MAX_CONCURRENT_JOBS} (cola máxima: {MAX_QUEUED_JOBS})")
+logger.info(f"  - Segmentos simultáneos: {SEGMENT_CONCURRENCY}")
+
+class UploadSizeLimitMiddleware:
+    """
+    Corta las peticiones cuyo cuerpo supera el máximo permitido sin llegar a almacenarlas:
+    rechaza por Content-Length antes de leer nada y, si la cabecera falta o miente,
+    responde 413 en cuanto los bytes recibidos superan el límite
+    """
+
+    def __init__(self, app, max_body_size: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        max_body_size = self.path_limits.get(scope["path"], self.max_body_size)
+        if scope["path"] in self.path_limits:
+            detail = f"Petición demasiado grande. Tamaño máximo permitido: {max_body_size / (1024*1024):.1f}MB"
+        else:
+            detail = f"Archivo demasiado grande. Tamaño máximo permitido: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+        
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body_size:
+            logger.warning(f"Petición rechazada por Content-Length: {int(content_length)} bytes")
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # FastAPI propaga HTTPException al parsear el formulario y la convierte en 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+# Los lotes tienen su propio límite: el de cada archivo se comprueba al recibirlo
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_limits={"/transcribe/batch": BATCH_MAX_BODY_SIZE}
+)
 
 # Seguridad
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-async def get_api_key(api_key: str = Security(api_key_header)):
-    if api_key != API_KEY:
+class ApiClient(NamedTuple):
+    """Cliente de la API: cuota de cómputo por ventana (0 = sin límite) y peso en las colas justas"""
+    name: str
+    key: str
+    quota: float = 0.0
+    weight: float = 1.0
+
+def parse_api_keys(spec: str) -> List[ApiClient]:
+    """Convierte 'nombre:clave[:cuota[:peso]],...' en clientes"""
+    clients = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        fields = [field.strip() for field in entry.split(":")]
+        if len(fields) < 2 or len(fields) > 4 or not fields[0] or not fields[1]:
+            raise ValueError(f"Entrada de API_KEYS inválida (usa 'nombre:clave[:cuota[:peso]]'): {entry.strip()}")
+        quota = float(fields[2]) if len(fields) > 2 and fields[2] else 0.0
+        weight = float(fields[3]) if len(fields) > 3 and fields[3] else 1.0
+        if weight <= 0:
+            raise ValueError(f"El peso de la clave '{fields[0]}' debe ser positivo")
+        clients.append(ApiClient(fields[0], fields[1], quota, weight))
+    return clients
+
+api_clients: Dict[str, ApiClient] = {client.key: client for client in parse_api_keys(API_KEYS)}
+if API_KEY:
+    api_clients.setdefault(API_KEY, ApiClient("default", API_KEY, API_KEY_QUOTA))
+logger.info(f"  - Claves de API: {', '.join(sorted(c.name for c in api_clients.values())) or 'ninguna'}")
+
+async def get_api_key(api_key: str = Security(api_key_header)) -> ApiClient:
+    client = api_clients.get(api_key) if api_key else None
+    if client is None:
         raise HTTPException(status_code=403, detail="API Key inválida")
-    return api_key
+    return client
 
-# Cargar modelo Whisper al iniciar la aplicación
-whisper_model = None
+def model_cost_factor(model_name: Optional[str]) -> float:
+    """Factor de coste de un modelo; las variantes ('small.en', 'large-v3') usan el de su tamaño"""
+    name = model_name or WHISPER_MODEL
+    if name in MODEL_COST_FACTORS:
+        return MODEL_COST_FACTORS[name]
+    return MODEL_COST_FACTORS.get(re.split(r"[.-]", name)[0], 1.0)
 
-@app.on_event("startup")
-async def load_whisper_model():
-    global whisper_model
-    logger.info(f"Cargando modelo Whisper: {WHISPER_MODEL}")
-    try:
-        whisper_model = whisper.load_model(WHISPER_MODEL)
-        logger.info(f"Modelo Whisper '{WHISPER_MODEL}' cargado exitosamente")
-    except Exception as e:
-        logger.error(f"Error cargando modelo Whisper '{WHISPER_MODEL}': {e}")
-        logger.info("Intentando cargar modelo 'small' como respaldo...")
-        whisper_model = whisper.load_model("small")
-        logger.info("Modelo Whisper 'small' cargado como respaldo")
+def compute_cost(audio_seconds: float, model_name: Optional[str]) -> float:
+    """Cómputo estimado de transcribir audio_seconds con un modelo"""
+    return audio_seconds * model_cost_factor(model_name)
+
+class QuotaLedger:
+    """Cómputo admitido de cada cliente en una ventana deslizante de QUOTA_WINDOW_SECONDS"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._charges: Dict[str, deque] = {}  # cliente -> [instante, coste] en orden de admisión
+
+    def _active(self, client: ApiClient) -> deque:
+        charges = self._charges.setdefault(client.name, deque())
+        horizon = time.time() - self.window
+        while charges and charges[0][0] < horizon:
+            charges.popleft()
+        return charges
+
+    def used(self, client: ApiClient) -> float:
+        return sum(cost for _, cost in self._active(client))
+
+    def _rejection(self, client: ApiClient, cost: float, detail: str) -> HTTPException:
+        QUOTA_REJECTIONS.labels(client.name).inc()
+        logger.warning(f"🚫 Cuota agotada para '{client.name}': {detail}")
+        if cost > client.quota:
+            # No cabría ni con la cuota entera libre: reintentar no sirve
+            return HTTPException(status_code=429, detail=detail)
+        
+        # Esperar a que expiren de la ventana las admisiones necesarias para que quepa
+        freed = 0.0
+        excess = self.used(client) + cost - client.quota
+        retry_after = self.window
+        for admitted_at, charge in self._active(client):
+            freed += charge
+            if freed >= excess:
+                retry_after = admitted_at + self.window - time.time()
+                break
+        return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, int(retry_after) + 1))})
+
+    def check(self, client: ApiClient):
+        """Rechaza de inmediato a un cliente que ya agotó su cuota, antes de leer la subida"""
+        if client.quota and self.used(client) >= client.quota:
+            raise self._rejection(client, 0.0, f"Cuota de cómputo agotada ({client.quota:.0f}s por {self.window}s)")
+
+    def admit(self, client: ApiClient, cost: float) -> list:
+        """Admite y cobra cost si cabe en la cuota del cliente (429 si no); devuelve el cargo para refund()"""
+        if client.quota:
+            used = self.used(client)
+            if used + cost > client.quota:
+                raise self._rejection(
+                    client, cost,
+                    f"La petición necesita {cost:.0f}s de cómputo y quedan {max(0.0, client.quota - used):.0f}s "
+                    f"de la cuota ({client.quota:.0f}s por {self.window}s)"
+                )
+        charge = [time.time(), cost]
+        self._active(client).append(charge)
+        return charge
+
+    @staticmethod
+    def refund(charge: Optional[list]):
+        """Anula un cargo (la petición falló sin producir resultado)"""
+        if charge is not None:
+            charge[1] = 0.0
+
+quota_ledger = QuotaLedger(QUOTA_WINDOW_SECONDS)
+
+# Rutas cuyo cuerpo es audio a transcribir (se comprueban antes de leerlo)
+QUOTA_CHECKED_PATHS = {"/transcribe", "/transcribe/stream", "/transcribe/batch", "/jobs"}
 
-def split_audio(audio_path: str, segment_duration: int = 300) -> List[str]:
+class QuotaPrecheckMiddleware:
     """
-    Divide un archivo de audio en segmentos de duración específica (en segundos)
-    Por defecto 300 segundos = 5 minutos
+    Responde 429 antes de leer el cuerpo cuando la clave de la petición ya agotó su cuota.
+    Los endpoints con archivos en el formulario solo ven la petición tras recibir la subida entera
     """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in QUOTA_CHECKED_PATHS:
+            headers = dict(scope.get("headers") or [])
+            client = api_clients.get(headers.get(b"x-api-key", b"").decode("latin-1"))
+            if client is not None:
+                try:
+                    quota_ledger.check(client)
+                except HTTPException as e:
+                    response = JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+app.add_middleware(QuotaPrecheckMiddleware)
+
+class Trace:
+    """Traza de una petición o trabajo: tramos con nombre, inicio relativo, duración y atributos"""
+
+    def __init__(self, name: str, client: Optional[str] = None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.client = client
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.ended: Optional[float] = None
+        self.profile_path: Optional[str] = None
+        self._spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.perf_counter()) - self.started
+
+    def add(self, name: str, started: float, duration: float, **attributes):
+        span = {"name": name, "start": round(started - self.started, 3), "duration": round(duration, 3), **attributes}
+        with self._lock:
+            self._spans.append(span)
+
+    def finish(self):
+        self.ended = time.perf_counter()
+
+    def stages(self) -> Dict[str, float]:
+        """Segundos por tipo de tramo (suma: los segmentos en paralelo pueden superar el total)"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self._spans:
+                totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        return {name: round(seconds, 3) for name, seconds in totals.items()}
+
+    def to_dict(self, spans: bool = True) -> dict:
+        data = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "total_seconds": round(self.duration, 3),
+            "stages": self.stages(),
+            "profile_url": f"/traces/{self.trace_id}/profile" if self.profile_path else None
+        }
+        if spans:
+            with self._lock:
+                data["spans"] = sorted(self._spans, key=lambda span: span["start"])
+        return data
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+def add_span(name: str, started: float, **attributes):
+    """Cierra ahora un tramo empezado en started (perf_counter) en la traza en curso, si la hay"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, started, time.perf_counter() - started, **attributes)
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """Registra la duración del bloque como un tramo; el bloque puede añadir atributos al dict que recibe"""
+    started = time.perf_counter()
     try:
-        audio = AudioSegment.from_file(audio_path)
-        duration_ms = len(audio)
-        segment_duration_ms = segment_duration * 1000
+        yield attributes
+    finally:
+        add_span(name, started, **attributes)
+
+def log_trace(trace: Trace):
+    stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in trace.stages().items())
+    logger.info(f"⏱️  Traza {trace.trace_id} ({trace.name}): {trace.duration:.2f}s en total; {stages or 'sin tramos'}")
+
+class StackSampler:
+    """Perfil de muestreo de las pilas de todos los hilos del proceso, guardado en formato 'folded'"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self._counts: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                folded = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                self._counts[folded] = self._counts.get(folded, 0) + 1
+            self.samples += 1
+
+    def stop(self, path: str) -> str:
+        """Detiene el muestreo y escribe las pilas en path"""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self._counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+class TraceStore:
+    """Últimas TRACE_HISTORY trazas de este proceso, para consultarlas en /traces"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    def add(self, trace: Trace):
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.capacity:
+            _, evicted = self._traces.popitem(last=False)
+            # Sin la traza nadie puede pedir su perfil
+            if evicted.profile_path:
+                cleanup_temp_files([evicted.profile_path])
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def recent(self, client: Optional[str] = None, limit: int = 50) -> List[Trace]:
+        """Trazas más recientes primero; con client, solo las de ese cliente"""
+        traces = [trace for trace in reversed(self._traces.values()) if client is None or trace.client == client]
+        return traces[:limit]
+
+trace_store = TraceStore(TRACE_HISTORY)
+
+# Rechazos antes de hacer trabajo (clave, tamaño, cuota): no se guardan sus trazas
+UNTRACED_STATUSES = {401, 403, 413, 429}
+
+class TraceMiddleware:
+    """
+    Traza cada petición de transcripción de una clave válida y devuelve su id en la cabecera X-Trace-Id.
+    Con X-Profile: true (solo ADMIN_CLIENTS) además se muestrea el proceso mientras dura la petición
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in QUOTA_CHECKED_PATHS:
+            await self.app(scope, receive, send)
+            return
         
-        segment_paths = []
+        headers = dict(scope.get("headers") or [])
+        client = api_clients.get(headers.get(b"x-api-key", b"").decode("latin-1"))
+        if client is None:
+            # Sin clave válida la petición se rechaza: no debe ocupar sitio en trace_store
+            await self.app(scope, receive, send)
+            return
         
-        # Crear directorio temporal
-        temp_dir = tempfile.mkdtemp()
+        sampler = None
+        if headers.get(b"x-profile", b"").lower() in (b"1", b"true", b"yes"):
+            if client.name not in ADMIN_CLIENTS:
+                response = JSONResponse(
+                    status_code=403,
+                    content={"detail": "Solo los clientes administradores (ADMIN_CLIENTS) pueden pedir un perfil"}
+                )
+                await response(scope, receive, send)
+                return
+            sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
         
-        # Dividir y guardar segmentos directamente
-        for i in range(0, duration_ms, segment_duration_ms):
-            segment = audio[i:i + segment_duration_ms]
-            segment_path = os.path.join(temp_dir, f"segment_{i//segment_duration_ms:03d}.wav")
-            segment.export(segment_path, format="wav")
-            segment_paths.append(segment_path)
-            logger.info(f"Segmento {len(segment_paths)} creado: {segment_path}")
+        trace = Trace(f"{scope['method']} {scope['path']}", client.name)
+        status = None
         
-        return segment_paths
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if status not in UNTRACED_STATUSES:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
         
-    except Exception as e:
-        logger.error(f"Error dividiendo audio: {e}")
-        raise HTTPException(status_code=500, detail=f"Error procesando archivo de audio: {str(e)}")
+        token = current_trace.set(trace)
+        if sampler is not None:
+            sampler.start()
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            current_trace.reset(token)
+            trace.finish()
+            if sampler is not None:
+                trace.profile_path = await asyncio.to_thread(
+                    sampler.stop, os.path.join(PROFILE_DIR, f"{trace.trace_id}.folded")
+                )
+                logger.info(f"🔬 Perfil de {sampler.samples} muestras guardado en {trace.profile_path}")
+            if status in UNTRACED_STATUSES:
+                cleanup_temp_files([trace.profile_path] if trace.profile_path else [])
+            else:
+                trace_store.add(trace)
+                log_trace(trace)
 
-def transcribe_audio_segments(segment_paths: List[str]) -> str:
+app.add_middleware(TraceMiddleware)
+
+class FairQueue:
     """
-    Transcribe cada segmento de audio usando Whisper y une las transcripciones
+    Cola justa ponderada (WFQ) con capacity turnos simultáneos.
+    El siguiente turno es el de menor tiempo virtual de fin, que cada cliente acumula como coste / peso
     """
-    if not whisper_model:
-        raise HTTPException(status_code=503, detail="Modelo Whisper no disponible")
-    
-    transcriptions = []
-    
-    for i, segment_path in enumerate(segment_paths):
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self._waiting: List[Tuple[float, int, float, asyncio.Future]] = []  # (fin, orden, inicio, futuro)
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    async def acquire(self, client: Optional[ApiClient], cost: float):
+        name, weight = (client.name, client.weight) if client else ("", 1.0)
+        start = max(self._virtual_time, self._finish_tags.get(name, 0.0))
+        finish = start + cost / weight
+        self._finish_tags[name] = finish
+        if self.active < self.capacity:
+            self.active += 1
+            self._virtual_time = max(self._virtual_time, start)
+            return
+        
+        entry = (finish, next(self._sequence), start, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting, entry)
         try:
-            logger.info(f"Transcribiendo segmento {i+1}/{len(segment_paths)}")
-            result = whisper_model.transcribe(segment_path)
-            
-            # Verificar que el resultado tenga el formato esperado
-            if isinstance(result, dict) and "text" in result:
-                text = result["text"].strip()
-                transcriptions.append(text)
-                logger.info(f"Segmento {i+1} transcrito: {len(text)} caracteres")
+            await entry[3]
+        except asyncio.CancelledError:
+            if entry[3].cancelled():
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
             else:
-                logger.warning(f"Formato inesperado en resultado del segmento {i+1}")
-                transcriptions.append("")  # Agregar texto vacío para mantener orden
-                
-        except Exception as e:
-            logger.error(f"Error transcribiendo segmento {i+1}: {e}")
-            transcriptions.append("")  # Agregar texto vacío para mantener orden
-    
-    # Unir todas las transcripciones en orden, filtrando textos vacíos
-    valid_transcriptions = [t for t in transcriptions if t]
-    full_transcription = " ".join(valid_transcriptions)
-    
-    if not full_transcription.strip():
-        raise HTTPException(status_code=500, detail="No se pudo transcribir ningún segmento de audio")
-    
-    return full_transcription
+                # El turno se concedió justo antes de cancelar: devolverlo
+                self.release()
+            raise
 
-def cleanup_temp_files(file_paths: List[str]):
+    def release(self):
+        """Libera un turno y se lo pasa al siguiente en espera, si lo hay"""
+        while self._waiting:
+            _, _, start, future = heapq.heappop(self._waiting)
+            if not future.cancelled():
+                self._virtual_time = max(self._virtual_time, start)
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def turn(self, client: Optional[ApiClient], cost: float):
+        await self.acquire(client, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+# Turnos de inferencia por segmento entre todas las peticiones
+segment_fair_queue = FairQueue(SEGMENT_CONCURRENCY)
+
+class InferencePool:
     """
-    Limpia archivos temporales
+    Pool acotado para el trabajo bloqueante del pipeline.
+    Ejecuta como máximo max_workers trabajos a la vez y mantiene hasta max_queue en espera;
+    el resto se rechaza de inmediato con 503 y Retry-After. Los huecos se reparten entre
+    las claves en espera con una cola justa ponderada (una unidad de coste por petición)
     """
-    for file_path in file_paths:
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._fair_queue = FairQueue(max_workers)
+        self._admitted = 0
+        self._running = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._admitted - self._running
+
+    @property
+    def is_full(self) -> bool:
+        return self._admitted >= self.max_workers + self.max_queue
+
+    def busy_error(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, inténtalo de nuevo más tarde",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+    @asynccontextmanager
+    async def slot(self, reject_when_full: bool = True, client: Optional[ApiClient] = None):
+        """
+        Reserva un hueco de ejecución, esperando en la cola acotada si es necesario.
+        Los workers de trabajos usan reject_when_full=False: su cola es el almacén de trabajos
+        """
+        if reject_when_full and self.is_full:
+            raise self.busy_error()
+        self._admitted += 1
+        waiting = time.perf_counter()
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Archivo temporal eliminado: {file_path}")
-        except Exception as e:
-            logger.warning(f"Error eliminando archivo {file_path}: {e}")
+            async with self._fair_queue.turn(client, 1.0):
+                add_span("queue", waiting)
+                self._running += 1
+                try:
+                    yield
+                finally:
+                    self._running -= 1
+        finally:
+            self._admitted -= 1
 
-async def process_with_openai_chat(text: str, custom_prompt: str = None) -> str:
+    async def run(self, func, *args, **kwargs):
+        """Ejecuta una función bloqueante en el pool conservando el contexto actual"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+inference_pool = InferencePool(MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS)
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # existe, aunque sea de otro usuario
+    return True
+
+class ScratchSpace:
+    """Espacio temporal de las peticiones: un directorio por petición bajo root y una cuota global de bytes"""
+
+    # '<pid>-<id>': el barrido distingue los directorios de procesos que ya no existen
+    DIRECTORY_PATTERN = re.compile(r"^(\d+)-[0-9a-f]{32}$")
+
+    def __init__(self, root: str, quota: int):
+        self.root = root
+        self.quota = quota
+        self.reserved = 0
+        self._waiting = 0
+        self._active = set()
+        self._condition = asyncio.Condition()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def active(self) -> int:
+        return len(self._active)
+
+    @asynccontextmanager
+    async def directory(self, nbytes: int):
+        """Reserva nbytes de la cuota (esperando si hace falta) y entrega un directorio que se borra al salir"""
+        if self.quota:
+            # Una petición mayor que la cuota entera la ocupa sola en lugar de esperar para siempre
+            nbytes = min(nbytes, self.quota)
+        
+        async with self._condition:
+            self._waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self.quota or self.reserved + nbytes <= self.quota)
+            finally:
+                self._waiting -= 1
+            self.reserved += nbytes
+        
+        path = os.path.join(self.root, f"{os.getpid()}-{uuid.uuid4().hex}")
+        self._active.add(path)
+        try:
+            os.makedirs(path)
+            yield path
+        finally:
+            self._active.discard(path)
+            shutil.rmtree(path, ignore_errors=True)
+            async with self._condition:
+                self.reserved -= nbytes
+                self._condition.notify_all()
+
+    def sweep(self) -> int:
+        """
+        Elimina los directorios huérfanos: los de procesos que ya no existen y los de este
+        proceso que no pertenecen a ninguna petición en curso (p. ej. tras un reinicio del
+        contenedor, que reutiliza el pid). Devuelve cuántos se eliminaron
+        """
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            match = self.DIRECTORY_PATTERN.match(name)
+            if not match or path in self._active or not os.path.isdir(path):
+                continue
+            
+            pid = int(match.group(1))
+            if pid == os.getpid() or not process_alive(pid):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.root,
+            "quota_bytes": self.quota,
+            "reserved_bytes": self.reserved,
+            "active": self.active,
+            "waiting": self.waiting
+        }
+
+scratch_space = ScratchSpace(SCRATCH_DIR, SCRATCH_QUOTA)
+
+def upload_reservation(request: Request, limit: int = MAX_FILE_SIZE + MULTIPART_OVERHEAD) -> int:
+    """Bytes a reservar para una subida: Content-Length si viene, acotado por el tamaño máximo"""
+    try:
+        return min(int(request.headers["content-length"]), limit)
+    except (KeyError, ValueError):
+        return limit
+
+class JobStore:
     """
-    Procesa el texto transcrito con OpenAI Chat
+    Almacén persistente de trabajos de transcripción en SQLite.
+    Cada operación abre su propia conexión, por lo que puede usarse desde el event loop
+    y desde los hilos del pool de inferencia
     """
-    if not OPENAI_API_KEY:
-        return "OpenAI API Key no configurada. Transcripción completada sin procesamiento adicional."
-    
-    # Prompt por defecto si no se especifica uno personalizado
-    default_prompt = """
-    Eres un asistente experto en análisis de texto. Tu tarea es procesar la siguiente transcripción de audio:
-    
-    1. Corrige errores gramaticales y de puntuación
-    2. Estructura el texto de manera coherente
-    3. Identifica los puntos principales y temas tratados
-    4. Proporciona un resumen ejecutivo al final
-    
-    Transcripción a procesar:
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    original_filename TEXT NOT NULL,
+                    input_path TEXT NOT NULL,
+                    custom_prompt TEXT,
+                    model TEXT,
+                    language TEXT,
+                    client TEXT,
+                    segments_done INTEGER NOT NULL DEFAULT 0,
+                    segments_total INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    quota_refunded INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            # Bases de datos creadas antes de poder elegir modelo o idioma por petición o de haber varias claves
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("model", "language", "client"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            if "quota_refunded" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN quota_refunded INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(
+        self,
+        job_id: str,
+        original_filename: str,
+        input_path: str,
+        custom_prompt: str = None,
+        model: str = None,
+        language: str = None,
+        client: str = None
+    ):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, original_filename, input_path, custom_prompt, model, language, client, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, original_filename, input_path, custom_prompt, model, language, client, now, now)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim_next(self) -> Optional[dict]:
+        """Marca como 'running' el trabajo en cola más antiguo y lo devuelve"""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                        (time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row else None
+
+    def update_progress(self, job_id: str, segments_done: int, segments_total: int):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET segments_done = ?, segments_total = ?, updated_at = ? WHERE id = ?",
+                (segments_done, segments_total, time.time(), job_id)
+            )
+
+    def complete(self, job_id: str, result: dict, refunded: bool = False):
+        """Guarda el resultado; refunded indica que el trabajo no consumió cuota (salió de la caché)"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', result = ?, quota_refunded = ?, updated_at = ?, expires_at = ? WHERE id = ?",
+                (json.dumps(result), int(refunded), now, now + JOB_RESULT_TTL, job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, quota_refunded = 1, updated_at = ?, expires_at = ? WHERE id = ?",
+                (error, now, now + JOB_RESULT_TTL, job_id)
+            )
+
+    def count(self, status: str) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def requeue_interrupted(self) -> int:
+        """Devuelve a la cola los trabajos que quedaron en 'running' tras un reinicio"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', segments_done = 0, updated_at = ? WHERE status = 'running'",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+    def delete_expired(self) -> List[dict]:
+        """Elimina los trabajos cuyo resultado ha expirado y los devuelve"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+            ).fetchall()
+            conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        return [dict(row) for row in rows]
+
+class SpoolJobStore:
     """
-    
-    prompt = custom_prompt if custom_prompt else default_prompt
-    full_message = f"{prompt}\n\n{text}"
-    
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "user", "content": full_message}
-            ],
-            max_tokens=4000,
-            temperature=0.3
+    Almacén de trabajos en un directorio compartido: JSON movidos entre queued/, leased/ y done/ con os.rename.
+    El lease es la fecha de modificación del archivo en leased/, que el worker renueva mientras trabaja
+    """
+
+    def __init__(self, root: str, lease_seconds: int):
+        self.root = root
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        for name in ("queued", "leased", "done", "tmp", "uploads"):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _path(self, state: str, job_id: str) -> str:
+        return os.path.join(self.root, state, f"{job_id}.json")
+
+    def _read(self, path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: str, job: dict):
+        # Escribir aparte y renombrar: los lectores nunca ven un JSON a medias
+        tmp_path = os.path.join(self.root, "tmp", f"{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _leased(self, job_id: str) -> Optional[dict]:
+        """Trabajo en leased/ si el lease sigue siendo de este proceso"""
+        job = self._read(self._path("leased", job_id))
+        return job if job and job.get("lease_owner") == self.owner else None
+
+    def create(
+        self,
+        job_id: str,
+        original_filename: str,
+        input_path: str,
+        custom_prompt: str = None,
+        model: str = None,
+        language: str = None,
+        client: str = None
+    ):
+        now = time.time()
+        self._write(self._path("queued", job_id), {
+            "id": job_id, "status": "queued", "original_filename": original_filename,
+            "input_path": input_path, "custom_prompt": custom_prompt, "model": model,
+            "language": language, "client": client, "segments_done": 0, "segments_total": None,
+            "result": None, "error": None, "created_at": now, "updated_at": now,
+            "expires_at": None, "lease_owner": None
+        })
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        # El trabajo puede cambiar de directorio mientras se busca: una segunda pasada lo encuentra
+        for _ in range(2):
+            for state, status in (("done", None), ("leased", "running"), ("queued", None)):
+                job = self._read(self._path(state, job_id))
+                if job and state == "queued":
+                    # Un trabajo devuelto a la cola empieza de nuevo al reclamarlo
+                    return {**job, "status": "queued", "segments_done": 0}
+                if job:
+                    return {**job, "status": status or job["status"]}
+        return None
+
+    def claim_next(self) -> Optional[dict]:
+        """Mueve a leased/ el trabajo en cola más antiguo y lo devuelve"""
+        self.requeue_interrupted()
+        queued_dir = os.path.join(self.root, "queued")
+        candidates = []
+        for name in os.listdir(queued_dir):
+            job = self._read(os.path.join(queued_dir, name))
+            if job:
+                candidates.append((job["created_at"], name))
+        
+        for _, name in sorted(candidates):
+            queued_path = os.path.join(queued_dir, name)
+            leased_path = os.path.join(self.root, "leased", name)
+            try:
+                # El rename conserva la fecha de modificación: renovarla antes para que el
+                # trabajo no parezca un lease expirado nada más reclamarlo
+                os.utime(queued_path)
+                os.rename(queued_path, leased_path)
+            except FileNotFoundError:
+                continue  # otro worker se adelantó
+            job = self._read(leased_path)
+            if job is None:
+                continue
+            job.update(status="running", segments_done=0, updated_at=time.time(), lease_owner=self.owner)
+            self._write(leased_path, job)
+            return job
+        return None
+
+    def renew(self, job_id: str) -> bool:
+        """Renueva el lease de un trabajo; False si este proceso ya no lo tiene"""
+        if self._leased(job_id) is None:
+            return False
+        try:
+            os.utime(self._path("leased", job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job_id: str):
+        """Devuelve a la cola un trabajo que este proceso deja sin terminar (p. ej. al pararse)"""
+        if self._leased(job_id) is not None:
+            try:
+                os.rename(self._path("leased", job_id), self._path("queued", job_id))
+            except FileNotFoundError:
+                pass
+
+    def update_progress(self, job_id: str, segments_done: int, segments_total: int):
+        job = self._leased(job_id)
+        if job is not None:
+            job.update(segments_done=segments_done, segments_total=segments_total, updated_at=time.time())
+            self._write(self._path("leased", job_id), job)
+
+    def _finish(self, job_id: str, **fields):
+        # Si el lease expiró y otro worker repite el trabajo, gana el primero que termina
+        job = self._read(self._path("leased", job_id)) or self._read(self._path("queued", job_id))
+        if job is None:
+            return
+        now = time.time()
+        job.update(fields, updated_at=now, expires_at=now + JOB_RESULT_TTL, lease_owner=None)
+        self._write(self._path("done", job_id), job)
+        for state in ("leased", "queued"):
+            try:
+                os.remove(self._path(state, job_id))
+            except FileNotFoundError:
+                pass
+
+    def complete(self, job_id: str, result: dict, refunded: bool = False):
+        self._finish(job_id, status="completed", result=json.dumps(result), quota_refunded=refunded)
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, status="failed", error=error, quota_refunded=True)
+
+    def count(self, status: str) -> int:
+        if status in ("queued", "running"):
+            return len(os.listdir(os.path.join(self.root, "queued" if status == "queued" else "leased")))
+        done_dir = os.path.join(self.root, "done")
+        return sum(
+            1 for name in os.listdir(done_dir)
+            if (self._read(os.path.join(done_dir, name)) or {}).get("status") == status
         )
+
+    def requeue_interrupted(self) -> int:
+        """Devuelve a la cola los trabajos cuyo lease ha expirado (su worker dejó de renovarlo)"""
+        leased_dir = os.path.join(self.root, "leased")
+        now = time.time()
+        requeued = 0
+        for name in os.listdir(leased_dir):
+            path = os.path.join(leased_dir, name)
+            try:
+                if now - os.path.getmtime(path) <= self.lease_seconds:
+                    continue
+                os.rename(path, os.path.join(self.root, "queued", name))
+            except FileNotFoundError:
+                continue  # terminado o recuperado por otro proceso
+            logger.warning(f"Lease del trabajo {name[:-5]} expirado: vuelve a la cola")
+            requeued += 1
+        return requeued
+
+    def delete_expired(self) -> List[dict]:
+        """Elimina los trabajos cuyo resultado ha expirado y los devuelve"""
+        done_dir = os.path.join(self.root, "done")
+        now = time.time()
+        expired = []
+        for name in os.listdir(done_dir):
+            job = self._read(os.path.join(done_dir, name))
+            if job and job["expires_at"] is not None and job["expires_at"] < now:
+                try:
+                    os.remove(os.path.join(done_dir, name))
+                except FileNotFoundError:
+                    continue
+                expired.append(job)
+        return expired
+
+if SPOOL_DIR:
+    job_store = SpoolJobStore(SPOOL_DIR, SPOOL_LEASE_SECONDS)
+else:
+    job_store = JobStore(os.path.join(JOBS_DIR, "jobs.db"))
+JOB_UPLOADS_DIR = os.path.join(SPOOL_DIR or JOBS_DIR, "uploads")
+job_charges: Dict[str, list] = {}  # cargo de cuota de cada trabajo admitido aquí, para devolverlo si falla
+api_clients_by_name = {client.name: client for client in api_clients.values()}
+
+# Métricas Prometheus (expuestas en /metrics)
+STAGE_DURATION = Histogram(
+    "audiotrans_stage_duration_seconds",
+    "Duración de cada etapa del pipeline (upload, split, segment, chat)",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+SEGMENT_REAL_TIME_FACTOR = Histogram(
+    "audiotrans_segment_real_time_factor",
+    "Tiempo de inferencia dividido por la duración del audio de cada segmento",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4)
+)
+AUDIO_SECONDS_PROCESSED = Counter("audiotrans_audio_seconds_processed", "Segundos de audio transcritos por Whisper")
+BYTES_RECEIVED = Counter("audiotrans_upload_bytes_received", "Bytes de audio recibidos en subidas")
+FAILED_SEGMENTS = Counter("audiotrans_failed_segments", "Segmentos cuya transcripción falló")
+SEGMENT_RETRIES = Counter("audiotrans_segment_retries", "Reintentos de segmentos fallidos")
+CHECKPOINTED_SEGMENTS = Counter("audiotrans_checkpointed_segments", "Segmentos reutilizados de un checkpoint")
+IN_FLIGHT_TRANSCRIPTIONS = Gauge("audiotrans_in_flight_transcriptions", "Transcripciones en ejecución")
+QUEUE_DEPTH = Gauge("audiotrans_queue_depth", "Transcripciones esperando turno", ["queue"])
+BATCH_SIZE = Histogram(
+    "audiotrans_batch_size",
+    "Ventanas de 30 s procesadas en cada lote del micro-batching",
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+IN_FLIGHT_TRANSCRIPTIONS.set_function(lambda: inference_pool.running)
+QUEUE_DEPTH.labels("inference").set_function(lambda: inference_pool.queued)
+QUEUE_DEPTH.labels("jobs").set_function(lambda: job_store.count("queued"))
+QUEUE_DEPTH.labels("batch").set_function(lambda: batch_scheduler.pending if batch_scheduler else 0)
+QUEUE_DEPTH.labels("scratch").set_function(lambda: scratch_space.waiting)
+QUEUE_DEPTH.labels("segments").set_function(lambda: segment_fair_queue.waiting)
+QUOTA_REJECTIONS = Counter("audiotrans_quota_rejections", "Peticiones rechazadas por cuota de cómputo", ["client"])
+QUOTA_USED = Gauge("audiotrans_quota_used_seconds", "Cómputo admitido en la ventana de cuota", ["client"])
+for _client in (client for client in api_clients.values() if client.quota):
+    QUOTA_USED.labels(_client.name).set_function(functools.partial(quota_ledger.used, _client))
+SCRATCH_RESERVED_BYTES = Gauge("audiotrans_scratch_reserved_bytes", "Bytes reservados del espacio temporal")
+SCRATCH_RESERVED_BYTES.set_function(lambda: scratch_space.reserved)
+
+class DiskCache:
+    """
+    Caché persistente en disco con expulsión LRU acotada por tamaño total y TTL.
+    Cada entrada es un archivo JSON cuyo nombre es la clave; la fecha de modificación
+    marca el último uso y se actualiza en cada acierto
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        with self._lock:
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    raise FileNotFoundError(path)
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: dict):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+                self._evict()
+            except OSError as e:
+                logger.warning(f"Error guardando en caché {self.directory}: {e}")
+                self._remove(tmp_path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Elimina las entradas expiradas y, si se supera el tamaño máximo, las menos usadas"""
+        now = time.time()
+        entries = []
+        for mtime, size, path in self._entries():
+            if now - mtime > self.ttl:
+                self._remove(path)
+            else:
+                entries.append((mtime, size, path))
         
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error procesando con OpenAI: {e}")
-        return f"Error procesando con OpenAI: {str(e)}. Transcripción original: {text}"
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
 
-@app.get("/")
-async def root():
-    return {"message": "AudioTrans API - Servicio de transcripción de audio"}
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._entries()
+        return {
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / (1024*1024), 2),
+            "max_size_mb": round(self.max_bytes / (1024*1024), 1),
+            "hits": self.hits,
+            "misses": self.misses
+        }
 
-@app.get("/health")
-async def health_check():
+transcript_cache = DiskCache(os.path.join(CACHE_DIR, "transcripts"), TRANSCRIPT_CACHE_MAX_SIZE, CACHE_TTL) if CACHE_ENABLED else None
+chat_cache = DiskCache(os.path.join(CACHE_DIR, "chat"), CHAT_CACHE_MAX_SIZE, CACHE_TTL) if CACHE_ENABLED else None
+segment_cache = DiskCache(os.path.join(CACHE_DIR, "segments"), SEGMENT_CACHE_MAX_SIZE, CACHE_TTL) if CACHE_ENABLED else None
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 del contenido de un archivo, leído en bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def transcription_options(model_name: str = None, language: str = None) -> dict:
+    """Opciones que afectan al resultado de la transcripción (forman parte de la clave de caché)"""
     return {
-        "status": "healthy", 
-        "whisper_model_loaded": whisper_model is not None,
-        "whisper_model": WHISPER_MODEL,
-        "max_file_size_mb": round(MAX_FILE_SIZE / (1024*1024), 1),
-        "api_key_configured": bool(API_KEY),
-        "openai_key_configured": bool(OPENAI_API_KEY)
+        "model": model_name or WHISPER_MODEL,
+        "language": language,
+        "context_prompt_chars": CONTEXT_PROMPT_CHARS,
+        "quantization": WHISPER_QUANTIZATION,
+        "batching": WHISPER_BATCHING,
+        "sample_rate": SAMPLE_RATE,
+        "segmentation_mode": SEGMENTATION_MODE,
+        "segment_duration": SEGMENT_DURATION,
+        "silence_threshold_db": SILENCE_THRESHOLD_DB,
+        "min_silence_to_drop": MIN_SILENCE_TO_DROP
     }
 
-@app.post("/transcribe")
-async def transcribe_audio(
-    file: UploadFile = File(...),
-    custom_prompt: str = None,
-    api_key: str = Depends(get_api_key)
-):
+def cache_key(*parts) -> str:
+    """Clave de caché estable a partir de valores serializables a JSON"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+def model_memory_bytes(model) -> int:
+    """Memoria de los pesos y buffers de un modelo torch, incluidos los cuantizados (0 si no es un módulo torch)"""
+    if not hasattr(model, "state_dict"):
+        return 0
+    total = 0
+    for value in model.state_dict().values():
+        # Las capas cuantizadas guardan sus pesos empaquetados como tupla (peso, sesgo)
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if hasattr(tensor, "numel"):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+class ModelRegistry:
     """
-    Transcribe un archivo de audio .m4a y lo procesa con OpenAI Chat
+    Modelos Whisper cargados bajo demanda la primera vez que se piden.
+    Si la memoria de los modelos residentes supera el presupuesto se expulsan
+    los menos usados recientemente (nunca el último cargado)
     """
-    # Verificar formato de archivo
-    if not file.filename.lower().endswith('.m4a'):
-        raise HTTPException(status_code=400, detail="Solo se aceptan archivos .m4a")
-    
-    if not whisper_model:
-        raise HTTPException(status_code=503, detail="Modelo Whisper no está disponible")
-    
-    temp_files = []
-    
-    try:
-        # Guardar archivo subido temporalmente y verificar tamaño
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.m4a') as tmp_file:
-            content = await file.read()
-            
-            # Verificar tamaño del archivo
-            if len(content) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=413, 
-                    detail=f"Archivo demasiado grande. Tamaño máximo permitido: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
-                )
-            
-            tmp_file.write(content)
-            input_file_path = tmp_file.name
-            temp_files.append(input_file_path)
-        
-        logger.info(f"Archivo recibido: {file.filename}, tamaño: {len(content)} bytes ({len(content) / (1024*1024):.1f}MB)")
-        
-        # Dividir audio en segmentos de 5 minutos
-        logger.info("🔄 Paso 1/3: Dividiendo audio en segmentos de 5 minutos...")
-        segment_paths = split_audio(input_file_path, segment_duration=300)
-        temp_files.extend(segment_paths)
-        logger.info(f"✅ Audio dividido en {len(segment_paths)} segmentos")
-        
-        # Transcribir cada segmento
-        logger.info("🎤 Paso 2/3: Iniciando transcripción con Whisper...")
-        logger.info(f"   ⏱️  Tiempo estimado: {len(segment_paths) * 30} segundos aprox.")
-        full_transcription = transcribe_audio_segments(segment_paths)
-        
-        logger.info(f"✅ Transcripción completada: {len(full_transcription)} caracteres")
-        logger.info("🤖 Paso 3/3: Enviando a OpenAI para procesamiento...")
-        
-        # Procesar con OpenAI Chat
+
+    def __init__(self, default_model: str, allowed_models: List[str], memory_budget: int):
+        self.default_model = default_model
+        self.allowed_models = allowed_models
+        self.memory_budget = memory_budget
+        self._models: "OrderedDict[str, Tuple[object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._inference_locks = {}
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def resolve(self, name: Optional[str] = None) -> str:
+        """Nombre del modelo a usar; 400 si no está en la lista de permitidos"""
+        name = name or self.default_model
+        if name not in self.allowed_models:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Modelo '{name}' no permitido. Modelos disponibles: {', '.join(self.allowed_models)}"
+            )
+        return name
+
+    def _cached(self, name: str):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry:
+                self._models.move_to_end(name)
+                return entry[0]
+            return None
+
+    def get(self, name: Optional[str] = None):
+        """Devuelve el modelo, cargándolo si no está residente"""
+        name = self.resolve(name)
+        model = self._cached(name)
+        if model is not None:
+            return model
+        
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        # Un solo hilo carga cada modelo; los demás esperan y reutilizan el resultado
+        with load_lock:
+            model = self._cached(name)
+            if model is None:
+                model = load_model_with_fallback(name) if name == self.default_model else load_whisper(name)
+                self.register(name, model)
+        return model
+
+    def inference_lock(self, name: Optional[str] = None) -> threading.Lock:
+        """
+        Cerrojo de inferencia de un modelo: whisper instala hooks de caché KV en los módulos del
+        decoder en cada decodificación, así que dos hilos no pueden usar el mismo modelo a la vez
+        """
+        name = self.resolve(name)
+        with self._lock:
+            return self._inference_locks.setdefault(name, threading.Lock())
+
+    def register(self, name: str, model):
+        """Añade un modelo ya cargado como el más reciente y expulsa otros si hace falta"""
+        size = model_memory_bytes(model)
+        with self._lock:
+            self._models[name] = (model, size)
+            self._models.move_to_end(name)
+            while self.memory_budget and self.resident_bytes > self.memory_budget and len(self._models) > 1:
+                evicted, (_, evicted_size) = self._models.popitem(last=False)
+                logger.info(f"♻️  Modelo '{evicted}' descargado de memoria ({evicted_size / (1024*1024):.0f}MB)")
+        logger.info(f"Modelo '{name}' residente ({size / (1024*1024):.0f}MB)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            resident = [
+                {"name": name, "memory_mb": round(size / (1024*1024), 1)}
+                for name, (_, size) in reversed(self._models.items())
+            ]
+            total = self.resident_bytes
+        return {
+            "default": self.default_model,
+            "allowed": self.allowed_models,
+            "memory_budget_mb": round(self.memory_budget / (1024*1024), 1) if self.memory_budget else None,
+            "resident_memory_mb": round(total / (1024*1024), 1),
+            "resident": resident
+        }
+
+# Modelos Whisper de este proceso (en modo paralelo, cada worker tiene su propio registro)
+model_registry = ModelRegistry(WHISPER_MODEL, WHISPER_MODELS, MODEL_MEMORY_BUDGET)
+
+class BatchScheduler:
+    """
+    Agrupa las ventanas de audio pendientes de todas las peticiones y segmentos en curso
+    y las decodifica juntas (encoder y decoder en lote). Un hilo propio forma lotes de hasta
+    max_batch_size ventanas, esperando como mucho max_wait_ms desde la primera,
+    y entrega cada resultado en el futuro de su ventana
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: int):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[Tuple[str, Optional[str], np.ndarray, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, model_name: str, window: np.ndarray, language: str = None) -> Future:
+        future = Future()
+        self._queue.put((model_name, language, window, future))
+        return future
+
+    def shutdown(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            # Solo se decodifican juntas las ventanas del mismo modelo e idioma
+            # (sin idioma, whisper.decode lo detecta en cada ventana)
+            groups = {}
+            for model_name, language, window, future in batch:
+                groups.setdefault((model_name, language), []).append((window, future))
+            for (model_name, language), items in groups.items():
+                self._decode(model_name, language, items)
+            if stop:
+                return
+
+    def _decode(self, model_name: str, language: Optional[str], items: List[Tuple[np.ndarray, Future]]):
+        try:
+            import torch
+            import whisper
+            model = model_registry.get(model_name)
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(window), model.dims.n_mels)
+                for window, _ in items
+            ]).to(model.device)
+            # La detección de idioma usa el mismo modelo desde el pool de inferencia
+            with model_registry.inference_lock(model_name):
+                started = time.perf_counter()
+                results = whisper.decode(model, mels, whisper.DecodingOptions(task="transcribe", language=language, fp16=False))
+            BATCH_SIZE.observe(len(items))
+            logger.info(f"Lote de {len(items)} ventanas decodificado en {time.perf_counter() - started:.2f}s")
+            
+            tokenizer = whisper.tokenizer.get_tokenizer(
+                model.is_multilingual, num_languages=model.num_languages, task="transcribe"
+            )
+            for (window, future), result in zip(items, results):
+                future.set_result(window_result(result, tokenizer, len(window) / SAMPLE_RATE))
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+def window_result(result, tokenizer, window_seconds: float) -> dict:
+    """
+    Convierte un DecodingResult en texto y tramos (inicio, fin, texto) relativos a la ventana,
+    a partir de los tokens de marca de tiempo. Las ventanas sin voz devuelven texto vacío,
+    con los mismos umbrales que whisper.transcribe
+    """
+    if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+        return {"text": "", "segments": []}
+    
+    segments, start, text_tokens = [], 0.0, []
+    for token in result.tokens:
+        if token >= tokenizer.timestamp_begin:
+            t = (token - tokenizer.timestamp_begin) * 0.02
+            if text_tokens:
+                segments.append((start, min(t, window_seconds), tokenizer.decode(text_tokens).strip()))
+                text_tokens = []
+            start = t
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((start, window_seconds, tokenizer.decode(text_tokens).strip()))
+    
+    return {"text": result.text.strip(), "segments": [s for s in segments if s[2]]}
+
+batch_scheduler: Optional[BatchScheduler] = BatchScheduler(BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS) if WHISPER_BATCHING else None
+
+# Pool de procesos para transcribir segmentos en paralelo (solo si WHISPER_WORKERS > 1)
+segment_process_pool: Optional[ProcessPoolExecutor] = None
+segment_pool_lock = threading.Lock()
+
+def configure_torch_threads(intra_op_threads: int = None):
+    """Fija los hilos de torch: intra-op (dentro de cada operación) e inter-op (entre operaciones)"""
+    import torch
+    torch.set_num_threads(intra_op_threads or TORCH_THREADS_PER_WORKER)
+    if TORCH_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError as e:
+            # Solo puede fijarse antes de que torch ejecute trabajo en paralelo
+            logger.warning(f"No se pudieron fijar los hilos inter-op de torch: {e}")
+
+def quantize_model(model):
+    """
+    Cuantización dinámica int8 de las capas lineales: pesos en int8 y activaciones
+    cuantizadas al vuelo. Whisper usa su propia subclase de nn.Linear y quantize_dynamic
+    solo reconoce el tipo exacto, así que antes se convierten a nn.Linear
+    (la subclase solo añade conversiones de dtype que en CPU con fp32 no hacen falta)
+    """
+    import torch
+    import whisper.model
+    for module in model.modules():
+        if isinstance(module, whisper.model.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def load_whisper(model_name: str, quantization: str = None):
+    """Importa whisper (y con él torch) solo cuando hace falta cargar un modelo"""
+    import whisper
+    if (quantization or WHISPER_QUANTIZATION) == "int8":
+        # La cuantización dinámica solo está disponible en CPU
+        return quantize_model(whisper.load_model(model_name, device="cpu"))
+    return whisper.load_model(model_name)
+
+def load_model_with_fallback(model_name: str):
+    """Carga el modelo Whisper indicado; si falla, usa 'small' como respaldo"""
+    logger.info(f"Cargando modelo Whisper: {model_name}")
+    try:
+        model = load_whisper(model_name)
+        logger.info(f"Modelo Whisper '{model_name}' cargado exitosamente")
+    except Exception as e:
+        logger.error(f"Error cargando modelo Whisper '{model_name}': {e}")
+        logger.info("Intentando cargar modelo 'small' como respaldo...")
+        model = load_whisper("small")
+        logger.info("Modelo Whisper 'small' cargado como respaldo")
+    return model
+
+def warm_up_model(model):
+    """Inferencia sobre un clip sintético corto para que la primera petición no pague la inicialización"""
+    t = np.arange(WARMUP_CLIP_SECONDS * SAMPLE_RATE) / SAMPLE_RATE
+    model.transcribe((0.1 * np.sin(2 * np.pi * 440 * t)).astype(np.float32))
+
+def _init_segment_worker(model_name: str, torch_threads: int):
+    """Inicializador de cada proceso worker: fija los hilos de torch, carga el modelo por defecto y lo calienta"""
+    configure_torch_threads(torch_threads)
+    warm_up_model(model_registry.get(model_name))
+
+def _warm_segment_worker() -> int:
+    return os.getpid()
+
+def transcription_available() -> bool:
+    """Indica si hay un modelo en este proceso o un pool de workers para transcribir"""
+    return segment_process_pool is not None or len(model_registry) > 0
+
+# Tareas en segundo plano (carga del modelo, workers de trabajos y limpieza)
+background_tasks: List[asyncio.Task] = []
+job_wakeup = asyncio.Event()
+
+# Estado del arranque: fase actual y duración en segundos de cada fase completada
+startup_status = {"ready": False, "phase": "starting", "error": None, "phases": {}}
+model_ready = asyncio.Event()
+
+def start_segment_process_pool(broken_pool: Optional[ProcessPoolExecutor] = None) -> list:
+    """
+    Crea el pool de workers de transcripción. Si se indica broken_pool, solo lo reemplaza
+    cuando sigue siendo el pool activo (otro hilo puede haberlo reiniciado ya).
+    Devuelve futuros que terminan cuando los workers han cargado y calentado el modelo
+    """
+    global segment_process_pool
+    with segment_pool_lock:
+        if broken_pool is not None and segment_process_pool is not broken_pool:
+            return []
+        if broken_pool is not None:
+            logger.warning("Pool de workers de transcripción roto; reiniciándolo")
+            broken_pool.shutdown(wait=False, cancel_futures=True)
+        
+        logger.info(f"Iniciando {WHISPER_WORKERS} workers de transcripción...")
+        pool = ProcessPoolExecutor(
+            max_workers=WHISPER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_segment_worker,
+            initargs=(WHISPER_MODEL, TORCH_THREADS_PER_WORKER)
+        )
+        # Arrancar todos los workers ya para que carguen el modelo antes de la primera petición
+        warm_futures = [pool.submit(_warm_segment_worker) for _ in range(WHISPER_WORKERS)]
+        segment_process_pool = pool
+        return warm_futures
+
+def prepare_model():
+    """
+    Deja el servicio listo para transcribir registrando la duración de cada fase:
+    importación de whisper/torch, carga del modelo por defecto y calentamiento
+    """
+    def run_phase(phase: str, func):
+        startup_status["phase"] = phase
+        started = time.perf_counter()
+        result = func()
+        startup_status["phases"][phase] = round(time.perf_counter() - started, 3)
+        logger.info(f"⏱️  Arranque: fase '{phase}' completada en {startup_status['phases'][phase]}s")
+        return result
+    
+    if WHISPER_WORKERS > 1:
+        # Cada worker importa, carga y calienta su propio modelo; el proceso principal no necesita torch
+        run_phase("workers", lambda: [f.result() for f in start_segment_process_pool()])
+    else:
+        # El modelo por defecto se carga al arrancar; el resto, en la primera petición que lo use
+        def import_whisper():
+            import whisper  # noqa: F401 (importa torch)
+            configure_torch_threads()
+        
+        run_phase("import", import_whisper)
+        model = run_phase("model_load", lambda: model_registry.get(WHISPER_MODEL))
+        run_phase("warmup", lambda: warm_up_model(model))
+
+@app.on_event("startup")
+async def load_whisper_model():
+    """
+    Carga el modelo en segundo plano: el servidor acepta conexiones (y /health/live responde)
+    de inmediato, y /health/ready pasa a 200 cuando el modelo está cargado y caliente
+    """
+    startup_status["phases"]["server_start"] = round(time.time() - PROCESS_STARTED_AT, 3)
+    if not INFERENCE_ENABLED:
+        # Solo API: sin modelo que cargar, listo para encolar trabajos y servir resultados
+        startup_status.update(ready=True, phase="ready")
+        logger.info("✅ Servicio listo (INFERENCE_ENABLED=false: los trabajos los ejecutan los workers)")
+        return
+    
+    async def load():
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, prepare_model)
+        except Exception as e:
+            startup_status.update(phase="failed", error=str(e))
+            logger.error(f"❌ Error preparando el modelo Whisper: {e}")
+            return
+        
+        startup_status["phases"]["total_since_process_start"] = round(time.time() - PROCESS_STARTED_AT, 3)
+        startup_status.update(ready=True, phase="ready")
+        model_ready.set()
+        logger.info(f"✅ Servicio listo en {startup_status['phases']['total_since_process_start']}s desde el arranque")
+    
+    background_tasks.append(asyncio.create_task(load()))
+
+@app.on_event("startup")
+async def start_job_workers():
+    os.makedirs(JOB_UPLOADS_DIR, exist_ok=True)
+    requeued = job_store.requeue_interrupted()
+    if requeued:
+        logger.info(f"{requeued} trabajos interrumpidos devueltos a la cola")
+    
+    for worker_id in range(JOB_WORKERS):
+        background_tasks.append(asyncio.create_task(job_worker(worker_id)))
+    background_tasks.append(asyncio.create_task(job_janitor()))
+    background_tasks.append(asyncio.create_task(scratch_janitor()))
+    if SPOOL_DIR:
+        background_tasks.append(asyncio.create_task(job_charge_settler()))
+    
+    if SPOOL_DIR:
+        logger.info(f"📂 Trabajos en el spool {SPOOL_DIR} (lease de {SPOOL_LEASE_SECONDS}s), compartido con worker.py")
+    if not JOB_WORKERS:
+        logger.warning("JOB_WORKERS=0: los trabajos se encolarán pero este proceso no los ejecutará")
+
+@app.on_event("shutdown")
+async def shutdown_inference_pool():
+    for task in background_tasks:
+        task.cancel()
+    inference_pool.shutdown()
+    if batch_scheduler is not None:
+        batch_scheduler.shutdown()
+    if segment_process_pool is not None:
+        segment_process_pool.shutdown(wait=False, cancel_futures=True)
+    if openai_client is not None:
+        await openai_client.aclose()
+
+class AudioDecodeError(RuntimeError):
+    """ffmpeg no pudo decodificar la entrada: el archivo no es audio válido"""
+
+def ffmpeg_error(stderr: str, path: str) -> str:
+    """Mensaje de ffmpeg o ffprobe sin la ruta del archivo en el servidor, que no se expone al cliente"""
+    message = stderr.strip().replace(f"{path}: ", "").replace(path, os.path.basename(path))
+    return message or "formato no reconocido"
+
+def decode_audio(audio_path: str) -> np.ndarray:
+    """
+    Decodifica el archivo una sola vez con ffmpeg a PCM mono float32 a 16 kHz,
+    el formato que Whisper usa internamente
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", audio_path,
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-loglevel", "error", "-"
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        stderr = ffmpeg_error(e.stderr.decode(errors='ignore'), audio_path)
+        raise AudioDecodeError(f"ffmpeg no pudo decodificar el audio: {stderr}") from e
+    
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+class AudioChunk(NamedTuple):
+    """
+    Fragmento de audio listo para Whisper y su correspondencia con el audio original.
+    pieces son los intervalos (inicio, fin) en muestras del original que se concatenaron
+    """
+    audio: np.ndarray
+    pieces: Tuple[Tuple[int, int], ...]
+
+    @property
+    def start(self) -> float:
+        return self.pieces[0][0] / SAMPLE_RATE
+
+    @property
+    def end(self) -> float:
+        return self.pieces[-1][1] / SAMPLE_RATE
+
+    def to_original_time(self, t: float) -> float:
+        """Convierte un instante relativo al fragmento (segundos) a tiempo del audio original"""
+        offset = int(round(t * SAMPLE_RATE))
+        for start, end in self.pieces:
+            if offset <= end - start:
+                return (start + offset) / SAMPLE_RATE
+            offset -= end - start
+        return self.end
+
+def make_chunk(audio: np.ndarray, pieces: List[Tuple[int, int]]) -> AudioChunk:
+    """Crea un fragmento; con un único intervalo el audio es una vista sin copia"""
+    pieces = tuple((int(start), int(end)) for start, end in pieces)
+    if len(pieces) == 1:
+        start, end = pieces[0]
+        return AudioChunk(audio[start:end], pieces)
+    return AudioChunk(np.concatenate([audio[start:end] for start, end in pieces]), pieces)
+
+def frame_energy_db(audio: np.ndarray) -> np.ndarray:
+    """Energía en dBFS de cada trama de VAD_FRAME_SECONDS"""
+    frame = int(VAD_FRAME_SECONDS * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    # einsum evita materializar frames**2 (una copia completa del audio)
+    power = np.einsum("ij,ij->i", frames, frames) / frame
+    return 10 * np.log10(power + 1e-10)
+
+def find_speech_regions(energy_db: np.ndarray, total_samples: int) -> List[Tuple[int, int]]:
+    """
+    Devuelve los intervalos (en muestras) que quedan al eliminar los silencios
+    de al menos MIN_SILENCE_TO_DROP segundos, conservando SPEECH_PADDING alrededor de la voz
+    """
+    frame = int(VAD_FRAME_SECONDS * SAMPLE_RATE)
+    padding = int(SPEECH_PADDING / VAD_FRAME_SECONDS)
+    min_drop = int(MIN_SILENCE_TO_DROP / VAD_FRAME_SECONDS)
+    
+    silent = np.concatenate(([False], energy_db <= SILENCE_THRESHOLD_DB, [False]))
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    silent_runs = edges.reshape(-1, 2)  # [inicio, fin) en tramas
+    
+    regions = []
+    cursor = 0
+    n_frames = len(energy_db)
+    for run_start, run_end in silent_runs:
+        if run_end - run_start < min_drop:
+            continue
+        drop_start = run_start + padding if run_start > 0 else 0
+        drop_end = run_end - padding if run_end < n_frames else n_frames
+        if drop_end <= drop_start:
+            # Con MIN_SILENCE_TO_DROP < 2 * SPEECH_PADDING los márgenes se solapan: no hay nada que quitar
+            continue
+        if drop_start > cursor:
+            regions.append((cursor * frame, drop_start * frame))
+        cursor = drop_end
+    
+    if cursor < n_frames:
+        regions.append((cursor * frame, total_samples))
+    
+    return regions
+
+def find_cut_point(energy_db: np.ndarray, start: int, target_end: int) -> int:
+    """
+    Busca la trama más silenciosa (energía suavizada) en la ventana previa a target_end
+    y devuelve la posición de corte en muestras
+    """
+    frame = int(VAD_FRAME_SECONDS * SAMPLE_RATE)
+    search = int(min(CUT_SEARCH_SECONDS, (target_end - start) / SAMPLE_RATE / 4) * SAMPLE_RATE)
+    lo = max(start + 1, target_end - search) // frame
+    hi = target_end // frame
+    if hi <= lo or hi > len(energy_db):
+        return target_end
+    
+    # Suavizar ~0.3 s para preferir pausas y no un único valle entre sílabas
+    window = energy_db[lo:hi]
+    k = max(1, int(0.3 / VAD_FRAME_SECONDS))
+    smoothed = np.convolve(window, np.ones(k) / k, mode="same")
+    return (lo + int(np.argmin(smoothed))) * frame
+
+def split_on_silence(audio: np.ndarray, segment_duration: int) -> List[AudioChunk]:
+    """
+    Agrupa las regiones con voz en fragmentos de hasta segment_duration segundos, cortando
+    en pausas cercanas al objetivo y descartando los silencios largos
+    """
+    target = segment_duration * SAMPLE_RATE
+    energy_db = frame_energy_db(audio)
+    regions = find_speech_regions(energy_db, len(audio))
+    
+    chunks = []
+    pieces, length = [], 0
+    for start, end in regions:
+        while start < end:
+            room = target - length
+            if end - start <= room:
+                pieces.append((start, end))
+                length += end - start
+                break
+            if pieces:
+                # La región no cabe en el fragmento actual: cerrarlo y empezar uno nuevo
+                chunks.append(make_chunk(audio, pieces))
+                pieces, length = [], 0
+                continue
+            # Región más larga que el objetivo: cortar en la pausa más cercana al límite
+            cut = find_cut_point(energy_db, start, start + target)
+            chunks.append(make_chunk(audio, [(start, cut)]))
+            start = cut
+    
+    if pieces:
+        chunks.append(make_chunk(audio, pieces))
+    
+    return chunks
+
+def segment_audio(audio: np.ndarray, segment_duration: int, mode: str) -> List[AudioChunk]:
+    """Divide audio ya decodificado según el modo de segmentación ("silence" o "fixed")"""
+    if mode == "silence":
+        return split_on_silence(audio, segment_duration)
+    
+    samples_per_segment = segment_duration * SAMPLE_RATE
+    return [
+        make_chunk(audio, [(i, min(i + samples_per_segment, len(audio)))])
+        for i in range(0, len(audio), samples_per_segment)
+    ]
+
+def split_audio(audio_path: str, segment_duration: int = None, mode: str = None) -> List[AudioChunk]:
+    """
+    Divide un archivo de audio en segmentos de duración específica (en segundos)
+    Por defecto SEGMENT_DURATION (300 segundos = 5 minutos) y SEGMENTATION_MODE:
+    - "silence": corta en pausas cerca de la duración objetivo y descarta silencios largos
+    - "fixed": corta cada segment_duration segundos exactos
+    Los segmentos son vistas sobre el buffer decodificado: no se escriben a disco
+    """
+    segment_duration = segment_duration or SEGMENT_DURATION
+    mode = mode or SEGMENTATION_MODE
+    
+    try:
+        audio = decode_audio(audio_path)
+        segments = segment_audio(audio, segment_duration, mode)
+        
+        kept = sum(len(segment.audio) for segment in segments) / SAMPLE_RATE
+        logger.info(
+            f"Audio decodificado: {len(audio) / SAMPLE_RATE:.1f}s en {len(segments)} segmentos "
+            f"({kept:.1f}s a transcribir, modo '{mode}')"
+        )
+        
+        return segments
+        
+    except AudioDecodeError as e:
+        logger.error(f"Error dividiendo audio: {e}")
+        raise HTTPException(status_code=400, detail=f"Error procesando archivo de audio: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error dividiendo audio: {e}")
+        raise HTTPException(status_code=500, detail=f"Error procesando archivo de audio: {str(e)}")
+
+def mp4_moov_before_mdat(header: bytes) -> Optional[bool]:
+    """
+    Recorre las cajas de primer nivel de un MP4/M4A: True si 'moov' (el índice) llega antes
+    que 'mdat' (los datos), lo que permite decodificar mientras se recibe; False si no;
+    None si aún faltan bytes para saberlo
+    """
+    offset = 0
+    while offset + 8 <= len(header):
+        size = int.from_bytes(header[offset:offset + 4], "big")
+        box = header[offset + 4:offset + 8]
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1:
+            # Tamaño extendido de 64 bits
+            if offset + 16 > len(header):
+                return None
+            size = int.from_bytes(header[offset + 8:offset + 16], "big")
+        if size < 8:
+            # 0 = caja hasta el final del archivo, o una cabecera inválida
+            return False
+        offset += size
+    return None
+
+def mp4_duration(header: bytes) -> Optional[float]:
+    """
+    Duración en segundos de la caja 'mvhd' del índice ('moov') de un MP4/M4A, leída de sus
+    primeros bytes sin decodificar; None si el índice no está al principio o aún no ha llegado
+    """
+    def boxes(start: int, end: int):
+        offset = start
+        while offset + 8 <= end:
+            size = int.from_bytes(header[offset:offset + 4], "big")
+            box = header[offset + 4:offset + 8]
+            header_size = 8
+            if size == 1:
+                if offset + 16 > end:
+                    return
+                size = int.from_bytes(header[offset + 8:offset + 16], "big")
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+            if size < header_size:
+                return
+            yield box, offset + header_size, offset + size
+            offset += size
+    
+    for box, body, box_end in boxes(0, len(header)):
+        if box == b"mdat":
+            return None
+        if box != b"moov":
+            continue
+        for child, child_body, _ in boxes(body, min(box_end, len(header))):
+            if child != b"mvhd":
+                continue
+            # Versión 1: fechas y duración de 64 bits; versión 0: de 32 bits
+            if header[child_body:child_body + 1] == b"\x01":
+                fields, timescale_at, width = header[child_body:child_body + 32], 20, 8
+            else:
+                fields, timescale_at, width = header[child_body:child_body + 20], 12, 4
+            if len(fields) < timescale_at + 4 + width:
+                return None
+            timescale = int.from_bytes(fields[timescale_at:timescale_at + 4], "big")
+            duration = int.from_bytes(fields[timescale_at + 4:timescale_at + 4 + width], "big")
+            if not timescale or duration == (1 << (8 * width)) - 1:
+                return None  # duración desconocida
+            return duration / timescale
+        return None
+    return None
+
+class StreamingSegmenter:
+    """
+    Corta en segmentos el audio a medida que sale del decodificador, con la misma lógica que
+    split_audio sobre el archivo completo. Solo se emiten los segmentos que ya no pueden
+    cambiar (todos menos el último); el resto del audio espera a que llegue más.
+    El audio pendiente vive en un búfer float32 reservado una vez y reutilizado en cada corte,
+    y cada segmento emitido se copia a su propio array: la memoria no depende de la duración y
+    el asignador no se fragmenta con búferes de tamaños distintos en cada corte
+    """
+
+    def __init__(self, segment_duration: int, mode: str):
+        self.segment_duration = segment_duration
+        self.mode = mode
+        self._buffer = np.empty(2 * segment_duration * SAMPLE_RATE, dtype=np.float32)
+        self._length = 0  # muestras válidas al principio del búfer
+        self._partial = b""  # bytes de una muestra que llegó incompleta
+        self._offset = 0  # muestra del audio original donde empieza el búfer
+        self._next_cut = int(1.5 * segment_duration * SAMPLE_RATE)  # muestras a partir de las que intentar cortar
+
+    @property
+    def ready(self) -> bool:
+        return self._length >= self._next_cut
+
+    def append(self, data: bytes):
+        if self._partial:
+            data = self._partial + data
+        usable = len(data) - len(data) % 4
+        self._partial = data[usable:]
+        samples = np.frombuffer(data, dtype=np.float32, count=usable // 4)
+        
+        end = self._length + len(samples)
+        if end > len(self._buffer):
+            # Bloques más grandes de lo previsto: ampliar el búfer (no ocurre en el flujo normal)
+            grown = np.empty(max(end, 2 * len(self._buffer)), dtype=np.float32)
+            grown[:self._length] = self._buffer[:self._length]
+            self._buffer = grown
+        self._buffer[self._length:end] = samples
+        self._length = end
+
+    def cut(self, final: bool = False) -> List[AudioChunk]:
+        audio = self._buffer[:self._length]
+        chunks = segment_audio(audio, self.segment_duration, self.mode)
+        
+        if final or not chunks:
+            keep_from = self._length  # todo emitido, o solo silencio que se descarta
+        else:
+            keep_from = chunks[-1].pieces[0][0]
+            chunks = chunks[:-1]
+        
+        # Los segmentos de un único intervalo son vistas sobre el búfer: copiarlos antes de reutilizarlo
+        emitted = [
+            AudioChunk(
+                chunk.audio if chunk.audio.base is None else chunk.audio.copy(),
+                tuple((start + self._offset, end + self._offset) for start, end in chunk.pieces)
+            )
+            for chunk in chunks
+        ]
+        remaining = self._length - keep_from
+        self._buffer[:remaining] = self._buffer[keep_from:self._length]
+        self._length = remaining
+        self._offset += keep_from
+        self._next_cut = remaining + int(0.5 * self.segment_duration * SAMPLE_RATE)
+        return emitted
+
+class MultipartFileReader:
+    """
+    Extrae los archivos del campo field de un cuerpo multipart/form-data a medida que llega,
+    sin esperar al final de la petición. Con multiple=False solo cuenta el primer archivo;
+    los campos de texto se guardan en fields
+    """
+
+    def __init__(self, content_type: str, field: str = "file", multiple: bool = False):
+        mime, params = parse_options_header(content_type)
+        if mime != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail=f"Se esperaba multipart/form-data con el campo '{field}'")
+        
+        self.field = field.encode()
+        self.multiple = multiple
+        self.filenames: List[str] = []
+        self.fields: Dict[str, str] = {}
+        self._in_file = False
+        self._field_name: Optional[str] = None
+        self._field_data = bytearray()
+        self._field_bytes = 0
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._chunks: List[Tuple[int, bytes]] = []
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    @property
+    def filename(self) -> Optional[str]:
+        return self.filenames[0] if self.filenames else None
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Procesa un bloque del cuerpo y devuelve los bytes del archivo que contenía"""
+        return [chunk for _, chunk in self.feed_parts(data)]
+
+    def feed_parts(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """Procesa un bloque del cuerpo y devuelve (índice del archivo, bytes) de los archivos que contenía"""
+        self._parser.write(data)
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"")
+        self._in_file = name == self.field and (self.multiple or not self.filenames)
+        if self._in_file:
+            self.filenames.append(options.get(b"filename", b"").decode("utf-8", errors="replace"))
+        elif b"filename" not in options:
+            self._field_name = name.decode("utf-8", errors="replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._chunks.append((len(self.filenames) - 1, bytes(data[start:end])))
+        elif self._field_name is not None:
+            # Los campos de texto se guardan en memoria: se limitan al margen de MULTIPART_OVERHEAD
+            self._field_bytes += end - start
+            if self._field_bytes > MULTIPART_OVERHEAD:
+                raise HTTPException(status_code=413, detail="Campos del formulario demasiado grandes")
+            self._field_data += data[start:end]
+
+    def _on_part_end(self):
+        if self._field_name is not None:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", errors="replace")
+        self._in_file = False
+        self._field_name = None
+        self._field_data = bytearray()
+
+# Idiomas de whisper 20231117 (whisper.tokenizer.LANGUAGES y sus alias). Se copian aquí para
+# validar el parámetro 'language' sin importar whisper (y torch) en el proceso de la API
+WHISPER_LANGUAGES = {
+    "en": "english", "zh": "chinese", "de": "german", "es": "spanish", "ru": "russian", "ko": "korean",
+    "fr": "french", "ja": "japanese", "pt": "portuguese", "tr": "turkish", "pl": "polish", "ca": "catalan",
+    "nl": "dutch", "ar": "arabic", "sv": "swedish", "it": "italian", "id": "indonesian", "hi": "hindi",
+    "fi": "finnish", "vi": "vietnamese", "he": "hebrew", "uk": "ukrainian", "el": "greek", "ms": "malay",
+    "cs": "czech", "ro": "romanian", "da": "danish", "hu": "hungarian", "ta": "tamil", "no": "norwegian",
+    "th": "thai", "ur": "urdu", "hr": "croatian", "bg": "bulgarian", "lt": "lithuanian", "la": "latin",
+    "mi": "maori", "ml": "malayalam", "cy": "welsh", "sk": "slovak", "te": "telugu", "fa": "persian",
+    "lv": "latvian", "bn": "bengali", "sr": "serbian", "az": "azerbaijani", "sl": "slovenian", "kn": "kannada",
+    "et": "estonian", "mk": "macedonian", "br": "breton", "eu": "basque", "is": "icelandic", "hy": "armenian",
+    "ne": "nepali", "mn": "mongolian", "bs": "bosnian", "kk": "kazakh", "sq": "albanian", "sw": "swahili",
+    "gl": "galician", "mr": "marathi", "pa": "punjabi", "si": "sinhala", "km": "khmer", "sn": "shona",
+    "yo": "yoruba", "so": "somali", "af": "afrikaans", "oc": "occitan", "ka": "georgian", "be": "belarusian",
+    "tg": "tajik", "sd": "sindhi", "gu": "gujarati", "am": "amharic", "yi": "yiddish", "lo": "lao",
+    "uz": "uzbek", "fo": "faroese", "ht": "haitian creole", "ps": "pashto", "tk": "turkmen", "nn": "nynorsk",
+    "mt": "maltese", "sa": "sanskrit", "lb": "luxembourgish", "my": "myanmar", "bo": "tibetan", "tl": "tagalog",
+    "mg": "malagasy", "as": "assamese", "tt": "tatar", "haw": "hawaiian", "ln": "lingala", "ha": "hausa",
+    "ba": "bashkir", "jw": "javanese", "su": "sundanese", "yue": "cantonese",
+}
+WHISPER_LANGUAGE_CODES = {
+    **{name: code for code, name in WHISPER_LANGUAGES.items()},
+    "burmese": "my", "valencian": "ca", "flemish": "nl", "haitian": "ht", "letzeburgesch": "lb",
+    "pushto": "ps", "panjabi": "pa", "moldavian": "ro", "moldovan": "ro", "sinhalese": "si",
+    "castilian": "es", "mandarin": "zh",
+}
+
+def resolve_language(language: Optional[str]) -> Optional[str]:
+    """
+    Código de idioma de Whisper a partir de un código o un nombre ('es', 'spanish'), o
+    WHISPER_LANGUAGE si no se indica; None si hay que detectarlo. 400 si Whisper no lo admite
+    """
+    language = (language or WHISPER_LANGUAGE).strip().lower()
+    if not language:
+        return None
+    
+    if language in WHISPER_LANGUAGES:
+        return language
+    if language in WHISPER_LANGUAGE_CODES:
+        return WHISPER_LANGUAGE_CODES[language]
+    raise HTTPException(status_code=400, detail=f"Idioma no soportado por Whisper: {language}")
+
+def speech_window(audio: np.ndarray) -> Optional[np.ndarray]:
+    """Primera ventana de WINDOW_SECONDS que empieza con voz (por energía); None si todo es silencio"""
+    voiced = np.flatnonzero(frame_energy_db(audio) > SILENCE_THRESHOLD_DB)
+    if not len(voiced):
+        return None
+    start = int(voiced[0] * VAD_FRAME_SECONDS * SAMPLE_RATE)
+    return audio[start:start + WINDOW_SECONDS * SAMPLE_RATE]
+
+def detect_language(model, window: np.ndarray) -> str:
+    """Idioma más probable de una ventana de audio (una sola pasada del encoder)"""
+    if not model.is_multilingual:
+        return "en"
+    import whisper
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(window), model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+def _detect_language_in_worker(window: np.ndarray, model_name: str) -> str:
+    model = model_registry.get(model_name)
+    # Con micro-batching el hilo del planificador decodifica a la vez con el mismo modelo
+    with model_registry.inference_lock(model_name):
+        return detect_language(model, window)
+
+def detect_segments_language(segments: List[AudioChunk], model_name: str) -> Optional[str]:
+    """
+    Idioma de un archivo, detectado una sola vez en el primer segmento con voz (en un worker
+    si los hay). None si no hay voz o la detección falla: Whisper lo detectará en cada segmento
+    """
+    try:
+        for segment in segments:
+            window = speech_window(segment.audio)
+            if window is None:
+                continue
+            
+            started = time.perf_counter()
+            pool = segment_process_pool
+            if pool is not None:
+                language = pool.submit(_detect_language_in_worker, window, model_name).result()
+            else:
+                language = _detect_language_in_worker(window, model_name)
+            logger.info(f"🌐 Idioma detectado: {language} ({time.perf_counter() - started:.2f}s)")
+            return language
+    except Exception as e:
+        logger.warning(f"⚠️  No se pudo detectar el idioma, se detectará en cada segmento: {e}")
+    return None
+
+def context_prompt(text: str) -> Optional[str]:
+    """Final del texto de un segmento, cortado en una palabra, como initial_prompt del siguiente"""
+    if not CONTEXT_PROMPT_CHARS or not text:
+        return None
+    tail = text[-CONTEXT_PROMPT_CHARS:]
+    if len(text) > CONTEXT_PROMPT_CHARS and " " in tail:
+        tail = tail.split(" ", 1)[1]
+    return tail.strip() or None
+
+def transcribe_segment(
+    model,
+    segment: AudioChunk,
+    index: int,
+    total: int,
+    language: str = None,
+    initial_prompt: str = None
+) -> dict:
+    """
+    Transcribe un segmento con el modelo dado y devuelve su texto, los tramos de Whisper
+    con tiempos del audio original y el tiempo de inferencia; devuelve texto vacío si falla.
+    Con language se omite la detección de idioma; initial_prompt da contexto del segmento anterior
+    """
+    try:
+        logger.info(f"Transcribiendo segmento {index+1}/{total or '?'}")
+        start = time.perf_counter()
+        result = model.transcribe(segment.audio, language=language, initial_prompt=initial_prompt)
+        elapsed = time.perf_counter() - start
+        
+        # Verificar que el resultado tenga el formato esperado
+        if isinstance(result, dict) and "text" in result:
+            text = result["text"].strip()
+            timed = [
+                {
+                    "start": round(segment.to_original_time(s["start"]), 2),
+                    "end": round(segment.to_original_time(s["end"]), 2),
+                    "text": s["text"].strip()
+                }
+                for s in result.get("segments", [])
+            ]
+            logger.info(f"Segmento {index+1} transcrito: {len(text)} caracteres")
+            return {"text": text, "segments": timed, "inference_seconds": elapsed}
+        
+        logger.warning(f"Formato inesperado en resultado del segmento {index+1}")
+        error = "formato de resultado inesperado"
+            
+    except Exception as e:
+        logger.error(f"Error transcribiendo segmento {index+1}: {e}")
+        error = str(e)
+    
+    return {"text": "", "segments": [], "error": error}  # Texto vacío para mantener orden
+
+def _transcribe_segment_in_worker(
+    segment: AudioChunk,
+    index: int,
+    total: int,
+    model_name: str,
+    language: str = None,
+    initial_prompt: str = None
+) -> dict:
+    """Transcribe con el registro de modelos del proceso actual (punto de entrada de los procesos worker)"""
+    model = model_registry.get(model_name)
+    with model_registry.inference_lock(model_name):
+        return transcribe_segment(model, segment, index, total, language, initial_prompt)
+
+def window_bounds(audio: np.ndarray) -> List[Tuple[int, int]]:
+    """Divide el audio de un segmento en ventanas de hasta WINDOW_SECONDS, cortando en pausas cuando es posible"""
+    window = WINDOW_SECONDS * SAMPLE_RATE
+    energy_db = frame_energy_db(audio)
+    bounds = []
+    start = 0
+    while len(audio) - start > window:
+        cut = find_cut_point(energy_db, start, start + window)
+        if cut <= start:
+            cut = start + window
+        bounds.append((start, cut))
+        start = cut
+    if start < len(audio):
+        bounds.append((start, len(audio)))
+    return bounds
+
+def submit_segment_windows(segment: AudioChunk, model_name: str, language: str = None) -> List[Tuple[int, Future]]:
+    """Encola en el micro-batching las ventanas de un segmento; devuelve (inicio en muestras, futuro) de cada una"""
+    return [
+        (start, batch_scheduler.submit(model_name, segment.audio[start:end], language))
+        for start, end in window_bounds(segment.audio)
+    ]
+
+def collect_segment_windows(segment: AudioChunk, windows: List[Tuple[int, Future]], index: int) -> dict:
+    """
+    Espera los resultados de las ventanas de un segmento y los une en el mismo formato
+    que transcribe_segment; devuelve texto vacío si alguna ventana falla
+    """
+    try:
+        started = time.perf_counter()
+        texts = []
+        timed = []
+        for start, future in windows:
+            result = future.result()
+            offset = start / SAMPLE_RATE
+            texts.append(result["text"])
+            timed.extend(
+                {
+                    "start": round(segment.to_original_time(offset + s), 2),
+                    "end": round(segment.to_original_time(offset + e), 2),
+                    "text": text
+                }
+                for s, e, text in result["segments"]
+            )
+        text = " ".join(t for t in texts if t)
+        logger.info(f"Segmento {index+1} transcrito en lotes ({len(windows)} ventanas): {len(text)} caracteres")
+        # Tiempo esperando a este segmento; las ventanas se decodifican a la vez que las de otros
+        return {"text": text, "segments": timed, "inference_seconds": time.perf_counter() - started}
+    except Exception as e:
+        logger.error(f"Error transcribiendo segmento {index+1}: {e}")
+        return {"text": "", "segments": [], "error": str(e)}
+
+def submit_to_segment_pool(
+    segment: AudioChunk,
+    index: int,
+    total: int,
+    model_name: str,
+    language: str = None
+) -> Tuple[ProcessPoolExecutor, Future]:
+    """Envía un segmento a los workers; devuelve el pool usado (para reiniciarlo si se rompe) y el futuro"""
+    pool = segment_process_pool
+    try:
+        future = pool.submit(_transcribe_segment_in_worker, segment, index, total, model_name, language)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+    return pool, future
+
+def should_retry_segment(result: dict, attempts: int, index: int) -> bool:
+    """Indica si un segmento fallido admite otro intento (hasta SEGMENT_MAX_ATTEMPTS) y lo registra"""
+    if "error" not in result or attempts >= SEGMENT_MAX_ATTEMPTS:
+        return False
+    SEGMENT_RETRIES.inc()
+    logger.warning(f"🔁 Reintentando segmento {index+1} (intento {attempts+1}/{SEGMENT_MAX_ATTEMPTS}): {result['error']}")
+    return True
+
+def segment_checkpoint_key(segment: AudioChunk, model_name: str, language: str = None) -> Optional[str]:
+    """
+    Clave del checkpoint de un segmento: hash de su audio decodificado, sus límites en el audio
+    original y las opciones de transcripción. El contexto del segmento anterior no forma parte de
+    la clave: si cambiara (p. ej. al reintentar un segmento fallido), todos los siguientes se
+    volverían a transcribir. None sin caché
+    """
+    if segment_cache is None:
+        return None
+    audio_hash = hashlib.sha256(segment.audio.tobytes()).hexdigest()
+    return cache_key(audio_hash, segment.pieces, transcription_options(model_name, language))
+
+def load_segment_checkpoint(key: Optional[str]) -> Optional[dict]:
+    """Resultado guardado de un segmento ya transcrito, marcado como 'checkpoint'"""
+    if key is None:
+        return None
+    checkpoint = segment_cache.get(key)
+    if checkpoint is not None:
+        checkpoint["checkpoint"] = True
+    return checkpoint
+
+def save_segment_checkpoint(key: Optional[str], result: dict):
+    """Guarda el resultado de un segmento en cuanto termina; los fallos no se guardan y se repetirán"""
+    if key is not None and "error" not in result and not result.get("checkpoint"):
+        segment_cache.set(key, {"text": result["text"], "segments": result["segments"]})
+
+def record_segment_metrics(segment: AudioChunk, result: dict):
+    """Registra en Prometheus el tiempo de inferencia y el RTF de un segmento, o su fallo"""
+    if "error" in result:
+        FAILED_SEGMENTS.inc()
+        return
+    if result.get("checkpoint"):
+        CHECKPOINTED_SEGMENTS.inc()
+        return
+    
+    audio_seconds = len(segment.audio) / SAMPLE_RATE
+    STAGE_DURATION.labels("segment").observe(result["inference_seconds"])
+    AUDIO_SECONDS_PROCESSED.inc(audio_seconds)
+    if audio_seconds > 0:
+        SEGMENT_REAL_TIME_FACTOR.observe(result["inference_seconds"] / audio_seconds)
+
+def record_segment_span(segment: AudioChunk, index: int, result: dict, timing: Dict[str, float], attempts: int):
+    """
+    Tramo de un segmento en la traza en curso: desde que obtiene turno hasta su resultado, con
+    la espera en la cola justa, el tiempo de inferencia y su RTF (inferencia / duración del audio)
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return
+    audio_seconds = len(segment.audio) / SAMPLE_RATE
+    attributes = {
+        "index": index,
+        "audio_seconds": round(audio_seconds, 3),
+        "wait_seconds": round(timing["started"] - timing["queued"], 3),
+        "attempts": attempts
+    }
+    if "error" in result:
+        attributes["error"] = result["error"]
+    elif result.get("checkpoint"):
+        attributes["checkpoint"] = True
+    else:
+        attributes["inference_seconds"] = round(result["inference_seconds"], 3)
+        if audio_seconds > 0:
+            attributes["real_time_factor"] = round(result["inference_seconds"] / audio_seconds, 3)
+    trace.add("segment", timing["started"], timing["finished"] - timing["started"], **attributes)
+
+def merge_segment_results(results: List[dict]) -> Tuple[str, List[dict]]:
+    """Une en orden los resultados de los segmentos (texto completo y tramos); 500 si todos están vacíos"""
+    # Unir todas las transcripciones en orden, filtrando textos vacíos
+    valid_transcriptions = [r["text"] for r in results if r["text"]]
+    full_transcription = " ".join(valid_transcriptions)
+    
+    if not full_transcription.strip():
+        raise HTTPException(status_code=500, detail="No se pudo transcribir ningún segmento de audio")
+    
+    timed_segments = [timed for r in results for timed in r["segments"]]
+    return full_transcription, timed_segments
+
+def failed_segment_count(results: List[dict]) -> int:
+    """Segmentos que siguieron fallando tras todos los intentos"""
+    return sum("error" in r for r in results)
+
+def cache_transcript(key: Optional[str], full_transcription: str, timed_segments: List[dict], results: List[dict]):
+    """
+    Guarda la transcripción completa en la caché, salvo que falte algún segmento: así una petición
+    repetida no recibe el hueco de la caché, sino que reintenta esos segmentos (el resto sale de checkpoints)
+    """
+    if not transcript_cache or key is None:
+        return
+    failed = failed_segment_count(results)
+    if failed:
+        logger.warning(f"⚠️  {failed}/{len(results)} segmentos fallaron; la transcripción no se guarda en caché")
+        return
+    transcript_cache.set(key, {
+        "raw_transcription": full_transcription,
+        "segments": timed_segments,
+        "segment_texts": [r["text"] for r in results]
+    })
+
+def cleanup_temp_files(file_paths: List[str]):
+    """
+    Limpia archivos temporales
+    """
+    for file_path in file_paths:
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Archivo temporal eliminado: {file_path}")
+        except Exception as e:
+            logger.warning(f"Error eliminando archivo {file_path}: {e}")
+
+# Cliente HTTP compartido (conexiones reutilizadas) para la API de OpenAI
+openai_client: Optional[httpx.AsyncClient] = None
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Códigos de respuesta que justifican reintentar la petición
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Prompt para combinar las respuestas parciales de una transcripción larga
+REDUCE_PROMPT = """
+Las siguientes son respuestas parciales generadas sobre fragmentos consecutivos de una misma transcripción de audio.
+Combínalas en una única respuesta coherente, sin repetir información, siguiendo estas instrucciones originales:
+
+{prompt}
+
+Respuestas parciales:
+"""
+
+def get_openai_client() -> httpx.AsyncClient:
+    global openai_client
+    if openai_client is None:
+        openai_client = httpx.AsyncClient(
+            base_url=OPENAI_BASE_URL,
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            timeout=OPENAI_TIMEOUT,
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONCURRENCY, max_keepalive_connections=OPENAI_MAX_CONCURRENCY)
+        )
+    return openai_client
+
+# Caracteres por token en la estimación: conservadora para español e inglés
+CHARS_PER_TOKEN = 3
+
+def count_tokens(text: str) -> int:
+    """Estimación de los tokens de text por su longitud (sin descargar el tokenizador)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def pack_by_tokens(pieces: List[str], budget: int, separator: str) -> List[str]:
+    """
+    Agrupa piezas consecutivas en bloques de como máximo budget tokens.
+    Una pieza que por sí sola supera el presupuesto se corta por longitud
+    """
+    blocks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if tokens > budget:
+            size = max(1, budget - 1) * CHARS_PER_TOKEN
+            parts = [piece[i:i + size] for i in range(0, len(piece), size)]
+            blocks.extend(pack_by_tokens(parts, budget, separator) if len(parts) > 1 else parts)
+            continue
+        if current and current_tokens + tokens > budget:
+            blocks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        blocks.append(separator.join(current))
+    return blocks
+
+def input_token_budget(prompt: str) -> int:
+    """Tokens disponibles para el texto tras reservar el prompt y la respuesta"""
+    return OPENAI_CONTEXT_TOKENS - OPENAI_MAX_TOKENS - count_tokens(prompt) - 100
+
+async def chat_completion(content: str) -> str:
+    """
+    Llama a /chat/completions con reintentos acotados y backoff exponencial
+    ante errores de red, 429 y 5xx (respetando Retry-After si viene)
+    """
+    client = get_openai_client()
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "user", "content": content}
+        ],
+        "max_tokens": OPENAI_MAX_TOKENS,
+        "temperature": 0.3
+    }
+    
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        last_attempt = attempt == OPENAI_MAX_RETRIES
+        delay = min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+        try:
+            async with openai_semaphore:
+                response = await client.post("/chat/completions", json=payload)
+        except httpx.TransportError as e:
+            if last_attempt:
+                raise
+            logger.warning(f"Error de red con OpenAI ({e}); reintento {attempt+1}/{OPENAI_MAX_RETRIES} en {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        
+        if response.status_code in RETRYABLE_STATUS_CODES and not last_attempt:
+            retry_after = response.headers.get("retry-after")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = min(float(retry_after), 60)
+            logger.warning(f"OpenAI respondió {response.status_code}; reintento {attempt+1}/{OPENAI_MAX_RETRIES} en {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenAI respondió {response.status_code}: {response.text[:500]}")
+        
+        return response.json()["choices"][0]["message"]["content"]
+
+async def map_reduce_chat(text: str, prompt: str) -> str:
+    """
+    Procesa la transcripción con el prompt. Si no cabe en la ventana de contexto se divide
+    en fragmentos que se procesan en paralelo (map) y cuyas respuestas se combinan (reduce)
+    """
+    budget = input_token_budget(prompt)
+    if budget <= 0:
+        raise ValueError("El prompt no deja espacio para la transcripción en la ventana de contexto")
+    
+    # Una transcripción de horas son megabytes de texto: trocearla fuera del event loop
+    sentences = await asyncio.to_thread(re.split, r"(?<=[.!?])\s+", text)
+    chunks = await asyncio.to_thread(pack_by_tokens, sentences, budget, " ")
+    if len(chunks) == 1:
+        return await chat_completion(f"{prompt}\n\n{text}")
+    
+    logger.info(f"Transcripción larga: procesando {len(chunks)} fragmentos con OpenAI en paralelo")
+    partials = await asyncio.gather(*(
+        chat_completion(f"{prompt}\n\n(Fragmento {i+1} de {len(chunks)} de una transcripción más larga)\n\n{chunk}")
+        for i, chunk in enumerate(chunks)
+    ))
+    
+    # Combinar las respuestas parciales, por niveles si no caben en una sola petición
+    reduce_prompt = REDUCE_PROMPT.format(prompt=prompt.strip())
+    reduce_budget = input_token_budget(reduce_prompt)
+    while True:
+        groups = await asyncio.to_thread(pack_by_tokens, list(partials), reduce_budget, "\n\n---\n\n")
+        if len(groups) > 1 and len(groups) >= len(partials):
+            raise ValueError("Las respuestas parciales no caben en la ventana de contexto para combinarlas")
+        partials = await asyncio.gather(*(chat_completion(f"{reduce_prompt}\n{group}") for group in groups))
+        if len(partials) == 1:
+            return partials[0]
+
+async def process_with_openai_chat(text: str, custom_prompt: str = None) -> str:
+    """
+    Procesa el texto transcrito con OpenAI Chat
+    """
+    if not OPENAI_API_KEY:
+        return "OpenAI API Key no configurada. Transcripción completada sin procesamiento adicional."
+    
+    # Prompt por defecto si no se especifica uno personalizado
+    default_prompt = """
+    Eres un asistente experto en análisis de texto. Tu tarea es procesar la siguiente transcripción de audio:
+    
+    1. Corrige errores gramaticales y de puntuación
+    2. Estructura el texto de manera coherente
+    3. Identifica los puntos principales y temas tratados
+    4. Proporciona un resumen ejecutivo al final
+    
+    Transcripción a procesar:
+    """
+    
+    prompt = custom_prompt if custom_prompt else default_prompt
+    
+    key = cache_key(hashlib.sha256(text.encode("utf-8")).hexdigest(), prompt, OPENAI_MODEL)
+    cached = await asyncio.to_thread(chat_cache.get, key) if chat_cache else None
+    if cached:
+        logger.info("💾 Respuesta de OpenAI obtenida de la caché")
+        return cached["content"]
+    
+    try:
+        content = await map_reduce_chat(text, prompt)
+        if chat_cache:
+            await asyncio.to_thread(chat_cache.set, key, {"content": content})
+        return content
+    except Exception as e:
+        logger.error(f"Error procesando con OpenAI: {e}")
+        return f"Error procesando con OpenAI: {str(e)}. Transcripción original: {text}"
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(content=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+@app.get("/")
+async def root():
+    return {"message": "AudioTrans API - Servicio de transcripción de audio"}
+
+@app.get("/health/live")
+async def liveness():
+    """Sonda de vida: responde en cuanto el proceso atiende peticiones, sin depender del modelo"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Sonda de disponibilidad: 200 solo cuando el modelo está cargado y calentado, 503 mientras tanto"""
+    return JSONResponse(
+        status_code=200 if startup_status["ready"] else 503,
+        content={"status": "ready" if startup_status["ready"] else "not_ready", **startup_status}
+    )
+
+def blocking_health_stats() -> dict:
+    """Partes de /health que leen disco o esperan cerrojos de otros hilos (SQLite, spool, cachés, modelos)"""
+    models = model_registry.stats()
+    if segment_process_pool is not None:
+        # Cada worker de WHISPER_WORKERS carga sus modelos en su registro: el de este proceso está vacío
+        del models["resident"], models["resident_memory_mb"]
+        models["resident_in_workers"] = WHISPER_WORKERS
+    return {
+        "models": models,
+        "jobs": {
+            "store": "spool" if SPOOL_DIR else "sqlite",
+            "inference_enabled": INFERENCE_ENABLED,
+            "workers_in_process": JOB_WORKERS,
+            "queued": job_store.count("queued"),
+            "running": job_store.count("running")
+        },
+        "cache": {
+            "transcripts": transcript_cache.stats() if transcript_cache else None,
+            "segments": segment_cache.stats() if segment_cache else None,
+            "chat": chat_cache.stats() if chat_cache else None
+        }
+    }
+
+@app.get("/health")
+async def health_check():
+    # Fuera del event loop: bajo carga no debe frenar al resto de peticiones
+    stats = await asyncio.to_thread(blocking_health_stats)
+    return {
+        "status": "healthy", 
+        "ready": startup_status["ready"],
+        "startup": startup_status,
+        "whisper_model_loaded": transcription_available(),
+        "whisper_model": WHISPER_MODEL,
+        "whisper_workers": WHISPER_WORKERS,
+        "models": stats["models"],
+        "max_file_size_mb": round(MAX_FILE_SIZE / (1024*1024), 1),
+        "api_key_configured": bool(api_clients),
+        "admission": {
+            "api_keys": len(api_clients),
+            "quota_window_seconds": QUOTA_WINDOW_SECONDS,
+            "segment_concurrency": SEGMENT_CONCURRENCY,
+            "segments_running": segment_fair_queue.active,
+            "segments_waiting": segment_fair_queue.waiting
+        },
+        "jobs": stats["jobs"],
+        "openai_key_configured": bool(OPENAI_API_KEY),
+        "cache": stats["cache"],
+        "inference_pool": {
+            "max_concurrent_jobs": inference_pool.max_workers,
+            "max_queued_jobs": inference_pool.max_queue,
+            "running": inference_pool.running,
+            "queued": inference_pool.queued
+        },
+        "scratch": scratch_space.stats()
+    }
+
+async def save_upload(file: UploadFile, destination_path: str) -> int:
+    """
+    Guarda el archivo subido en destination_path en bloques de UPLOAD_CHUNK_SIZE,
+    verificando el tamaño máximo a medida que se escribe. Devuelve el número de bytes escritos
+    """
+    size = 0
+    
+    with STAGE_DURATION.labels("upload").time(), trace_span("upload") as span, open(destination_path, "wb") as f:
+        span["filename"] = file.filename
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            # Verificar tamaño del archivo
+            size += len(chunk)
+            BYTES_RECEIVED.inc(len(chunk))
+            if size > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413, 
+                    detail=f"Archivo demasiado grande. Tamaño máximo permitido: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+                )
+            
+            f.write(chunk)
+        span["bytes"] = size
+    
+    logger.info(f"Archivo recibido: {file.filename}, tamaño: {size} bytes ({size / (1024*1024):.1f}MB)")
+    return size
+
+async def run_transcription_pipeline(
+    input_file_path: str,
+    original_filename: str,
+    custom_prompt: str = None,
+    on_segment: Optional[Callable[[int, int, str], None]] = None,
+    model_name: Optional[str] = None,
+    audio_hash: Optional[str] = None,
+    language: Optional[str] = None,
+    client: Optional[ApiClient] = None,
+    charge: Optional[list] = None
+) -> dict:
+    """
+    Ejecuta el pipeline completo (división → transcripción → OpenAI) sobre un archivo ya guardado.
+    El trabajo bloqueante se ejecuta en el pool de inferencia y los segmentos se turnan con los
+    de otras peticiones en la cola justa de la clave client; devuelve el payload de respuesta.
+    charge es el cargo de cuota de la petición: se devuelve si falla o si sale de la caché
+    """
+    try:
+        # Las transcripciones se cachean por contenido del audio y opciones de transcripción
+        key = None
+        cached = None
+        if transcript_cache:
+            audio_hash = audio_hash or await inference_pool.run(file_sha256, input_file_path)
+            key = cache_key(audio_hash, transcription_options(model_name, language))
+            cached = transcript_cache.get(key)
+        
+        if cached:
+            logger.info("💾 Transcripción obtenida de la caché, se omiten división y Whisper")
+            quota_ledger.refund(charge)
+            full_transcription = cached["raw_transcription"]
+            timed_segments = cached["segments"]
+            segment_texts = cached["segment_texts"]
+            failed_segments = 0
+            if on_segment:
+                for i, text in enumerate(segment_texts):
+                    on_segment(i, len(segment_texts), text)
+        else:
+            if not transcription_available():
+                raise HTTPException(status_code=503, detail="Modelo Whisper no disponible")
+            
+            # Dividir en segmentos (5 minutos por defecto) y transcribir cada uno en cuanto se decodifica
+            expected = await asyncio.to_thread(estimated_segment_count, input_file_path)
+            logger.info(f"🔄 Paso 1/3: Dividiendo audio en segmentos de {SEGMENT_DURATION}s (modo '{SEGMENTATION_MODE}')...")
+            logger.info("🎤 Paso 2/3: Iniciando transcripción con Whisper...")
+            
+            def on_result(index: int, result: dict):
+                # El total es una estimación hasta que termina la decodificación
+                on_segment(index, max(expected or 0, index + 1), result["text"])
+            
+            results = await transcribe_file_segments(
+                input_file_path, model_registry.resolve(model_name), language, client,
+                on_result if on_segment else None
+            )
+            full_transcription, timed_segments = merge_segment_results(results)
+            segment_texts = [r["text"] for r in results]
+            cache_transcript(key, full_transcription, timed_segments, results)
+            failed_segments = failed_segment_count(results)
+        
+        return await finish_pipeline(
+            original_filename, model_name, full_transcription, timed_segments, segment_texts, custom_prompt,
+            failed_segments, cached=bool(cached)
+        )
+    except BaseException:
+        # Sin resultado no se consume cuota
+        quota_ledger.refund(charge)
+        raise
+
+async def finish_pipeline(
+    original_filename: str,
+    model_name: Optional[str],
+    full_transcription: str,
+    timed_segments: List[dict],
+    segment_texts: List[str],
+    custom_prompt: str = None,
+    failed_segments: int = 0,
+    cached: bool = False
+) -> dict:
+    """
+    Último paso común: procesa la transcripción con OpenAI y compone el payload de respuesta.
+    failed_segments cuenta los segmentos que faltan; cached indica que salió de la caché (sin cuota)
+    """
+    logger.info(f"✅ Transcripción completada: {len(full_transcription)} caracteres")
+    logger.info("🤖 Paso 3/3: Enviando a OpenAI para procesamiento...")
+    
+    # Procesar con OpenAI Chat
+    with STAGE_DURATION.labels("chat").time(), trace_span("chat", filename=original_filename, characters=len(full_transcription)):
         processed_response = await process_with_openai_chat(full_transcription, custom_prompt)
+    
+    payload = {
+        "status": "success",
+        "original_filename": original_filename,
+        "whisper_model": model_name or WHISPER_MODEL,
+        "segments_processed": len(segment_texts),
+        "failed_segments": failed_segments,
+        "cached": cached,
+        "transcription_length": len(full_transcription),
+        "raw_transcription": full_transcription,
+        "segments": timed_segments,
+        "processed_response": processed_response,
+        "message": (
+            f"Audio transcrito con {failed_segments} segmentos fallidos; repite la petición para reintentarlos"
+            if failed_segments else "Audio transcrito y procesado exitosamente"
+        )
+    }
+    # Desglose por etapas hasta este momento; la traza completa queda en /traces/{trace_id}
+    trace = current_trace.get()
+    if trace is not None:
+        payload["trace"] = trace.to_dict()
+    return payload
+
+class FileContext:
+    """Estado que comparten los segmentos de un archivo en la cola de transcripción"""
+
+    def __init__(self, language: Optional[str] = None):
+        self.language = language  # indicado por el cliente o detectado en el primer segmento con voz
+        self.previous_text = ""  # texto del último segmento transcrito, para el initial_prompt
+
+def launch_segment(
+    segment: AudioChunk,
+    index: int,
+    model_name: str,
+    language: str = None,
+    initial_prompt: str = None
+) -> Awaitable[dict]:
+    """Lanza la transcripción de un segmento según el modo configurado y devuelve un awaitable con su resultado"""
+    if segment_process_pool is not None:
+        return asyncio.wrap_future(submit_to_segment_pool(segment, index, 0, model_name, language)[1])
+    if batch_scheduler is not None:
+        return collect_windows_when_done(segment, submit_segment_windows(segment, model_name, language), index)
+    return inference_pool.run(_transcribe_segment_in_worker, segment, index, 0, model_name, language, initial_prompt)
+
+async def collect_windows_when_done(segment: AudioChunk, windows: List[Tuple[int, Future]], index: int) -> dict:
+    """Espera las ventanas en el event loop (sin ocupar un hilo del pool de inferencia) y las une"""
+    await asyncio.wait([asyncio.wrap_future(future) for _, future in windows])
+    return collect_segment_windows(segment, windows, index)
+
+async def transcribe_segment_queue(
+    segments_queue: asyncio.Queue,
+    model_name: str,
+    client: Optional[ApiClient] = None,
+    on_result: Optional[Callable[[int, dict], None]] = None
+) -> List[dict]:
+    """
+    Etapa de inferencia: transcribe cada (segmento, FileContext) de la cola hasta None y devuelve
+    los resultados en orden; on_result(índice, resultado) se invoca con cada uno
+    """
+    if segment_process_pool is not None:
+        max_in_flight = WHISPER_WORKERS
+    elif batch_scheduler is not None:
+        max_in_flight = BATCH_MAX_SIZE
+    else:
+        max_in_flight = 1
+    
+    results = []
+    in_flight = deque()
+    
+    async def settle(task: Awaitable[dict], pool: Optional[ProcessPoolExecutor], index: int) -> dict:
+        try:
+            return await task
+        except Exception as e:
+            # Fallo del propio worker (p. ej. proceso terminado por falta de memoria)
+            logger.error(f"Error transcribiendo segmento {index+1}: {e}")
+            if isinstance(e, BrokenProcessPool):
+                await asyncio.to_thread(start_segment_process_pool, pool)
+            return {"text": "", "segments": [], "error": str(e)}
+    
+    def segment_cost(segment: AudioChunk) -> float:
+        return compute_cost(len(segment.audio) / SAMPLE_RATE, model_name)
+    
+    async def collect_oldest():
+        segment, context, index, initial_prompt, key, timing, task, pool = in_flight.popleft()
+        result = await settle(task, pool, index)
+        attempts = 1
+        while should_retry_segment(result, attempts, index):
+            attempts += 1
+            async with segment_fair_queue.turn(client, segment_cost(segment)):
+                pool = segment_process_pool
+                result = await settle(launch_segment(segment, index, model_name, context.language, initial_prompt), pool, index)
+            timing["finished"] = time.perf_counter()
+        await asyncio.to_thread(save_segment_checkpoint, key, result)
+        record_segment_metrics(segment, result)
+        record_segment_span(segment, index, result, timing, attempts)
+        results.append(result)
+        context.previous_text = result["text"]
+        if on_result:
+            on_result(len(results) - 1, result)
+    
+    try:
+        index = 0
+        while True:
+            item = await segments_queue.get()
+            if item is None:
+                break
+            segment, context = item
+            if context.language is None:
+                with trace_span("language") as span:
+                    context.language = await inference_pool.run(detect_segments_language, [segment], model_name)
+                    span["language"] = context.language
+            # En vuelo de uno en uno, el segmento anterior ya terminó: su final sirve de contexto
+            initial_prompt = context_prompt(context.previous_text) if max_in_flight == 1 else None
+            
+            key = await asyncio.to_thread(segment_checkpoint_key, segment, model_name, context.language)
+            checkpoint = await asyncio.to_thread(load_segment_checkpoint, key)
+            pool = segment_process_pool
+            timing = {"queued": time.perf_counter()}
+            if checkpoint is not None:
+                logger.info(f"💾 Segmento {index+1} recuperado de un checkpoint")
+                timing["started"] = timing["finished"] = timing["queued"]
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(checkpoint)
+            else:
+                # El turno se libera en cuanto termina la inferencia, no al recoger el resultado:
+                # los segmentos terminados nunca retienen capacidad mientras se espera otro turno
+                await segment_fair_queue.acquire(client, segment_cost(segment))
+                timing["started"] = time.perf_counter()
+                try:
+                    task = asyncio.ensure_future(launch_segment(segment, index, model_name, context.language, initial_prompt))
+                except BaseException:
+                    segment_fair_queue.release()
+                    raise
+                
+                def on_done(_, timing=timing):
+                    timing["finished"] = time.perf_counter()
+                    segment_fair_queue.release()
+                
+                task.add_done_callback(on_done)
+            in_flight.append((segment, context, index, initial_prompt, key, timing, task, pool))
+            index += 1
+            while len(in_flight) >= max_in_flight:
+                await collect_oldest()
         
-        return JSONResponse(content={
-            "status": "success",
-            "original_filename": file.filename,
-            "segments_processed": len(segment_paths),
-            "transcription_length": len(full_transcription),
-            "raw_transcription": full_transcription,
-            "processed_response": processed_response,
-            "message": "Audio transcrito y procesado exitosamente"
-        })
+        while in_flight:
+            await collect_oldest()
+        return results
+    finally:
+        for *_, task, _ in in_flight:
+            task.cancel()
+
+async def start_stream_decoder() -> asyncio.subprocess.Process:
+    """ffmpeg leyendo el audio por stdin y escribiendo PCM mono float32 a 16 kHz por stdout"""
+    return await asyncio.create_subprocess_exec(
+        "ffmpeg", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-loglevel", "error", "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+async def decoded_segments(decoder: asyncio.subprocess.Process, source: str = "pipe:0") -> AsyncIterator[AudioChunk]:
+    """
+    Lee el PCM que produce ffmpeg y devuelve cada segmento en cuanto es definitivo. ffmpeg solo
+    avanza cuando se consume lo que ya decodificó, así que en memoria está como mucho el audio
+    del segmento en curso (hasta 1,5 veces SEGMENT_DURATION) más los que esperan a Whisper
+    """
+    segmenter = StreamingSegmenter(SEGMENT_DURATION, SEGMENTATION_MODE)
+    started = time.perf_counter()
+    consumer_seconds = 0.0  # tiempo suspendido en yield mientras se procesa cada segmento
+    decoded_bytes = 0
+    count = 0
+    kept = 0
+    while True:
+        data = await decoder.stdout.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            break
+        decoded_bytes += len(data)
+        segmenter.append(data)
+        if segmenter.ready:
+            for chunk in await asyncio.to_thread(segmenter.cut):
+                count += 1
+                kept += len(chunk.audio)
+                paused = time.perf_counter()
+                yield chunk
+                consumer_seconds += time.perf_counter() - paused
+    
+    stderr = await decoder.stderr.read()
+    if await decoder.wait() != 0:
+        raise AudioDecodeError(f"ffmpeg no pudo decodificar el audio: {ffmpeg_error(stderr.decode(errors='ignore'), source)}")
+    
+    for chunk in await asyncio.to_thread(segmenter.cut, True):
+        count += 1
+        kept += len(chunk.audio)
+        paused = time.perf_counter()
+        yield chunk
+        consumer_seconds += time.perf_counter() - paused
+    # La etapa 'split' cuenta la lectura y el corte, no lo que tarda quien consume los segmentos
+    STAGE_DURATION.labels("split").observe(time.perf_counter() - started - consumer_seconds)
+    logger.info(
+        f"Audio decodificado por ventanas: {decoded_bytes / 4 / SAMPLE_RATE:.1f}s en {count} segmentos "
+        f"({kept / SAMPLE_RATE:.1f}s a transcribir, modo '{SEGMENTATION_MODE}')"
+    )
+    # Solapado con la inferencia: incluye el tiempo que ffmpeg espera a que Whisper consuma
+    add_span(
+        "decode", started, windowed=True, segments=count,
+        audio_seconds=round(decoded_bytes / 4 / SAMPLE_RATE, 3)
+    )
+
+async def decode_stream(decoder: asyncio.subprocess.Process, segments_queue: asyncio.Queue, context: FileContext):
+    """
+    Etapa de decodificación: encola cada segmento en cuanto es definitivo. La cola acotada
+    frena a ffmpeg (y con él la lectura de la subida) si Whisper va por detrás
+    """
+    async for chunk in decoded_segments(decoder):
+        await segments_queue.put((chunk, context))
+    await segments_queue.put(None)
+
+async def file_segments(audio_path: str) -> AsyncIterator[AudioChunk]:
+    """
+    Segmentos de un archivo ya guardado, en orden. Con WINDOWED_DECODE se decodifica por
+    ventanas (decoded_segments) y la memoria no depende de la duración del archivo; sin él,
+    split_audio decodifica el archivo entero en el pool de inferencia
+    """
+    if not WINDOWED_DECODE:
+        with STAGE_DURATION.labels("split").time(), trace_span("decode", windowed=False) as span:
+            segments = await inference_pool.run(split_audio, audio_path)
+            span["segments"] = len(segments)
+        for segment in segments:
+            yield segment
+        return
+    
+    decoder = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", audio_path,
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-loglevel", "error", "pipe:1",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        async for segment in decoded_segments(decoder, audio_path):
+            yield segment
+    except AudioDecodeError as e:
+        logger.error(f"Error dividiendo audio: {e}")
+        raise HTTPException(status_code=400, detail=f"Error procesando archivo de audio: {str(e)}")
+    finally:
+        if decoder.returncode is None:
+            decoder.kill()
+            await decoder.wait()
+
+async def transcribe_file_segments(
+    audio_path: str,
+    model_name: str,
+    language: Optional[str] = None,
+    client: Optional[ApiClient] = None,
+    on_result: Optional[Callable[[int, dict], None]] = None
+) -> List[dict]:
+    """
+    Decodifica y transcribe un archivo guardado con las dos etapas solapadas: los segmentos pasan
+    de file_segments a transcribe_segment_queue por una cola acotada, que frena la decodificación
+    si Whisper va por detrás
+    """
+    segments_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SEGMENTS)
+    context = FileContext(language)
+    
+    async def produce():
+        async for segment in file_segments(audio_path):
+            await segments_queue.put((segment, context))
+        await segments_queue.put(None)
+    
+    producer = asyncio.create_task(produce())
+    consumer = asyncio.create_task(transcribe_segment_queue(segments_queue, model_name, client, on_result))
+    try:
+        _, results = await asyncio.gather(producer, consumer)
+        return results
+    finally:
+        for task in (producer, consumer):
+            if not task.done():
+                task.cancel()
+
+def estimated_segment_count(audio_path: str) -> Optional[int]:
+    """
+    Segmentos previstos según la duración del contenedor, antes de decodificar: exacto en modo
+    'fixed'; en 'silence' es aproximado (los cortes en pausas y los silencios descartados lo cambian)
+    """
+    try:
+        return max(1, -(-int(probe_duration(audio_path)) // SEGMENT_DURATION))
+    except Exception:
+        return None
+
+async def admit_audio_file(client: Optional[ApiClient], path: str, model_name: Optional[str]) -> Optional[list]:
+    """
+    Admite la transcripción de un archivo guardado según la duración de su cabecera (ffprobe,
+    sin decodificar); 429 si no cabe en la cuota. Las claves sin cuota no necesitan la duración
+    """
+    if client is None or not client.quota:
+        return None
+    try:
+        duration = await asyncio.to_thread(probe_duration, path)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el archivo: {e}")
+    return quota_ledger.admit(client, compute_cost(duration, model_name))
+
+async def receive_and_transcribe(
+    request: Request,
+    input_file_path: str,
+    custom_prompt: str = None,
+    model_name: str = None,
+    language: str = None,
+    client: Optional[ApiClient] = None
+) -> dict:
+    """
+    Recibe la subida y, si el M4A tiene el índice ('moov') al principio, la decodifica y transcribe
+    mientras llega; si no, transcribe el archivo completo al terminar la subida
+    """
+    reader = MultipartFileReader(request.headers.get("content-type", ""))
+    digest = hashlib.sha256()
+    size = 0
+    header = bytearray()
+    streamable = None
+    charge = None
+    decoder = None
+    decode_task = consume_task = None
+    segments_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SEGMENTS)
+    # El hueco del pool se toma al empezar a decodificar, no durante la subida: un cliente lento
+    # no debe dejar el pool ocupado sin trabajo
+    slot = AsyncExitStack()
+    holding_slot = False
+    
+    async def acquire_slot():
+        nonlocal holding_slot
+        if not holding_slot:
+            await slot.enter_async_context(inference_pool.slot(client=client))
+            holding_slot = True
+    
+    try:
+        with STAGE_DURATION.labels("upload").time(), trace_span("upload") as upload_span, open(input_file_path, "wb") as f:
+            async for body in request.stream():
+                for data in reader.feed(body):
+                    if size == 0 and not reader.filename.lower().endswith('.m4a'):
+                        raise HTTPException(status_code=400, detail="Solo se aceptan archivos .m4a")
+                    
+                    # Verificar tamaño del archivo
+                    size += len(data)
+                    if size > MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Archivo demasiado grande. Tamaño máximo permitido: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+                        )
+                    BYTES_RECEIVED.inc(len(data))
+                    f.write(data)
+                    digest.update(data)
+                    
+                    if streamable is None:
+                        # Con los primeros bytes: si el índice ('moov') va al principio, su duración
+                        # sirve para admitir la petición y el M4A puede decodificarse mientras llega
+                        header += data
+                        moov_first = mp4_moov_before_mdat(bytes(header))
+                        duration = mp4_duration(bytes(header)) if moov_first else None
+                        if duration is not None:
+                            if client is not None and client.quota:
+                                charge = quota_ledger.admit(client, compute_cost(duration, model_name))
+                            streamable = PIPELINED_TRANSCRIBE
+                        elif moov_first is False or len(header) >= MP4_PROBE_BYTES:
+                            streamable = False
+                        if streamable:
+                            await acquire_slot()
+                            logger.info("🔄 Decodificando y transcribiendo mientras se recibe el archivo...")
+                            decoder = await start_stream_decoder()
+                            decode_task = asyncio.create_task(decode_stream(decoder, segments_queue, FileContext(language)))
+                            consume_task = asyncio.create_task(transcribe_segment_queue(segments_queue, model_name, client))
+                            data = bytes(header)
+                        elif streamable is False and duration is None and PIPELINED_TRANSCRIBE:
+                            logger.info("ℹ️  El M4A no tiene el índice al principio: se decodificará al terminar la subida")
+                    
+                    if streamable:
+                        try:
+                            decoder.stdin.write(data)
+                            # Si ffmpeg no da abasto, esperar aquí deja de leer la subida (contrapresión)
+                            await decoder.stdin.drain()
+                        except (BrokenPipeError, ConnectionResetError):
+                            # ffmpeg terminó antes de tiempo; el error se recoge en decode_stream
+                            streamable = False
+            upload_span.update(filename=reader.filename, bytes=size, pipelined=bool(streamable))
+        
+        if reader.filename is None:
+            raise HTTPException(status_code=400, detail="Falta el campo 'file' con el archivo de audio")
+        logger.info(f"Archivo recibido: {reader.filename}, tamaño: {size} bytes ({size / (1024*1024):.1f}MB)")
+        if decoder is not None and streamable:
+            decoder.stdin.close()
+        
+        audio_hash = digest.hexdigest()
+        if transcript_cache:
+            cached = transcript_cache.get(cache_key(audio_hash, transcription_options(model_name, language)))
+            if cached:
+                logger.info("💾 Transcripción obtenida de la caché, se omiten división y Whisper")
+                quota_ledger.refund(charge)
+                return await finish_pipeline(
+                    reader.filename, model_name, cached["raw_transcription"],
+                    cached["segments"], cached["segment_texts"], custom_prompt, cached=True
+                )
+        
+        if decode_task is not None:
+            try:
+                await decode_task
+                results = await consume_task
+            except Exception as e:
+                logger.warning(f"⚠️  Falló la decodificación durante la subida ({e}); se procesa el archivo completo")
+            else:
+                full_transcription, timed_segments = merge_segment_results(results)
+                segment_texts = [r["text"] for r in results]
+                cache_transcript(
+                    cache_key(audio_hash, transcription_options(model_name, language)),
+                    full_transcription, timed_segments, results
+                )
+                return await finish_pipeline(
+                    reader.filename, model_name, full_transcription, timed_segments, segment_texts, custom_prompt,
+                    failed_segment_count(results)
+                )
+        
+        if charge is None:
+            charge = await admit_audio_file(client, input_file_path, model_name)
+        await acquire_slot()
+        return await run_transcription_pipeline(
+            input_file_path, reader.filename, custom_prompt,
+            model_name=model_name, audio_hash=audio_hash, language=language, client=client, charge=charge
+        )
+    
+    except BaseException:
+        quota_ledger.refund(charge)
+        raise
+    finally:
+        for task in (decode_task, consume_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if decoder is not None and decoder.returncode is None:
+            decoder.kill()
+            await decoder.wait()
+        await slot.aclose()
+
+def probe_duration(path: str) -> float:
+    """Duración en segundos leída de la cabecera del contenedor con ffprobe, sin decodificar el audio"""
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            path
+        ],
+        capture_output=True,
+        text=True,
+        timeout=30
+    )
+    if result.returncode != 0:
+        raise RuntimeError(ffmpeg_error(result.stderr, path))
+    return float(result.stdout.strip())
+
+def resolve_manifest_path(path: str) -> str:
+    """Ruta real de una entrada del manifiesto (relativa a BATCH_INPUT_DIR); 400 si queda fuera"""
+    if not BATCH_INPUT_DIR:
+        raise HTTPException(status_code=400, detail="Las rutas locales están desactivadas: configura BATCH_INPUT_DIR")
+    
+    root = os.path.realpath(BATCH_INPUT_DIR)
+    real_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, real_path]) != root:
+        raise HTTPException(status_code=400, detail=f"Ruta fuera de BATCH_INPUT_DIR: {path}")
+    return real_path
+
+async def transcribe_batch(
+    items: List[dict],
+    custom_prompt: str = None,
+    model_name: str = None,
+    language: str = None,
+    client: Optional[ApiClient] = None
+) -> dict:
+    """
+    Transcribe varios archivos como un único trabajo, el más largo primero; cada item tiene
+    'filename', 'path' y 'error', y un fallo en un archivo solo afecta a su entrada del resultado
+    """
+    started = time.perf_counter()
+    
+    # 1. Duración de cada archivo desde la cabecera del contenedor
+    async def probe(item: dict):
+        try:
+            item["duration"] = await asyncio.to_thread(probe_duration, item["path"])
+        except Exception as e:
+            item["error"] = f"No se pudo leer el archivo: {e}"
+    
+    await asyncio.gather(*(probe(item) for item in items if item["error"] is None))
+    
+    # 2. Transcripciones ya en caché
+    pending = []
+    for item in items:
+        if item["error"] is not None:
+            continue
+        if transcript_cache:
+            item["cache_key"] = cache_key(
+                await inference_pool.run(file_sha256, item["path"]), transcription_options(model_name, language)
+            )
+            item["transcript"] = transcript_cache.get(item["cache_key"])
+            if item["transcript"]:
+                continue
+        pending.append(item)
+    
+    charge = None
+    if client is not None and client.quota:
+        charge = quota_ledger.admit(client, compute_cost(sum(item["duration"] for item in pending), model_name))
+    
+    # 3. Transcripción, el más largo primero
+    pending.sort(key=lambda item: item["duration"], reverse=True)
+    logger.info(
+        f"📦 Lote de {len(items)} archivos: {len(pending)} a transcribir "
+        f"({sum(item['duration'] for item in pending) / 3600:.2f} h de audio), el más largo primero"
+    )
+    
+    segments_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SEGMENTS)
+    owners = []  # (item, índice del segmento en su archivo) en el orden en que se encolan
+    
+    async def produce():
+        # Cada archivo se decodifica a medida que sus segmentos entran en la cola, en orden,
+        # para pasar contexto entre segmentos; un archivo ilegible no detiene el resto
+        for item in pending:
+            item["segment_results"] = []
+            context = FileContext(language)
+            try:
+                async for segment in file_segments(item["path"]):
+                    owners.append((item, len(item["segment_results"])))
+                    item["segment_results"].append(None)
+                    await segments_queue.put((segment, context))
+            except HTTPException as e:
+                item["error"] = e.detail
+        await segments_queue.put(None)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        results = await transcribe_segment_queue(segments_queue, model_name, client)
+        await producer
+    except BaseException:
+        quota_ledger.refund(charge)
+        raise
+    finally:
+        if not producer.done():
+            producer.cancel()
+    
+    for (item, index), result in zip(owners, results):
+        item["segment_results"][index] = result
     
+    # 4. Unión y procesamiento con OpenAI de cada archivo
+    async def finish(item: dict):
+        try:
+            if item.get("transcript"):
+                cached = item["transcript"]
+                full_transcription = cached["raw_transcription"]
+                timed_segments = cached["segments"]
+                segment_texts = cached["segment_texts"]
+                failed_segments = 0
+            else:
+                results = item["segment_results"]
+                full_transcription, timed_segments = merge_segment_results(results)
+                segment_texts = [r["text"] for r in results]
+                cache_transcript(item.get("cache_key"), full_transcription, timed_segments, results)
+                failed_segments = failed_segment_count(results)
+            item["result"] = await finish_pipeline(
+                item["filename"], model_name, full_transcription, timed_segments, segment_texts, custom_prompt,
+                failed_segments, cached=bool(item.get("transcript"))
+            )
+        except HTTPException as e:
+            item["error"] = e.detail
+        except Exception as e:
+            item["error"] = str(e)
+    
+    await asyncio.gather(*(finish(item) for item in items if item["error"] is None))
+    
+    wall_seconds = time.perf_counter() - started
+    succeeded = [item for item in items if item["error"] is None]
+    failed = len(items) - len(succeeded)
+    audio_seconds = sum(item["duration"] for item in succeeded)
+    logger.info(
+        f"📦 Lote completado: {len(succeeded)}/{len(items)} archivos, "
+        f"{audio_seconds / 3600:.2f} h de audio en {wall_seconds:.1f}s"
+    )
+    
+    files = []
+    for item in items:
+        if item["error"] is None:
+            # La traza es la del lote entero: se devuelve una sola vez, no en cada archivo
+            item["result"].pop("trace", None)
+            files.append({"filename": item["filename"], "duration_seconds": round(item["duration"], 2), **item["result"]})
+        else:
+            logger.error(f"Error en el archivo del lote {item['filename']}: {item['error']}")
+            files.append({"filename": item["filename"], "status": "error", "detail": item["error"]})
+    
+    payload = {
+        "status": "success" if not failed else ("partial" if succeeded else "error"),
+        "files": files,
+        "summary": {
+            "files": len(items),
+            "succeeded": len(succeeded),
+            "failed": failed,
+            "audio_seconds": round(audio_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "audio_hours_per_hour": round(audio_seconds / wall_seconds, 2) if wall_seconds > 0 else 0.0
+        }
+    }
+    trace = current_trace.get()
+    if trace is not None:
+        payload["trace"] = trace.to_dict()
+    return payload
+
+async def run_job(job: dict):
+    """
+    Ejecuta un trabajo reclamado del almacén y guarda su resultado o error
+    """
+    job_id = job["id"]
+    client = api_clients_by_name.get(job["client"])
+    
+    # El progreso se guarda fuera del event loop con un único escritor, que solo escribe el más reciente
+    progress: List[Tuple[int, int]] = []
+    progress_writer: Optional[asyncio.Task] = None
+    
+    async def write_progress():
+        while progress:
+            segments_done, segments_total = progress[-1]
+            progress.clear()
+            try:
+                await asyncio.to_thread(job_store.update_progress, job_id, segments_done, segments_total)
+            except Exception as e:
+                logger.warning(f"Trabajo {job_id}: error guardando el progreso: {e}")
+    
+    def on_segment(index: int, total: int, text: str):
+        nonlocal progress_writer
+        progress.append((index + 1, total))
+        if progress_writer is None or progress_writer.done():
+            progress_writer = asyncio.create_task(write_progress())
+    
+    # Cada ejecución tiene su propia traza (la de POST /jobs termina al encolar); se guarda
+    # con el resultado y, en este proceso, en /traces
+    trace = Trace(f"job {job_id}", job["client"])
+    token = current_trace.set(trace)
+    logger.info(f"Iniciando trabajo {job_id} ({job['original_filename']}, traza {trace.trace_id})")
+    # Con SPOOL_DIR el cargo puede estar en otro proceso (el que admitió el trabajo): el trabajo
+    # terminado anota si hay que devolverlo y ese proceso lo aplica (settle_job_charges)
+    charge = job_charges.pop(job_id, None)
+    try:
+        async with inference_pool.slot(reject_when_full=False, client=client):
+            payload = await run_transcription_pipeline(
+                job["input_path"], job["original_filename"], job["custom_prompt"], on_segment, job["model"],
+                language=job["language"], client=client, charge=charge
+            )
+        if progress_writer is not None:
+            await progress_writer
+        await asyncio.to_thread(job_store.complete, job_id, payload, payload["cached"])
+        logger.info(f"✅ Trabajo {job_id} completado")
     except Exception as e:
-        logger.error(f"Error procesando audio: {e}")
-        raise HTTPException(status_code=500, detail=f"Error procesando audio: {str(e)}")
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Error en trabajo {job_id}: {detail}")
+        await asyncio.to_thread(job_store.fail, job_id, detail)
+    finally:
+        current_trace.reset(token)
+        trace.finish()
+        trace_store.add(trace)
+        log_trace(trace)
+    
+    # El audio de entrada solo se elimina al terminar: si el proceso se reinicia
+    # a mitad del trabajo, éste vuelve a la cola con su archivo intacto
+    cleanup_temp_files([job["input_path"]])
+
+async def job_worker(worker_id: int):
+    """
+    Bucle de un worker: reclama trabajos en cola y los ejecuta de uno en uno
+    """
+    # No reclamar trabajos hasta que el modelo esté listo
+    await model_ready.wait()
+    
+    while True:
+        try:
+            job = await asyncio.to_thread(job_store.claim_next)
+        except Exception as e:
+            logger.error(f"Worker {worker_id}: error reclamando trabajo: {e}")
+            job = None
+        
+        if job is None:
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            job_wakeup.clear()
+            continue
+        
+        async with job_lease(job["id"]):
+            await run_job(job)
+
+@asynccontextmanager
+async def job_lease(job_id: str):
+    """
+    Con SPOOL_DIR, renueva el lease del trabajo mientras se ejecuta y, si el worker se para
+    a mitad, lo devuelve a la cola en vez de esperar a que el lease expire
+    """
+    if not SPOOL_DIR:
+        yield
+        return
+    
+    async def renew():
+        while True:
+            await asyncio.sleep(SPOOL_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(job_store.renew, job_id):
+                logger.warning(f"Trabajo {job_id}: lease perdido, otro worker puede repetirlo")
+                return
+    
+    heartbeat = asyncio.create_task(renew())
+    try:
+        yield
+    except asyncio.CancelledError:
+        job_store.release(job_id)
+        logger.info(f"Trabajo {job_id} devuelto a la cola al detener el worker")
+        raise
+    finally:
+        heartbeat.cancel()
+
+async def job_janitor():
+    """
+    Elimina periódicamente los trabajos expirados y sus archivos
+    """
+    while True:
+        try:
+            expired = await asyncio.to_thread(job_store.delete_expired)
+            cleanup_temp_files([job["input_path"] for job in expired])
+            if expired:
+                logger.info(f"{len(expired)} trabajos expirados eliminados")
+        except Exception as e:
+            logger.warning(f"Error limpiando trabajos expirados: {e}")
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+def settle_job_charges() -> int:
+    """
+    Con SPOOL_DIR, devuelve los cargos de los trabajos admitidos aquí que otro proceso terminó sin
+    consumir cuota (fallaron o salieron de la caché); devuelve cuántos se devolvieron
+    """
+    horizon = time.time() - quota_ledger.window
+    refunded = 0
+    for job_id, charge in list(job_charges.items()):
+        job = job_store.get(job_id)
+        if job is None or charge[0] < horizon:
+            # Expirado o ya fuera de la ventana de cuota: el cargo ya no cuenta
+            job_charges.pop(job_id, None)
+        elif job["status"] in ("completed", "failed"):
+            job_charges.pop(job_id, None)
+            if job.get("quota_refunded"):
+                quota_ledger.refund(charge)
+                refunded += 1
+    return refunded
+
+async def job_charge_settler():
+    """
+    Aplica periódicamente las devoluciones de cuota de los trabajos ejecutados por los workers del spool
+    """
+    while True:
+        try:
+            refunded = await asyncio.to_thread(settle_job_charges)
+            if refunded:
+                logger.info(f"💳 Cuota devuelta de {refunded} trabajos sin resultado")
+        except Exception as e:
+            logger.warning(f"Error devolviendo cuota de trabajos: {e}")
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def scratch_janitor():
+    """
+    Barre al arrancar y después periódicamente los directorios temporales huérfanos
+    (peticiones de un proceso anterior que terminó sin limpiar)
+    """
+    while True:
+        try:
+            removed = await asyncio.to_thread(scratch_space.sweep)
+            if removed:
+                logger.info(f"🧹 {removed} directorios temporales huérfanos eliminados")
+        except Exception as e:
+            logger.warning(f"Error barriendo el espacio temporal: {e}")
+        await asyncio.sleep(SCRATCH_SWEEP_INTERVAL)
+
+def serialize_job(job: dict) -> dict:
+    """Representación pública del estado de un trabajo"""
+    def iso(ts):
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+    
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "original_filename": job["original_filename"],
+        "model": job["model"] or WHISPER_MODEL,
+        "language": job["language"],
+        "progress": {
+            "segments_done": job["segments_done"],
+            "segments_total": job["segments_total"]
+        },
+        "error": job["error"],
+        "created_at": iso(job["created_at"]),
+        "updated_at": iso(job["updated_at"]),
+        "expires_at": iso(job["expires_at"])
+    }
+
+# Cuerpo de /transcribe para la documentación OpenAPI: el multipart se lee a mano, a medida que llega
+TRANSCRIBE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary", "description": "Archivo de audio .m4a"}}
+                }
+            }
+        }
+    }
+}
+
+@app.post("/transcribe", openapi_extra=TRANSCRIBE_REQUEST_BODY)
+async def transcribe_audio(
+    request: Request,
+    custom_prompt: str = None,
+    model: str = None,
+    language: str = None,
+    client: ApiClient = Depends(get_api_key)
+):
+    """
+    Transcribe un archivo de audio .m4a y lo procesa con OpenAI Chat
+    """
+    model = model_registry.resolve(model)
+    language = resolve_language(language)
+    
+    if not transcription_available():
+        raise HTTPException(status_code=503, detail="Modelo Whisper no está disponible")
+    
+    # Si la cola está llena se responde 503 de inmediato, antes de esperar por espacio temporal
+    if inference_pool.is_full:
+        raise inference_pool.busy_error()
+    
+    # Siempre espacio temporal primero y después hueco en el pool (al empezar a decodificar), en todos los endpoints
+    async with scratch_space.directory(upload_reservation(request)) as scratch_dir:
+        try:
+            # El archivo subido se guarda en el directorio de la petición, que se borra al salir
+            input_file_path = os.path.join(scratch_dir, "input.m4a")
+            payload = await receive_and_transcribe(request, input_file_path, custom_prompt, model, language, client)
+            return JSONResponse(content=payload)
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando audio: {e}")
+            raise HTTPException(status_code=500, detail=f"Error procesando audio: {str(e)}")
+
+BATCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                            "description": "Archivos de audio .m4a"
+                        },
+                        "manifest": {"type": "string", "description": "Rutas relativas a BATCH_INPUT_DIR, una por línea"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+async def receive_batch_uploads(request: Request, scratch_dir: str) -> Tuple[List[dict], str]:
+    """
+    Guarda en scratch_dir cada archivo del campo 'files' a medida que llega y devuelve sus items
+    y el campo 'manifest'. Los archivos que no son .m4a o superan MAX_FILE_SIZE quedan con su error
+    """
+    reader = MultipartFileReader(request.headers.get("content-type", ""), field="files", multiple=True)
+    items: Dict[int, dict] = {}
+    sizes: Dict[int, int] = {}
+    output = None
+    
+    with STAGE_DURATION.labels("upload").time(), trace_span("upload") as span:
+        try:
+            async for body in request.stream():
+                for index, data in reader.feed_parts(body):
+                    item = items.get(index)
+                    if item is None:
+                        # Empieza un archivo nuevo: el anterior ya está completo
+                        if output is not None:
+                            output.close()
+                            output = None
+                        item = items[index] = {"filename": reader.filenames[index], "path": None, "error": None}
+                        sizes[index] = 0
+                        if not item["filename"].lower().endswith('.m4a'):
+                            item["error"] = "Solo se aceptan archivos .m4a"
+                        else:
+                            item["path"] = os.path.join(scratch_dir, f"{index}.m4a")
+                            output = open(item["path"], "wb")
+                    if item["error"] is not None:
+                        continue
+                    
+                    sizes[index] += len(data)
+                    BYTES_RECEIVED.inc(len(data))
+                    if sizes[index] > MAX_FILE_SIZE:
+                        item["error"] = f"Archivo demasiado grande. Tamaño máximo permitido: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+                        output.close()
+                        output = None
+                        cleanup_temp_files([item["path"]])
+                        item["path"] = None
+                        continue
+                    output.write(data)
+                
+                if len(reader.filenames) > BATCH_MAX_FILES:
+                    raise HTTPException(status_code=400, detail=f"Demasiados archivos en el lote. Máximo permitido: {BATCH_MAX_FILES}")
+        finally:
+            if output is not None:
+                output.close()
+        span.update(files=len(reader.filenames), bytes=sum(sizes.values()))
+    
+    uploads = []
+    for index, filename in enumerate(reader.filenames):
+        # Un archivo vacío no llega a producir datos
+        uploads.append(items.get(index) or {
+            "filename": filename,
+            "path": None,
+            "error": "Solo se aceptan archivos .m4a" if not filename.lower().endswith('.m4a') else "Archivo vacío"
+        })
+    logger.info(f"Lote recibido: {len(uploads)} archivos, {sum(sizes.values()) / (1024*1024):.1f}MB")
+    return uploads, reader.fields.get("manifest", "")
+
+@app.post("/transcribe/batch", openapi_extra=BATCH_REQUEST_BODY)
+async def transcribe_audio_batch(
+    request: Request,
+    custom_prompt: str = None,
+    model: str = None,
+    language: str = None,
+    client: ApiClient = Depends(get_api_key)
+):
+    """
+    Transcribe varios archivos .m4a en una sola petición: subidos en el campo 'files' y/o
+    indicados en 'manifest' (una ruta por línea, relativa a BATCH_INPUT_DIR)
+    """
+    model = model_registry.resolve(model)
+    language = resolve_language(language)
+    
+    if not transcription_available():
+        raise HTTPException(status_code=503, detail="Modelo Whisper no está disponible")
+    
+    if inference_pool.is_full:
+        raise inference_pool.busy_error()
+    
+    # El lote completo ocupa un único hueco del pool, tomado al terminar la subida; las rutas
+    # locales no usan espacio temporal
+    reservation = upload_reservation(request, BATCH_MAX_BODY_SIZE)
+    async with scratch_space.directory(reservation) as scratch_dir:
+        try:
+            uploads, manifest = await receive_batch_uploads(request, scratch_dir)
+            paths = [line.strip() for line in manifest.splitlines() if line.strip()]
+            if not uploads and not paths:
+                raise HTTPException(status_code=400, detail="Envía archivos en 'files' o rutas en 'manifest'")
+            if len(uploads) + len(paths) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=400, detail=f"Demasiados archivos en el lote. Máximo permitido: {BATCH_MAX_FILES}")
+            
+            items = []
+            for path in paths:
+                real_path = resolve_manifest_path(path)
+                error = None
+                if not path.lower().endswith('.m4a'):
+                    error = "Solo se aceptan archivos .m4a"
+                elif not os.path.isfile(real_path):
+                    error = "El archivo no existe"
+                items.append({"filename": path, "path": real_path, "error": error})
+            items.extend(uploads)
+            
+            async with inference_pool.slot(client=client):
+                payload = await transcribe_batch(items, custom_prompt, model, language, client)
+            return JSONResponse(content=payload)
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando lote: {e}")
+            raise HTTPException(status_code=500, detail=f"Error procesando lote: {str(e)}")
+
+def format_stream_event(event: dict, stream_format: str) -> str:
+    """Serializa un evento como línea NDJSON o como mensaje SSE"""
+    data = json.dumps(event, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def stream_transcription_events(
+    input_path: str,
+    original_filename: str,
+    custom_prompt: str,
+    stream_format: str,
+    model_name: Optional[str] = None,
+    language: Optional[str] = None,
+    client: Optional[ApiClient] = None,
+    charge: Optional[list] = None
+):
+    """
+    Ejecuta el pipeline y emite un evento por cada segmento transcrito,
+    seguido de un evento final 'result' (o 'error') con el payload completo
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    
+    def on_segment(index: int, total: int, text: str):
+        # Se invoca desde los hilos del pool: reenviar al event loop
+        loop.call_soon_threadsafe(events.put_nowait, {"event": "segment", "index": index, "total": total, "text": text})
+    
+    async def run():
+        try:
+            async with inference_pool.slot(reject_when_full=False, client=client):
+                payload = await run_transcription_pipeline(
+                    input_path, original_filename, custom_prompt, on_segment, model_name,
+                    language=language, client=client, charge=charge
+                )
+            event = {"event": "result", **payload}
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Error procesando audio: {detail}")
+            event = {"event": "error", "detail": detail}
+        loop.call_soon_threadsafe(events.put_nowait, event)
     
+    task = asyncio.create_task(run())
+    try:
+        yield format_stream_event({"event": "accepted", "original_filename": original_filename}, stream_format)
+        while True:
+            event = await events.get()
+            yield format_stream_event(event, stream_format)
+            if event["event"] in ("result", "error"):
+                break
     finally:
-        # Limpiar archivos temporales
-        cleanup_temp_files(temp_files)
+        # Si el cliente se desconecta se deja de esperar el resultado
+        if not task.done():
+            task.cancel()
+
+@app.post("/transcribe/stream")
+async def transcribe_audio_stream(
+    file: UploadFile = File(...),
+    custom_prompt: str = None,
+    format: str = "ndjson",
+    model: str = None,
+    language: str = None,
+    client: ApiClient = Depends(get_api_key)
+):
+    """
+    Igual que /transcribe, pero devuelve eventos a medida que se transcribe cada segmento
+    (NDJSON por defecto o Server-Sent Events con format=sse)
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Usa 'ndjson' o 'sse'")
+    
+    if not file.filename.lower().endswith('.m4a'):
+        raise HTTPException(status_code=400, detail="Solo se aceptan archivos .m4a")
+    
+    model = model_registry.resolve(model)
+    language = resolve_language(language)
+    
+    if not transcription_available():
+        raise HTTPException(status_code=503, detail="Modelo Whisper no está disponible")
+    
+    # Rechazar antes de empezar a emitir: después ya no se puede cambiar el código de estado
+    if inference_pool.is_full:
+        raise inference_pool.busy_error()
+    
+    # El directorio temporal vive hasta que termina la respuesta (o se desconecta el cliente)
+    scratch = AsyncExitStack()
+    try:
+        scratch_dir = await scratch.enter_async_context(
+            scratch_space.directory(min(file.size or MAX_FILE_SIZE, MAX_FILE_SIZE))
+        )
+        input_file_path = os.path.join(scratch_dir, "input.m4a")
+        await save_upload(file, input_file_path)
+        # Admitir por cuota ahora: una vez empezado el streaming ya no se puede responder 429
+        charge = await admit_audio_file(client, input_file_path, model)
+    except BaseException:
+        await scratch.aclose()
+        raise
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_transcription_events(input_file_path, file.filename, custom_prompt, format, model, language, client, charge),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(scratch.aclose)
+    )
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    custom_prompt: str = None,
+    model: str = None,
+    language: str = None,
+    client: ApiClient = Depends(get_api_key)
+):
+    """
+    Encola la transcripción de un archivo .m4a y devuelve el id del trabajo de inmediato
+    """
+    if not file.filename.lower().endswith('.m4a'):
+        raise HTTPException(status_code=400, detail="Solo se aceptan archivos .m4a")
+    
+    model = model_registry.resolve(model)
+    language = resolve_language(language)
+    
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(JOB_UPLOADS_DIR, f"{job_id}.m4a")
+    
+    try:
+        await save_upload(file, input_path)
+        # La cuota se comprueba al encolar: un trabajo que no cabe no llega a la cola
+        charge = await admit_audio_file(client, input_path, model)
+        await asyncio.to_thread(
+            job_store.create, job_id, file.filename, input_path, custom_prompt, model, language, client.name
+        )
+    except Exception:
+        cleanup_temp_files([input_path])
+        raise
+    # Con SPOOL_DIR el trabajo puede ejecutarlo otro proceso: job_charge_settler devuelve el cargo
+    if charge is not None:
+        job_charges[job_id] = charge
+    
+    job_wakeup.set()
+    logger.info(f"Trabajo {job_id} encolado")
+    
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }
+
+async def load_owned_job(job_id: str, client: ApiClient) -> dict:
+    """Trabajo job_id si es de client (los creados antes de haber varias claves no tienen dueño); 404 si no"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job or job["client"] not in (None, client.name):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, client: ApiClient = Depends(get_api_key)):
+    """
+    Devuelve el estado y progreso (segmentos completados / total) de un trabajo
+    """
+    return serialize_job(await load_owned_job(job_id, client))
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, client: ApiClient = Depends(get_api_key)):
+    """
+    Devuelve el resultado de un trabajo completado (mismo formato que /transcribe)
+    """
+    job = await load_owned_job(job_id, client)
+    
+    if job["status"] != "completed":
+        detail = f"El trabajo no está completado (estado: {job['status']})"
+        if job["error"]:
+            detail += f": {job['error']}"
+        raise HTTPException(status_code=409, detail=detail)
+    
+    return JSONResponse(content=json.loads(job["result"]))
+
+def visible_trace(trace_id: str, client: ApiClient) -> Trace:
+    """Traza de trace_id si la ve client (la suya, o cualquiera para ADMIN_CLIENTS); 404 si no"""
+    trace = trace_store.get(trace_id)
+    if trace is None or (client.name not in ADMIN_CLIENTS and trace.client != client.name):
+        raise HTTPException(status_code=404, detail="Traza no encontrada o expirada")
+    return trace
+
+@app.get("/traces")
+async def list_traces(limit: int = 50, client: ApiClient = Depends(get_api_key)):
+    """
+    Últimas trazas de la clave (de todas las claves para ADMIN_CLIENTS), sin los tramos
+    """
+    traces = trace_store.recent(None if client.name in ADMIN_CLIENTS else client.name, max(1, limit))
+    return {"traces": [{**trace.to_dict(spans=False), "client": trace.client} for trace in traces]}
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, client: ApiClient = Depends(get_api_key)):
+    """
+    Desglose completo de una petición: tramos de subida, decodificación, cada segmento (con su
+    RTF) y Chat, con su inicio relativo y duración
+    """
+    return visible_trace(trace_id, client).to_dict()
+
+@app.get("/traces/{trace_id}/profile")
+async def get_trace_profile(trace_id: str, client: ApiClient = Depends(get_api_key)):
+    """
+    Perfil de muestreo de una petición hecha con X-Profile: true, en formato 'folded'
+    (flamegraph.pl, speedscope). Solo para ADMIN_CLIENTS
+    """
+    if client.name not in ADMIN_CLIENTS:
+        raise HTTPException(status_code=403, detail="Solo los clientes administradores (ADMIN_CLIENTS) pueden leer perfiles")
+    trace = visible_trace(trace_id, client)
+    if not trace.profile_path or not os.path.exists(trace.profile_path):
+        raise HTTPException(status_code=404, detail="La petición no tiene perfil")
+    with open(trace.profile_path, encoding="utf-8") as f:
+        return Response(content=f.read(), media_type="text/plain; charset=utf-8")
 
 if __name__ == "__main__":
     import uvicorn
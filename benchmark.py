@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de rendimiento para AudioTrans
+Mide etapas del pipeline sobre audio real o sintético sin necesidad de levantar la API
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+
+def generate_synthetic_audio(output_path, duration_seconds, pauses=False):
+    """
+    Genera un .m4a sintético (tono + ruido) de la duración indicada usando ffmpeg.
+    Con pauses=True se silencian 2 de cada 10 segundos para ejercitar la segmentación por silencios
+    """
+    filters = "amix=inputs=2:duration=shortest,aformat=channel_layouts=stereo"
+    if pauses:
+        filters += ",volume=volume=0:enable='gte(mod(t,10),8)'"
+    cmd = [
+        "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration_seconds}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:sample_rate=44100:duration={duration_seconds}",
+        "-filter_complex", filters,
+        "-c:a", "aac", "-b:a", "96k", output_path
+    ]
+    subprocess.run(cmd, check=True)
+    return output_path
+
+
+def current_rss_bytes():
+    """Memoria residente actual del proceso"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceMonitor:
+    """
+    Muestrea el proceso y un directorio mientras dura el bloque 'with' y registra
+    el pico de memoria residente, el pico de ocupación en disco y el total de bytes
+    escritos en archivos temporales
+    """
+
+    def __init__(self, directory, interval=0.01):
+        self.directory = directory
+        self.interval = interval
+        self.peak_bytes = 0
+        self.peak_rss_bytes = 0
+        self.wall_time_s = 0.0
+        self._file_sizes = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def written_bytes(self):
+        return sum(self._file_sizes.values())
+
+    def _sample(self):
+        self.peak_rss_bytes = max(self.peak_rss_bytes, current_rss_bytes())
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                total += size
+                self._file_sizes[path] = max(size, self._file_sizes.get(path, 0))
+        self.peak_bytes = max(self.peak_bytes, total)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_time_s = time.perf_counter() - self._start
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def legacy_split_and_decode(audio_path, segment_duration=300):
+    """
+    Camino anterior: pydub decodifica el archivo, cada segmento se exporta a .wav
+    y Whisper vuelve a decodificar cada .wav con ffmpeg antes de transcribir
+    """
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(audio_path)
+    segment_duration_ms = segment_duration * 1000
+    temp_dir = tempfile.mkdtemp()
+
+    segments = []
+    for i in range(0, len(audio), segment_duration_ms):
+        segment_path = os.path.join(temp_dir, f"segment_{i//segment_duration_ms:03d}.wav")
+        audio[i:i + segment_duration_ms].export(segment_path, format="wav")
+        # Equivalente a lo que hacía whisper_model.transcribe(segment_path) antes de inferir
+        segments.append(app.decode_audio(segment_path))
+    return segments
+
+
+def bench_decode(args, audio_path, scratch_dir):
+    """Compara el camino pydub + .wav con la decodificación única a float32 en memoria"""
+    variants = {
+        "legacy_pydub_wav": legacy_split_and_decode,
+        "decode_once_float32": lambda path, duration: app.split_audio(path, duration, "fixed"),
+    }
+    results = {}
+
+    for name, split in variants.items():
+        variant_dir = os.path.join(scratch_dir, name)
+        os.makedirs(variant_dir)
+        tempfile.tempdir = variant_dir
+        try:
+            timings = []
+            for _ in range(args.repeat):
+                with ResourceMonitor(variant_dir) as monitor:
+                    segments = split(audio_path, args.segment_duration)
+                timings.append(monitor.wall_time_s)
+            results[name] = {
+                "wall_time_s": round(min(timings), 3),
+                "segments": len(segments),
+                "peak_rss_mb": round(monitor.peak_rss_bytes / 1e6, 1),
+                "temp_disk_written_bytes": monitor.written_bytes,
+                "temp_disk_peak_bytes": monitor.peak_bytes,
+            }
+        finally:
+            tempfile.tempdir = None
+
+    legacy, current = results["legacy_pydub_wav"], results["decode_once_float32"]
+    results["speedup"] = round(legacy["wall_time_s"] / max(current["wall_time_s"], 1e-9), 2)
+    results["disk_bytes_saved"] = legacy["temp_disk_written_bytes"] - current["temp_disk_written_bytes"]
+
+    print(f"{'Variante':<22} {'Tiempo (s)':>11} {'Segmentos':>10} {'Disco escrito (MB)':>19}")
+    for name in variants:
+        r = results[name]
+        print(f"{name:<22} {r['wall_time_s']:>11.3f} {r['segments']:>10} {r['temp_disk_written_bytes'] / 1e6:>19.1f}")
+    print(f"⚡ Aceleración: x{results['speedup']}  💾 Disco ahorrado: {results['disk_bytes_saved'] / 1e6:.1f}MB")
+    return results
+
+
+class StubWhisperModel:
+    """
+    Modelo determinista con la interfaz de Whisper: devuelve dos palabras por segundo
+    de audio y, opcionalmente, simula el coste de inferencia con un factor de tiempo real
+    """
+
+    is_multilingual = False  # detect_language devuelve "en" sin importar whisper ni ejecutar el modelo
+
+    def __init__(self, rtf=0.0):
+        self.rtf = rtf
+
+    def transcribe(self, audio, **kwargs):
+        duration = len(audio) / app.SAMPLE_RATE
+        if self.rtf:
+            time.sleep(duration * self.rtf)
+        text = " ".join(["palabra"] * max(1, int(duration * 2)))
+        return {"text": text, "segments": [{"start": 0.0, "end": duration, "text": text}], "language": "es"}
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """Endpoint /chat/completions compatible con OpenAI que responde sin llamar a la red"""
+
+    latency = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+        content = f"Respuesta simulada ({len(body['messages'][0]['content'])} caracteres de entrada)"
+        data = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def fake_chat_server(latency=0.0):
+    """Levanta el endpoint de chat simulado en un puerto libre y devuelve su URL base"""
+    handler = type("Handler", (FakeChatHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/v1"
+    finally:
+        server.shutdown()
+
+
+def load_benchmark_model(name, stub_rtf):
+    """Prepara el modelo del pipeline: 'stub' (determinista) o un modelo Whisper real"""
+    # El modelo pasa a ser el modelo por defecto del servicio; los workers (spawn) lo leen del entorno
+    os.environ["WHISPER_MODEL"] = name
+    app.WHISPER_MODEL = name
+    app.model_registry = app.ModelRegistry(name, [name], app.MODEL_MEMORY_BUDGET)
+    if name == "stub":
+        app.segment_process_pool = None
+        app.model_registry.register(name, StubWhisperModel(stub_rtf))
+    elif app.WHISPER_WORKERS > 1:
+        app.start_segment_process_pool()
+    else:
+        app.model_registry.get(name)
+
+
+def stage_metrics(monitor, audio_seconds):
+    return {
+        "wall_time_s": round(monitor.wall_time_s, 3),
+        "real_time_factor": round(monitor.wall_time_s / audio_seconds, 4) if audio_seconds else None,
+        "peak_rss_mb": round(monitor.peak_rss_bytes / 1e6, 1),
+        "temp_disk_written_bytes": monitor.written_bytes,
+        "temp_disk_peak_bytes": monitor.peak_bytes,
+    }
+
+
+def bench_pipeline(args, audio_path, scratch_dir):
+    """
+    Ejecuta por etapas la decodificación (file_segments), la decodificación con la transcripción
+    (transcribe_file_segments, el camino de los archivos guardados), el procesamiento con el chat
+    y el camino completo de /transcribe, con un modelo stub o real y un chat simulado local
+    """
+    from fastapi.testclient import TestClient
+
+    load_benchmark_model(args.model, args.stub_rtf)
+    # Sin caché: cada repetición debe recorrer el pipeline completo
+    app.transcript_cache = None
+    app.segment_cache = None
+    app.chat_cache = None
+    app.SEGMENT_DURATION = args.segment_duration
+    # Directorio propio para medir solo los temporales que crea el pipeline (no el audio de entrada)
+    work_dir = os.path.join(scratch_dir, "work")
+    os.makedirs(work_dir, exist_ok=True)
+    tempfile.tempdir = work_dir
+    # /transcribe guarda la subida en el espacio temporal de la petición, no en tempfile
+    app.scratch_space = app.ScratchSpace(work_dir, app.SCRATCH_QUOTA)
+
+    audio_seconds = len(app.decode_audio(audio_path)) / app.SAMPLE_RATE
+    stages = {}
+
+    with fake_chat_server(args.chat_latency) as chat_url:
+        app.OPENAI_API_KEY = "benchmark"
+        app.OPENAI_BASE_URL = chat_url
+
+        def run_stage(name, func):
+            best, result = None, None
+            for _ in range(args.repeat):
+                # Cliente nuevo en cada ejecución: cada asyncio.run usa su propio event loop
+                app.openai_client = None
+                with ResourceMonitor(work_dir) as monitor:
+                    result = func()
+                if best is None or monitor.wall_time_s < best.wall_time_s:
+                    best = monitor
+            stages[name] = stage_metrics(best, audio_seconds)
+            return result
+
+        async def decode():
+            return [segment async for segment in app.file_segments(audio_path)]
+
+        segments = run_stage("split", lambda: asyncio.run(decode()))
+        results = run_stage(
+            "transcribe",
+            lambda: asyncio.run(app.transcribe_file_segments(audio_path, args.model, app.resolve_language(None)))
+        )
+        text, _ = app.merge_segment_results(results)
+        run_stage("chat", lambda: asyncio.run(app.process_with_openai_chat(text)))
+
+        client = TestClient(app.app)
+
+        def transcribe_request():
+            with open(audio_path, "rb") as f:
+                response = client.post(
+                    "/transcribe",
+                    files={"file": ("benchmark.m4a", f, "audio/mp4")},
+                    headers={"X-API-Key": app.API_KEY}
+                )
+            response.raise_for_status()
+            return response.json()
+
+        run_stage("end_to_end", transcribe_request)
+
+    tempfile.tempdir = None
+
+    print(f"{'Etapa':<12} {'Tiempo (s)':>11} {'RTF':>8} {'RSS pico (MB)':>14} {'Disco temp (MB)':>16}")
+    for name, r in stages.items():
+        print(
+            f"{name:<12} {r['wall_time_s']:>11.3f} {r['real_time_factor']:>8.4f} "
+            f"{r['peak_rss_mb']:>14.1f} {r['temp_disk_written_bytes'] / 1e6:>16.1f}"
+        )
+
+    return {
+        "model": args.model,
+        "audio_seconds": round(audio_seconds, 2),
+        "segments": len(segments),
+        "segmentation_mode": app.SEGMENTATION_MODE,
+        "stages": stages,
+    }
+
+
+def run_memory_variant(audio_path, windowed, segment_duration):
+    """Decodifica y transcribe un archivo con el modelo stub; se ejecuta en un proceso nuevo para medir su pico de memoria"""
+    import resource
+
+    load_benchmark_model("stub", 0.0)
+    app.segment_cache = None
+    app.WINDOWED_DECODE = windowed
+    app.SEGMENT_DURATION = segment_duration
+    baseline = current_rss_bytes()
+
+    start = time.perf_counter()
+    results = asyncio.run(app.transcribe_file_segments(audio_path, "stub", "es"))
+    wall_time = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        "wall_time_s": round(wall_time, 3),
+        "segments": len(results),
+        "baseline_rss_mb": round(baseline / 1e6, 1),
+        "peak_rss_mb": round(peak / 1e6, 1),
+        "peak_rss_growth_mb": round((peak - baseline) / 1e6, 1),
+    }
+
+
+def bench_memory(args, audio_path, scratch_dir):
+    """
+    Pico de memoria de la decodificación + transcripción (modelo stub) según la duración del audio,
+    decodificando el archivo entero o por ventanas. Con ventanas el pico no debe crecer con la duración
+    """
+    if args.input:
+        inputs = {round(app.probe_duration(audio_path)): audio_path}
+    else:
+        inputs = {}
+        for duration in sorted(int(d) for d in args.durations.split(",")):
+            if duration == args.duration:
+                inputs[duration] = audio_path  # ya generado con --duration
+                continue
+            path = os.path.join(scratch_dir, f"memory-{duration}s.m4a")
+            print(f"🎵 Generando audio sintético de {duration}s...")
+            inputs[duration] = generate_synthetic_audio(path, duration, args.pauses)
+
+    rows = {}
+    for duration, path in inputs.items():
+        for mode, windowed in (("full", False), ("windowed", True)):
+            print(f"🔬 {duration}s, decodificación '{mode}'...")
+            # Un proceso por variante: el pico de memoria (ru_maxrss) solo puede medirse una vez por proceso
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                rows[f"{duration}s_{mode}"] = {
+                    "duration_s": duration,
+                    "decode": mode,
+                    **executor.submit(run_memory_variant, path, windowed, args.segment_duration).result(),
+                }
+
+    print(f"{'Duración (s)':>12} {'Decodificación':<15} {'Tiempo (s)':>11} {'Segmentos':>10} {'RSS pico (MB)':>14} {'Crecimiento (MB)':>17}")
+    for r in rows.values():
+        print(
+            f"{r['duration_s']:>12} {r['decode']:<15} {r['wall_time_s']:>11.2f} {r['segments']:>10} "
+            f"{r['peak_rss_mb']:>14.1f} {r['peak_rss_growth_mb']:>17.1f}"
+        )
+
+    # Relación entre el crecimiento de memoria con el audio más largo y con el más corto
+    shortest, longest = min(inputs), max(inputs)
+    growth = {
+        mode: round(
+            rows[f"{longest}s_{mode}"]["peak_rss_growth_mb"] / max(rows[f"{shortest}s_{mode}"]["peak_rss_growth_mb"], 1.0), 2
+        )
+        for mode in ("full", "windowed")
+    }
+    print(f"📈 Crecimiento de memoria de {shortest}s a {longest}s: completo x{growth['full']}, por ventanas x{growth['windowed']}")
+    return {"segment_duration_s": args.segment_duration, "runs": rows, "growth_ratio": growth}
+
+
+AUDIO_EXTENSIONS = (".m4a", ".mp3", ".wav", ".flac", ".ogg")
+
+
+def load_corpus(path):
+    """
+    Lista de (audio, transcripción de referencia) a partir de un archivo o un directorio.
+    La referencia es el .txt con el mismo nombre que el audio (None si no existe)
+    """
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(path, n) for n in os.listdir(path) if n.lower().endswith(AUDIO_EXTENSIONS))
+    corpus = []
+    for audio_file in files:
+        reference_path = os.path.splitext(audio_file)[0] + ".txt"
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, "r", encoding="utf-8") as f:
+                reference = f.read()
+        corpus.append((audio_file, reference))
+    return corpus
+
+
+def word_errors(reference, hypothesis):
+    """Distancia de edición por palabras (sustituciones, inserciones y borrados) y número de palabras de referencia"""
+    ref = re.findall(r"\w+", reference.lower())
+    hyp = re.findall(r"\w+", hypothesis.lower())
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1], len(ref)
+
+
+def corpus_wer(references, hypotheses):
+    """WER agregado sobre los archivos que tienen referencia (None si no hay ninguno)"""
+    edits = words = 0
+    for path, reference in references.items():
+        if reference is not None:
+            e, w = word_errors(reference, hypotheses[path])
+            edits, words = edits + e, words + w
+    return round(edits / words, 4) if words else None
+
+
+def run_quantization_variant(model_name, quantization, corpus):
+    """Carga el modelo con la cuantización indicada y transcribe el corpus; se ejecuta en un proceso nuevo"""
+    import resource
+
+    app.configure_torch_threads()
+    start = time.perf_counter()
+    model = app.load_whisper(model_name, quantization)
+    load_time = time.perf_counter() - start
+    rss_after_load = current_rss_bytes()
+    app.warm_up_model(model)
+
+    transcripts, inference_time, audio_seconds = {}, 0.0, 0.0
+    for audio_file, _ in corpus:
+        audio = app.decode_audio(audio_file)
+        audio_seconds += len(audio) / app.SAMPLE_RATE
+        start = time.perf_counter()
+        transcripts[audio_file] = model.transcribe(audio)["text"].strip()
+        inference_time += time.perf_counter() - start
+
+    return {
+        "load_time_s": round(load_time, 3),
+        "inference_time_s": round(inference_time, 3),
+        "audio_seconds": round(audio_seconds, 2),
+        "real_time_factor": round(inference_time / audio_seconds, 4) if audio_seconds else None,
+        "model_memory_mb": round(app.model_memory_bytes(model) / 1e6, 1),
+        "rss_after_load_mb": round(rss_after_load / 1e6, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 1e6, 1),
+        "transcripts": transcripts,
+    }
+
+
+def bench_quantization(args, audio_path, scratch_dir):
+    """
+    Compara el modelo fp32 con su versión cuantizada en int8 sobre un corpus fijo:
+    tiempo de inferencia, memoria y WER (frente a las referencias .txt y frente a fp32)
+    """
+    if args.model == "stub":
+        raise SystemExit("❌ El benchmark 'quantization' necesita un modelo Whisper real (por ejemplo --model small)")
+
+    corpus = load_corpus(audio_path)
+    references = dict(corpus)
+    variants = {}
+    for quantization in ("none", "int8"):
+        print(f"🔬 Variante '{quantization}' ({len(corpus)} archivos)...")
+        # Un proceso por variante para que la memoria de una no contamine la de la otra
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            variants[quantization] = executor.submit(run_quantization_variant, args.model, quantization, corpus).result()
+
+    fp32_transcripts = variants["none"]["transcripts"]
+    for variant in variants.values():
+        transcripts = variant.pop("transcripts")
+        variant["wer"] = corpus_wer(references, transcripts)
+        variant["wer_vs_fp32"] = corpus_wer(fp32_transcripts, transcripts)
+    if variants["int8"]["inference_time_s"]:
+        variants["int8"]["speedup_vs_fp32"] = round(variants["none"]["inference_time_s"] / variants["int8"]["inference_time_s"], 2)
+
+    print(f"{'Variante':<10} {'Inferencia (s)':>15} {'RTF':>8} {'Modelo (MB)':>12} {'RSS pico (MB)':>14} {'WER':>7} {'WER vs fp32':>12}")
+    for name, v in variants.items():
+        wer = f"{v['wer']:.3f}" if v["wer"] is not None else "-"
+        print(
+            f"{name:<10} {v['inference_time_s']:>15.2f} {v['real_time_factor'] or 0:>8.4f} {v['model_memory_mb']:>12.1f} "
+            f"{v['peak_rss_mb']:>14.1f} {wer:>7} {v['wer_vs_fp32']:>12.3f}"
+        )
+
+    return {"model": args.model, "files": len(corpus), "variants": variants}
+
+
+CONTEXT_VARIANTS = ("per_segment", "language_once", "language_and_context")
+
+
+def run_context_variant(model, segments, variant):
+    """
+    Transcribe los segmentos de un archivo en orden: 'per_segment' como antes (Whisper detecta
+    el idioma en cada segmento, sin contexto), 'language_once' con el idioma detectado una vez y
+    'language_and_context' además con el final de cada segmento como initial_prompt del siguiente
+    """
+    language, detect_time = None, 0.0
+    if variant != "per_segment":
+        start = time.perf_counter()
+        language = app.detect_segments_language(segments, app.WHISPER_MODEL)
+        detect_time = time.perf_counter() - start
+
+    texts, initial_prompt = [], None
+    start = time.perf_counter()
+    for i, segment in enumerate(segments):
+        result = app.transcribe_segment(model, segment, i, len(segments), language, initial_prompt)
+        texts.append(result["text"])
+        if variant == "language_and_context":
+            initial_prompt = app.context_prompt(result["text"])
+    return " ".join(t for t in texts if t), detect_time, time.perf_counter() - start
+
+
+def bench_context(args, audio_path, scratch_dir):
+    """
+    Mide el efecto de detectar el idioma una vez por archivo y de pasar contexto entre segmentos:
+    tiempo de detección y de transcripción, y WER frente a las referencias y frente a 'per_segment'
+    """
+    if args.model == "stub":
+        raise SystemExit("❌ El benchmark 'context' necesita un modelo Whisper real (por ejemplo --model small)")
+
+    app.configure_torch_threads()
+    app.WHISPER_MODEL = args.model
+    app.model_registry = app.ModelRegistry(args.model, [args.model], app.MODEL_MEMORY_BUDGET)
+    model = app.model_registry.get(args.model)
+    app.warm_up_model(model)
+
+    corpus = load_corpus(audio_path)
+    references = dict(corpus)
+    segments_by_file = {audio_file: app.split_audio(audio_file, args.segment_duration) for audio_file, _ in corpus}
+    audio_seconds = sum(len(s.audio) for segments in segments_by_file.values() for s in segments) / app.SAMPLE_RATE
+
+    variants = {}
+    for variant in CONTEXT_VARIANTS:
+        print(f"🔬 Variante '{variant}' ({len(corpus)} archivos, {sum(map(len, segments_by_file.values()))} segmentos)...")
+        transcripts, detect_time, transcribe_time = {}, 0.0, 0.0
+        for audio_file, segments in segments_by_file.items():
+            transcripts[audio_file], detect_s, transcribe_s = run_context_variant(model, segments, variant)
+            detect_time += detect_s
+            transcribe_time += transcribe_s
+        variants[variant] = {
+            "detect_time_s": round(detect_time, 3),
+            "transcribe_time_s": round(transcribe_time, 3),
+            "total_time_s": round(detect_time + transcribe_time, 3),
+            "real_time_factor": round((detect_time + transcribe_time) / audio_seconds, 4) if audio_seconds else None,
+            "transcripts": transcripts,
+        }
+
+    baseline = variants["per_segment"]
+    baseline_transcripts = baseline["transcripts"]
+    for variant in variants.values():
+        transcripts = variant.pop("transcripts")
+        variant["wer"] = corpus_wer(references, transcripts)
+        variant["wer_vs_per_segment"] = corpus_wer(baseline_transcripts, transcripts)
+        if variant["total_time_s"]:
+            variant["speedup_vs_per_segment"] = round(baseline["total_time_s"] / variant["total_time_s"], 2)
+
+    print(f"{'Variante':<22} {'Detección (s)':>14} {'Transcripción (s)':>18} {'RTF':>8} {'WER':>7} {'WER vs antes':>13}")
+    for name, v in variants.items():
+        wer = f"{v['wer']:.3f}" if v["wer"] is not None else "-"
+        print(
+            f"{name:<22} {v['detect_time_s']:>14.2f} {v['transcribe_time_s']:>18.2f} "
+            f"{v['real_time_factor'] or 0:>8.4f} {wer:>7} {v['wer_vs_per_segment']:>13.3f}"
+        )
+
+    return {
+        "model": args.model,
+        "files": len(corpus),
+        "segment_duration_s": args.segment_duration,
+        "audio_seconds": round(audio_seconds, 2),
+        "context_prompt_chars": app.CONTEXT_PROMPT_CHARS,
+        "variants": variants,
+    }
+
+
+def flatten_numbers(data, prefix=""):
+    """Aplana un diccionario anidado a {'a.b.c': valor} conservando solo los valores numéricos"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_numbers(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_results(baseline, current):
+    """Muestra la variación de cada métrica numérica respecto a un resultado anterior"""
+    old = flatten_numbers(baseline.get("results", {}))
+    new = flatten_numbers(current.get("results", {}))
+    print(f"\n📈 Comparación con {baseline.get('metadata', {}).get('timestamp', 'resultado anterior')}")
+    print(f"{'Métrica':<45} {'Anterior':>12} {'Actual':>12} {'Cambio':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{key:<45} {before:>12.4g} {after:>12.4g} {change:>9}")
+
+
+def run_metadata():
+    """Datos del entorno para poder comparar resultados entre versiones"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+BENCHMARKS = {
+    "context": bench_context,
+    "decode": bench_decode,
+    "memory": bench_memory,
+    "pipeline": bench_pipeline,
+    "quantization": bench_quantization,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de rendimiento de AudioTrans")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Benchmark a ejecutar")
+    parser.add_argument("--input", help="Archivo de audio a usar, o directorio de corpus para 'quantization' y 'context' (por defecto se genera uno sintético)")
+    parser.add_argument("--duration", type=int, default=600, help="Duración en segundos del audio sintético")
+    parser.add_argument("--durations", default="600,3600,14400", help="Duraciones en segundos de los audios sintéticos de 'memory' (separadas por comas)")
+    parser.add_argument("--segment-duration", type=int, default=300, help="Duración de cada segmento en segundos")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por variante (se reporta la mejor)")
+    parser.add_argument("--pauses", action="store_true", help="Incluir silencios en el audio sintético")
+    parser.add_argument("--model", default="stub", help="Modelo para 'pipeline' ('stub' o un modelo Whisper: tiny, base...), 'quantization' y 'context'")
+    parser.add_argument("--stub-rtf", type=float, default=0.0, help="Factor de tiempo real simulado por el modelo stub")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Latencia en segundos del chat simulado")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultado JSON anterior con el que comparar")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix="audiotrans-bench-")
+    try:
+        audio_path = args.input
+        if not audio_path:
+            audio_path = os.path.join(scratch_dir, "synthetic.m4a")
+            print(f"🎵 Generando audio sintético de {args.duration}s...")
+            generate_synthetic_audio(audio_path, args.duration, args.pauses)
+
+        print(f"📊 Benchmark '{args.benchmark}' sobre {audio_path}")
+        results = {
+            "benchmark": args.benchmark,
+            "metadata": run_metadata(),
+            "input": os.path.basename(audio_path),
+            "duration_s": args.duration if not args.input else None,
+            "results": BENCHMARKS[args.benchmark](args, audio_path, scratch_dir),
+        }
+
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                compare_results(json.load(f), results)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"💾 Resultados guardados en: {args.output}")
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Configuración común de las pruebas. app.py lee su configuración del entorno al importarse,
+así que se fija aquí, antes de que ninguna prueba lo importe
+"""
+
+import os
+import sys
+import tempfile
+
+import httpx
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["TEMP_DIR"] = tempfile.mkdtemp(prefix="audiotrans-tests-")
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["API_KEYS"] = ""
+os.environ["SPOOL_DIR"] = ""
+os.environ["WHISPER_WORKERS"] = "1"
+os.environ["WHISPER_BATCHING"] = "false"
+
+import app  # noqa: E402
+
+
+class FakeWhisperModel:
+    """Modelo con la interfaz de Whisper: el texto de cada segmento sale de su primera muestra"""
+
+    is_multilingual = False
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)  # segmentos (por su primera muestra) que fallan siempre
+        self.calls = []
+
+    def transcribe(self, audio, language=None, initial_prompt=None):
+        segment = int(round(audio[0] * 10))
+        self.calls.append(segment)
+        if segment in self.failing:
+            raise RuntimeError(f"fallo simulado en el segmento {segment}")
+        text = f"segmento {segment}"
+        return {"text": text, "segments": [{"start": 0.0, "end": len(audio) / app.SAMPLE_RATE, "text": text}]}
+
+
+def make_segments(count, seconds=1):
+    """Segmentos distintos y consecutivos: el i-ésimo tiene todas sus muestras a (i + 1) / 10"""
+    length = seconds * app.SAMPLE_RATE
+    return [
+        app.AudioChunk(np.full(length, (i + 1) / 10, dtype=np.float32), ((i * length, (i + 1) * length),))
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Registra FakeWhisperModel como modelo por defecto de un registro nuevo"""
+    registry = app.ModelRegistry(app.WHISPER_MODEL, [app.WHISPER_MODEL], 0)
+    monkeypatch.setattr(app, "model_registry", registry)
+
+    def install(**kwargs):
+        model = FakeWhisperModel(**kwargs)
+        registry.register(app.WHISPER_MODEL, model)
+        return model
+
+    return install
+
+
+API_KEY = "clave-de-pruebas"
+
+
+@pytest.fixture
+def api_client(monkeypatch):
+    """Única clave válida de la API, sin cuota"""
+    client = app.ApiClient("tests", API_KEY, 0.0, 1.0)
+    monkeypatch.setattr(app, "api_clients", {API_KEY: client})
+    monkeypatch.setattr(app, "api_clients_by_name", {client.name: client})
+    return client
+
+
+def http_client():
+    """Cliente HTTP contra la aplicación, sin los eventos de arranque (ni modelo ni workers)"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test")
+
+
+def multipart_body(files=(), fields=None, boundary="limite-de-pruebas"):
+    """Cuerpo multipart/form-data con files [(campo, nombre, bytes)] y campos de texto; devuelve (content-type, cuerpo)"""
+    body = bytearray()
+    for name, value in (fields or {}).items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for field, filename, data in files:
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        body += data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return f"multipart/form-data; boundary={boundary}", bytes(body)
+
+
+@pytest.fixture
+def fake_audio(monkeypatch):
+    """Audio sin ffmpeg: un archivo 'segmentos:N' dura N segundos y se divide en N segmentos; el resto es ilegible"""
+    def segment_count(path):
+        with open(path, "rb") as f:
+            content = f.read()
+        if not content.startswith(b"segmentos:"):
+            raise RuntimeError("Invalid data found when processing input")
+        return int(content.split(b":")[1])
+
+    async def file_segments(path):
+        for segment in make_segments(segment_count(path)):
+            yield segment
+
+    monkeypatch.setattr(app, "probe_duration", segment_count)
+    monkeypatch.setattr(app, "file_segments", file_segments)
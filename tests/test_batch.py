@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app
+from conftest import API_KEY, http_client, multipart_body
+
+
+def read_all(reader, body, chunk_size):
+    """Pasa el cuerpo al lector en bloques de chunk_size y junta los bytes de cada archivo"""
+    files = {}
+    for offset in range(0, len(body), chunk_size):
+        for index, data in reader.feed_parts(body[offset:offset + chunk_size]):
+            files[index] = files.get(index, b"") + data
+    return files
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_reader_extracts_every_file_and_text_field(chunk_size):
+    content_type, body = multipart_body(
+        [("files", "a.m4a", b"primero"), ("otro", "x.m4a", b"ignorado"), ("files", "b.m4a", b"segundo" * 100)],
+        fields={"manifest": "uno.m4a\ndos.m4a"}
+    )
+    reader = app.MultipartFileReader(content_type, field="files", multiple=True)
+
+    files = read_all(reader, body, chunk_size)
+
+    assert reader.filenames == ["a.m4a", "b.m4a"]
+    assert files == {0: b"primero", 1: b"segundo" * 100}
+    assert reader.fields == {"manifest": "uno.m4a\ndos.m4a"}
+
+
+def test_single_file_reader_keeps_only_the_first_file():
+    content_type, body = multipart_body([("file", "a.m4a", b"primero"), ("file", "b.m4a", b"segundo")])
+    reader = app.MultipartFileReader(content_type)
+
+    assert reader.feed(body) == [b"primero"]
+    assert reader.filename == "a.m4a"
+
+
+def test_reader_rejects_bodies_that_are_not_multipart():
+    with pytest.raises(HTTPException) as rejected:
+        app.MultipartFileReader("application/json")
+    assert rejected.value.status_code == 400
+
+
+def test_reader_limits_text_fields():
+    content_type, body = multipart_body(fields={"manifest": "x" * (app.MULTIPART_OVERHEAD + 1)})
+    reader = app.MultipartFileReader(content_type, field="files", multiple=True)
+
+    with pytest.raises(HTTPException) as rejected:
+        reader.feed(body)
+    assert rejected.value.status_code == 413
+
+
+@pytest.fixture
+def batch(monkeypatch, fake_model, fake_audio, api_client):
+    fake_model()
+    monkeypatch.setattr(app, "inference_pool", app.InferencePool(1, 0))
+    monkeypatch.setattr(app, "transcript_cache", None)
+    monkeypatch.setattr(app, "segment_cache", None)
+    monkeypatch.setattr(app, "MAX_FILE_SIZE", 1024)
+
+
+def post_batch(files=(), fields=None):
+    content_type, body = multipart_body(files, fields)
+
+    async def run():
+        async with http_client() as http:
+            return await http.post(
+                "/transcribe/batch", content=body, headers={"X-API-Key": API_KEY, "Content-Type": content_type}
+            )
+
+    return asyncio.run(run())
+
+
+def test_failed_files_do_not_stop_the_rest_of_the_batch(batch):
+    response = post_batch([
+        ("files", "bueno.m4a", b"segmentos:3"),
+        ("files", "notas.txt", b"segmentos:1"),
+        ("files", "vacio.m4a", b""),
+        ("files", "roto.m4a", b"basura"),
+        ("files", "grande.m4a", b"segmentos:1" + b"\0" * 2048),
+        ("files", "corto.m4a", b"segmentos:1"),
+    ])
+
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["status"] == "partial"
+    assert payload["summary"]["succeeded"] == 2
+    assert payload["summary"]["failed"] == 4
+    files = {entry["filename"]: entry for entry in payload["files"]}
+    assert files["bueno.m4a"]["raw_transcription"] == "segmento 1 segmento 2 segmento 3"
+    assert files["corto.m4a"]["raw_transcription"] == "segmento 1"
+    assert files["notas.txt"]["detail"] == "Solo se aceptan archivos .m4a"
+    assert files["vacio.m4a"]["detail"] == "Archivo vacío"
+    assert files["roto.m4a"]["detail"].startswith("No se pudo leer el archivo")
+    assert files["grande.m4a"]["detail"].startswith("Archivo demasiado grande")
+    assert all(files[name]["status"] == "error" for name in ("notas.txt", "vacio.m4a", "roto.m4a", "grande.m4a"))
+
+
+def test_batch_without_files_or_manifest_is_rejected(batch):
+    response = post_batch(fields={"manifest": "  \n\n"})
+
+    assert response.status_code == 400
+    assert "manifest" in response.json()["detail"]
+
+
+def test_manifest_requires_batch_input_dir(batch, monkeypatch):
+    monkeypatch.setattr(app, "BATCH_INPUT_DIR", "")
+
+    response = post_batch(fields={"manifest": "reunion.m4a"})
+
+    assert response.status_code == 400
+    assert "BATCH_INPUT_DIR" in response.json()["detail"]
+
+
+def test_manifest_paths_outside_the_input_dir_are_rejected(batch, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "BATCH_INPUT_DIR", str(tmp_path / "entrada"))
+
+    response = post_batch(fields={"manifest": "../secreto.m4a"})
+
+    assert response.status_code == 400
+    assert "fuera de BATCH_INPUT_DIR" in response.json()["detail"]
+
+
+def test_invalid_manifest_entries_fail_individually(batch, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "BATCH_INPUT_DIR", str(tmp_path))
+    (tmp_path / "reunion.m4a").write_bytes(b"segmentos:2")
+
+    response = post_batch(fields={"manifest": " reunion.m4a \nno-existe.m4a\n\nnotas.txt\n"})
+
+    payload = response.json()
+    assert response.status_code == 200
+    files = {entry["filename"]: entry for entry in payload["files"]}
+    assert files["reunion.m4a"]["raw_transcription"] == "segmento 1 segmento 2"
+    assert files["no-existe.m4a"]["detail"] == "El archivo no existe"
+    assert files["notas.txt"]["detail"] == "Solo se aceptan archivos .m4a"
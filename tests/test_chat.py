@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app
+
+
+class ChatStub:
+    """API compatible con /chat/completions: responde con las respuestas encoladas y después con 200"""
+
+    def __init__(self, responses=(), partial=None):
+        self.responses = list(responses)
+        self.partial = partial  # texto de las respuestas parciales; por defecto 'parcial N'
+        self.prompts = []
+
+    def __call__(self, request):
+        content = json.loads(request.content)["messages"][0]["content"]
+        self.prompts.append(content)
+        if self.responses:
+            return self.responses.pop(0)
+        if content.startswith(app.REDUCE_PROMPT.split("{")[0]):
+            return self.reply("respuesta combinada")
+        return self.reply(self.partial or f"parcial {len(self.prompts)}")
+
+    @staticmethod
+    def reply(text):
+        return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Instala un ChatStub como API de OpenAI y registra las esperas entre reintentos"""
+    stub = ChatStub()
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(app, "openai_client", httpx.AsyncClient(
+        transport=httpx.MockTransport(stub), base_url="http://openai.test/v1"
+    ))
+    monkeypatch.setattr(app.asyncio, "sleep", record_sleep)
+    monkeypatch.setattr(app, "OPENAI_MAX_RETRIES", 3)
+    stub.delays = delays
+    return stub
+
+
+def run(coroutine_function, *args):
+    async def main():
+        # El semáforo se crea al importar: uno nuevo para el event loop de cada prueba
+        app.openai_semaphore = asyncio.Semaphore(app.OPENAI_MAX_CONCURRENCY)
+        return await coroutine_function(*args)
+
+    return asyncio.run(main())
+
+
+def test_rate_limited_request_is_retried_after_retry_after(chat):
+    chat.responses = [httpx.Response(429, headers={"Retry-After": "7"})]
+
+    assert run(app.chat_completion, "hola") == "parcial 2"
+    assert len(chat.prompts) == 2
+    assert chat.delays == [7.0]
+
+
+def test_server_errors_are_retried_with_exponential_backoff(chat):
+    chat.responses = [httpx.Response(503)] * 4
+
+    with pytest.raises(RuntimeError, match="503"):
+        run(app.chat_completion, "hola")
+    assert len(chat.prompts) == app.OPENAI_MAX_RETRIES + 1
+    # Backoff 2^intento con jitter entre la mitad y el total
+    for attempt, delay in enumerate(chat.delays):
+        assert 2 ** attempt / 2 <= delay <= 2 ** attempt
+
+
+def test_client_errors_are_not_retried(chat):
+    chat.responses = [httpx.Response(400, text="petición inválida")]
+
+    with pytest.raises(RuntimeError, match="400"):
+        run(app.chat_completion, "hola")
+    assert len(chat.prompts) == 1
+
+
+def test_short_transcript_is_sent_in_one_request(chat):
+    assert run(app.map_reduce_chat, "Una frase corta.", "Resume:") == "parcial 1"
+    assert chat.prompts == ["Resume:\n\nUna frase corta."]
+
+
+def test_long_transcript_is_split_and_the_partials_are_combined(chat, monkeypatch):
+    monkeypatch.setattr(app, "OPENAI_CONTEXT_TOKENS", 600)
+    monkeypatch.setattr(app, "OPENAI_MAX_TOKENS", 100)
+    sentences = [f"Esta es la frase número {i} de una reunión muy larga." for i in range(200)]
+
+    assert run(app.map_reduce_chat, " ".join(sentences), "Resume:") == "respuesta combinada"
+
+    *partial_prompts, reduce_prompt = chat.prompts
+    assert len(partial_prompts) > 1
+    budget = app.input_token_budget("Resume:")
+    for prompt in partial_prompts:
+        chunk = prompt.split("\n\n", 2)[2]
+        assert app.count_tokens(chunk) <= budget
+    # Ninguna frase se pierde ni se repite al dividir
+    chunks = " ".join(prompt.split("\n\n", 2)[2] for prompt in partial_prompts)
+    assert chunks == " ".join(sentences)
+    # La combinación recibe todas las respuestas parciales en orden
+    assert reduce_prompt.startswith(app.REDUCE_PROMPT.format(prompt="Resume:"))
+    partials = [f"parcial {i + 1}" for i in range(len(partial_prompts))]
+    assert reduce_prompt.endswith("\n\n---\n\n".join(partials))
+
+
+def test_partials_that_do_not_fit_are_combined_in_levels(chat, monkeypatch):
+    monkeypatch.setattr(app, "OPENAI_CONTEXT_TOKENS", 400)
+    monkeypatch.setattr(app, "OPENAI_MAX_TOKENS", 50)
+    # Cada parcial ocupa casi media ventana del reduce: solo caben de dos en dos
+    chat.partial = "x" * 150
+    text = " ".join(f"Frase {i} con bastante texto de relleno para ocupar sitio." for i in range(60))
+
+    assert run(app.map_reduce_chat, text, "Resume:") == "respuesta combinada"
+    reduce_prompts = [prompt for prompt in chat.prompts if prompt.startswith(app.REDUCE_PROMPT.split("{")[0])]
+    assert len(reduce_prompts) > 1
+
+
+def test_chat_responses_are_cached(chat, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "OPENAI_API_KEY", "sk-pruebas")
+    monkeypatch.setattr(app, "chat_cache", app.DiskCache(str(tmp_path), 1024 * 1024, 3600))
+
+    first = run(app.process_with_openai_chat, "Una frase.", "Resume:")
+    second = run(app.process_with_openai_chat, "Una frase.", "Resume:")
+
+    assert first == second == "parcial 1"
+    assert len(chat.prompts) == 1
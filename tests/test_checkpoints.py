@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import app
+from conftest import make_segments
+
+
+@pytest.fixture
+def segment_cache(tmp_path, monkeypatch):
+    cache = app.DiskCache(str(tmp_path / "segments"), 10 * 1024 * 1024, 3600)
+    monkeypatch.setattr(app, "segment_cache", cache)
+    return cache
+
+
+def transcribe(segments):
+    async def run():
+        segments_queue = asyncio.Queue()
+        context = app.FileContext("es")
+        for segment in segments:
+            segments_queue.put_nowait((segment, context))
+        segments_queue.put_nowait(None)
+        return await app.transcribe_segment_queue(segments_queue, app.WHISPER_MODEL)
+
+    return asyncio.run(run())
+
+
+def test_failed_segment_is_retried_up_to_max_attempts(fake_model, segment_cache):
+    model = fake_model(failing={2})
+
+    results = transcribe(make_segments(3))
+
+    assert [r["text"] for r in results] == ["segmento 1", "", "segmento 3"]
+    assert "error" in results[1]
+    assert model.calls.count(2) == app.SEGMENT_MAX_ATTEMPTS
+
+
+def test_repeated_request_only_transcribes_missing_segments(fake_model, segment_cache):
+    segments = make_segments(4)
+    fake_model(failing={2})
+    transcribe(segments)
+
+    # El segmento 2 ahora sale bien y cambia el contexto que recibe el 3: su checkpoint sigue valiendo
+    model = fake_model()
+    results = transcribe(segments)
+
+    assert model.calls == [2]
+    assert [r["text"] for r in results] == ["segmento 1", "segmento 2", "segmento 3", "segmento 4"]
+    assert [bool(r.get("checkpoint")) for r in results] == [True, False, True, True]
+
+
+def test_without_cache_every_segment_is_transcribed(fake_model, monkeypatch):
+    monkeypatch.setattr(app, "segment_cache", None)
+    segments = make_segments(2)
+    fake_model()
+    transcribe(segments)
+
+    model = fake_model()
+    transcribe(segments)
+
+    assert model.calls == [1, 2]
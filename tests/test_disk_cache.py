@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+import app
+
+
+def age(cache, key, seconds):
+    """Retrasa el último uso de una entrada seconds segundos"""
+    path = cache._path(key)
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def entry_size(value):
+    return len(json.dumps(value).encode())
+
+
+def test_entries_are_returned_until_they_expire(tmp_path):
+    cache = app.DiskCache(str(tmp_path), 1024 * 1024, 60)
+    cache.set("a", {"text": "hola"})
+
+    assert cache.get("a") == {"text": "hola"}
+    age(cache, "a", 61)
+    assert cache.get("a") is None
+    assert not os.path.exists(cache._path("a"))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entries_are_removed_on_write(tmp_path):
+    cache = app.DiskCache(str(tmp_path), 1024 * 1024, 60)
+    cache.set("old", {"text": "viejo"})
+    age(cache, "old", 61)
+
+    cache.set("new", {"text": "nuevo"})
+
+    assert cache.stats()["entries"] == 1
+    assert not os.path.exists(cache._path("old"))
+
+
+def test_least_recently_used_entries_are_evicted_over_the_size_limit(tmp_path):
+    value = {"text": "x" * 100}
+    cache = app.DiskCache(str(tmp_path), 2 * entry_size(value), 3600)
+    cache.set("a", value)
+    cache.set("b", value)
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+    # Un acierto renueva el uso de "a": la menos usada pasa a ser "b"
+    assert cache.get("a") == value
+
+    cache.set("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c") == value
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = app.DiskCache(str(tmp_path), 1024 * 1024, 60)
+    with open(cache._path("a"), "w") as f:
+        f.write("{")
+
+    assert cache.get("a") is None
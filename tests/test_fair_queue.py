@@ -0,0 +1,73 @@
+import asyncio
+
+import app
+
+HEAVY = app.ApiClient("heavy", "k1", 0.0, 1.0)
+LIGHT = app.ApiClient("light", "k2", 0.0, 1.0)
+PRIORITY = app.ApiClient("priority", "k3", 0.0, 3.0)
+
+
+async def serve(queue, requests):
+    """Encola las peticiones (cliente, coste) en orden con un turno ocupado y devuelve el orden de servicio"""
+    served = []
+    await queue.acquire(None, 1.0)
+
+    async def request(label, client, cost):
+        async with queue.turn(client, cost):
+            served.append(label)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for label, client, cost in requests:
+        tasks.append(asyncio.create_task(request(label, client, cost)))
+        await asyncio.sleep(0)
+    assert queue.waiting == len(requests)
+    queue.release()
+    await asyncio.gather(*tasks)
+    return served
+
+
+def test_free_turns_are_granted_immediately():
+    async def run():
+        queue = app.FairQueue(2)
+        await queue.acquire(HEAVY, 1.0)
+        await queue.acquire(LIGHT, 1.0)
+        assert queue.active == 2 and queue.waiting == 0
+        queue.release()
+        queue.release()
+        assert queue.active == 0
+
+    asyncio.run(run())
+
+
+def test_backlogged_client_does_not_starve_others():
+    requests = [(f"heavy{i}", HEAVY, 1.0) for i in range(4)] + [("light0", LIGHT, 1.0), ("light1", LIGHT, 1.0)]
+
+    served = asyncio.run(serve(app.FairQueue(1), requests))
+
+    assert served == ["heavy0", "light0", "heavy1", "light1", "heavy2", "heavy3"]
+
+
+def test_weight_gives_a_larger_share():
+    requests = [(f"light{i}", LIGHT, 1.0) for i in range(3)] + [(f"priority{i}", PRIORITY, 1.0) for i in range(3)]
+
+    served = asyncio.run(serve(app.FairQueue(1), requests))
+
+    # Fines virtuales: priority 1/3, 2/3, 1; light 1, 2, 3 (a igual fin, el que llegó antes)
+    assert served == ["priority0", "priority1", "light0", "priority2", "light1", "light2"]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        queue = app.FairQueue(1)
+        await queue.acquire(HEAVY, 1.0)
+        waiter = asyncio.create_task(queue.acquire(LIGHT, 1.0))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        assert queue.waiting == 0
+        queue.release()
+        assert queue.active == 0
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app
+from conftest import API_KEY, http_client, multipart_body
+
+
+def test_requests_beyond_the_queue_are_rejected_with_retry_after():
+    async def run():
+        pool = app.InferencePool(1, 1)
+        release = asyncio.Event()
+
+        async def hold(reject_when_full=True):
+            async with pool.slot(reject_when_full):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert (pool.running, pool.queued) == (1, 1)
+
+        with pytest.raises(HTTPException) as rejected:
+            async with pool.slot():
+                pass
+        # Los workers de trabajos esperan en vez de ser rechazados
+        waiting = asyncio.create_task(hold(reject_when_full=False))
+        await asyncio.sleep(0)
+        assert pool.queued == 2
+
+        release.set()
+        await asyncio.gather(*tasks, waiting)
+        assert (pool.running, pool.queued) == (0, 0)
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == str(app.RETRY_AFTER_SECONDS)
+
+
+def test_busy_server_rejects_transcriptions_and_still_answers_health(monkeypatch, fake_model, api_client):
+    fake_model()
+    monkeypatch.setattr(app, "inference_pool", app.InferencePool(1, 0))
+    monkeypatch.setattr(app, "transcript_cache", None)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def run_transcription_pipeline(input_file_path, original_filename, *args, **kwargs):
+        started.set()
+        await release.wait()
+        return {"original_filename": original_filename}
+
+    monkeypatch.setattr(app, "run_transcription_pipeline", run_transcription_pipeline)
+    content_type, body = multipart_body([("file", "a.m4a", b"\0" * (app.MP4_PROBE_BYTES + 1024))])
+    headers = {"X-API-Key": API_KEY, "Content-Type": content_type}
+
+    async def run():
+        async with http_client() as http:
+            first = asyncio.create_task(http.post("/transcribe", content=body, headers=headers))
+            await started.wait()
+            rejected = await http.post("/transcribe", content=body, headers=headers)
+            health = await asyncio.wait_for(http.get("/health"), timeout=5)
+            release.set()
+            return await first, rejected, health
+
+    first, rejected, health = asyncio.run(run())
+
+    assert first.status_code == 200
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == str(app.RETRY_AFTER_SECONDS)
+    assert health.status_code == 200
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import app
+from conftest import API_KEY, http_client, multipart_body
+
+OTHER_KEY = "otra-clave"
+
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path, fake_model, fake_audio, api_client):
+    """Almacén SQLite propio; los trabajos se ejecutan a mano con run_job"""
+    fake_model()
+    store = app.JobStore(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(app, "job_store", store)
+    monkeypatch.setattr(app, "JOB_UPLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "SPOOL_DIR", "")
+    monkeypatch.setattr(app, "job_charges", {})
+    monkeypatch.setattr(app, "inference_pool", app.InferencePool(1, 0))
+    monkeypatch.setattr(app, "transcript_cache", None)
+    monkeypatch.setattr(app, "segment_cache", None)
+    monkeypatch.setitem(app.api_clients, OTHER_KEY, app.ApiClient("otro", OTHER_KEY, 0.0, 1.0))
+    return store
+
+
+async def enqueue(http, audio):
+    content_type, body = multipart_body([("file", "reunion.m4a", audio)])
+    response = await http.post("/jobs", content=body, headers={"X-API-Key": API_KEY, "Content-Type": content_type})
+    assert response.status_code == 202
+    return response.json()
+
+
+def test_job_goes_from_queued_to_result(jobs):
+    async def run():
+        async with http_client() as http:
+            job = await enqueue(http, b"segmentos:3")
+            queued = (await http.get(job["status_url"], headers={"X-API-Key": API_KEY})).json()
+            await app.run_job(jobs.claim_next())
+            status = (await http.get(job["status_url"], headers={"X-API-Key": API_KEY})).json()
+            result = await http.get(job["result_url"], headers={"X-API-Key": API_KEY})
+            return queued, status, result
+
+    queued, status, result = asyncio.run(run())
+
+    assert queued["status"] == "queued"
+    assert status["status"] == "completed"
+    assert status["progress"] == {"segments_done": 3, "segments_total": 3}
+    assert result.status_code == 200
+    assert result.json()["raw_transcription"] == "segmento 1 segmento 2 segmento 3"
+
+
+def test_failed_job_result_explains_the_error(jobs):
+    async def run():
+        async with http_client() as http:
+            job = await enqueue(http, b"basura")
+            await app.run_job(jobs.claim_next())
+            return await http.get(job["result_url"], headers={"X-API-Key": API_KEY})
+
+    result = asyncio.run(run())
+
+    assert result.status_code == 409
+    assert "failed" in result.json()["detail"]
+
+
+def test_other_keys_cannot_see_the_job(jobs):
+    async def run():
+        async with http_client() as http:
+            job = await enqueue(http, b"segmentos:1")
+            await app.run_job(jobs.claim_next())
+            headers = {"X-API-Key": OTHER_KEY}
+            return await http.get(job["status_url"], headers=headers), await http.get(job["result_url"], headers=headers)
+
+    status, result = asyncio.run(run())
+
+    assert status.status_code == 404
+    assert result.status_code == 404
@@ -0,0 +1,22 @@
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+
+@pytest.mark.parametrize("language, code", [("es", "es"), ("Spanish", "es"), ("castilian", "es"), ("yue", "yue")])
+def test_resolve_language_accepts_codes_names_and_aliases(language, code):
+    assert app.resolve_language(language) == code
+
+
+def test_resolve_language_rejects_unknown_languages():
+    with pytest.raises(HTTPException) as error:
+        app.resolve_language("klingon")
+    assert error.value.status_code == 400
+
+
+def test_resolve_language_does_not_import_whisper():
+    app.resolve_language("english")
+    assert "whisper" not in sys.modules
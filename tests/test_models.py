@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import app
+from conftest import http_client
+
+MB = 1024 * 1024
+
+
+class SizedModel:
+    def __init__(self, megabytes):
+        self.size = megabytes * MB
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(app, "model_memory_bytes", lambda model: model.size)
+    return app.ModelRegistry("small", ["tiny", "small", "medium"], 100 * MB)
+
+
+def resident(registry):
+    return [model["name"] for model in registry.stats()["resident"]]
+
+
+def test_least_recently_used_model_is_evicted_over_the_budget(registry):
+    registry.register("tiny", SizedModel(40))
+    registry.register("small", SizedModel(40))
+    # Usar 'tiny' lo convierte en el más reciente: el expulsado es 'small'
+    registry.get("tiny")
+
+    registry.register("medium", SizedModel(40))
+
+    assert resident(registry) == ["medium", "tiny"]
+    assert registry.resident_bytes == 80 * MB
+
+
+def test_last_loaded_model_stays_even_over_the_budget(registry):
+    registry.register("tiny", SizedModel(40))
+
+    registry.register("medium", SizedModel(150))
+
+    assert resident(registry) == ["medium"]
+
+
+def test_models_load_on_first_use(registry, monkeypatch):
+    loaded = []
+
+    def load_whisper(name):
+        loaded.append(name)
+        return SizedModel(10)
+
+    monkeypatch.setattr(app, "load_whisper", load_whisper)
+    model = registry.get("tiny")
+
+    assert registry.get("tiny") is model
+    assert loaded == ["tiny"]
+
+
+def test_health_does_not_report_residency_of_worker_processes(monkeypatch, registry):
+    registry.register("small", SizedModel(10))
+    monkeypatch.setattr(app, "model_registry", registry)
+
+    async def health_models():
+        async with http_client() as http:
+            return (await http.get("/health")).json()["models"]
+
+    assert [model["name"] for model in asyncio.run(health_models())["resident"]] == ["small"]
+
+    monkeypatch.setattr(app, "segment_process_pool", object())
+    models = asyncio.run(health_models())
+    assert "resident" not in models and "resident_memory_mb" not in models
+    assert models["resident_in_workers"] == app.WHISPER_WORKERS
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+WEB = app.ApiClient("web", "k1", 100.0, 1.0)
+UNLIMITED = app.ApiClient("batch", "k2", 0.0, 1.0)
+
+
+def test_admitted_cost_counts_against_the_quota():
+    ledger = app.QuotaLedger(3600)
+    ledger.admit(WEB, 60)
+
+    assert ledger.used(WEB) == 60
+    with pytest.raises(HTTPException) as rejected:
+        ledger.admit(WEB, 50)
+    assert rejected.value.status_code == 429
+    # Libre cuando expire la admisión anterior, dentro de la ventana
+    assert 1 <= int(rejected.value.headers["Retry-After"]) <= 3601
+    assert ledger.used(WEB) == 60
+
+
+def test_request_larger_than_the_whole_quota_has_no_retry_after():
+    ledger = app.QuotaLedger(3600)
+
+    with pytest.raises(HTTPException) as rejected:
+        ledger.admit(WEB, 150)
+    assert rejected.value.headers is None
+
+
+def test_refund_frees_the_quota():
+    ledger = app.QuotaLedger(3600)
+    charge = ledger.admit(WEB, 100)
+    with pytest.raises(HTTPException):
+        ledger.check(WEB)
+
+    ledger.refund(charge)
+    ledger.refund(None)
+    ledger.check(WEB)
+    ledger.admit(WEB, 100)
+
+
+def test_charges_expire_with_the_window():
+    ledger = app.QuotaLedger(3600)
+    charge = ledger.admit(WEB, 100)
+    charge[0] = time.time() - 3601
+
+    assert ledger.used(WEB) == 0
+    ledger.admit(WEB, 100)
+
+
+def test_client_without_quota_is_never_rejected():
+    ledger = app.QuotaLedger(3600)
+    for _ in range(3):
+        ledger.admit(UNLIMITED, 10_000)
+    ledger.check(UNLIMITED)
+
+
+def test_compute_cost_uses_the_model_size_factor(monkeypatch):
+    monkeypatch.setattr(app, "MODEL_COST_FACTORS", {"small": 0.5, "large": 2.0})
+
+    assert app.compute_cost(3600, "small.en") == 1800
+    assert app.compute_cost(60, "large-v3") == 120
+    assert app.compute_cost(60, "desconocido") == 60
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+import app
+
+
+def test_requests_wait_for_quota_and_get_it_when_released(tmp_path):
+    async def run():
+        space = app.ScratchSpace(str(tmp_path), 100)
+        first_done = asyncio.Event()
+        order = []
+
+        async def request(name, nbytes, hold):
+            async with space.directory(nbytes) as path:
+                order.append(name)
+                assert os.path.isdir(path)
+                await hold.wait()
+            return path
+
+        first = asyncio.create_task(request("primera", 80, first_done))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(request("segunda", 50, asyncio.Event()))
+        await asyncio.sleep(0)
+        assert (space.reserved, space.waiting) == (80, 1)
+        assert order == ["primera"]
+
+        first_done.set()
+        first_path = await first
+        await asyncio.sleep(0)
+        assert order == ["primera", "segunda"]
+        assert space.reserved == 50 and space.waiting == 0
+        assert not os.path.exists(first_path)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        return space
+
+    space = asyncio.run(run())
+    assert space.reserved == 0 and space.active == 0
+    assert os.listdir(space.root) == []
+
+
+def test_failed_request_releases_its_reservation_and_directory(tmp_path):
+    async def run():
+        space = app.ScratchSpace(str(tmp_path), 100)
+        with pytest.raises(RuntimeError):
+            async with space.directory(100) as path:
+                with open(os.path.join(path, "input.m4a"), "wb") as f:
+                    f.write(b"audio")
+                raise RuntimeError("fallo en la petición")
+        # La cuota vuelve a estar entera para la siguiente
+        async with space.directory(100):
+            assert space.reserved == 100
+        return space
+
+    space = asyncio.run(run())
+    assert space.reserved == 0
+    assert os.listdir(space.root) == []
+
+
+def test_request_larger_than_the_quota_does_not_wait_forever(tmp_path):
+    async def run():
+        space = app.ScratchSpace(str(tmp_path), 100)
+        async with space.directory(1000):
+            assert space.reserved == 100
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+
+def test_sweep_removes_only_orphaned_directories(tmp_path, monkeypatch):
+    dead_pid = 999_999_999
+    monkeypatch.setattr(app, "process_alive", lambda pid: pid != dead_pid)
+    other_pid = os.getppid()
+    orphaned_dead = tmp_path / f"{dead_pid}-{'a' * 32}"
+    orphaned_own = tmp_path / f"{os.getpid()}-{'b' * 32}"
+    live_other = tmp_path / f"{other_pid}-{'c' * 32}"
+    unrelated = tmp_path / "otra-cosa"
+    for path in (orphaned_dead, orphaned_own, live_other, unrelated):
+        path.mkdir()
+
+    async def run():
+        space = app.ScratchSpace(str(tmp_path), 0)
+        async with space.directory(10) as active:
+            removed = space.sweep()
+            assert os.path.isdir(active)
+        return removed
+
+    assert asyncio.run(run()) == 2
+    assert sorted(os.listdir(tmp_path)) == sorted([live_other.name, unrelated.name])
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def energy(pattern):
+    """Energía por trama a partir de un patrón: 'v' voz, '.' silencio (una trama cada carácter)"""
+    return np.array([0.0 if c == "v" else -100.0 for c in pattern])
+
+
+def frames(seconds):
+    return int(round(seconds / app.VAD_FRAME_SECONDS))
+
+
+def assert_disjoint_and_ordered(regions):
+    for (start, end), (next_start, _) in zip(regions, regions[1:]):
+        assert start < end <= next_start
+
+
+@pytest.mark.parametrize("min_silence", [0.1, 0.3, 0.5, 2.0])
+def test_speech_regions_never_overlap(monkeypatch, min_silence):
+    monkeypatch.setattr(app, "MIN_SILENCE_TO_DROP", min_silence)
+    frame = int(app.VAD_FRAME_SECONDS * app.SAMPLE_RATE)
+    pattern = "v" * 20 + "." * frames(0.3) + "v" * 20 + "." * frames(3) + "v" * 20 + "." * frames(0.1)
+    regions = app.find_speech_regions(energy(pattern), len(pattern) * frame)
+
+    assert_disjoint_and_ordered(regions)
+    assert all(0 <= start and end <= len(pattern) * frame for start, end in regions)
+
+
+def test_long_silence_is_dropped_keeping_padding(monkeypatch):
+    monkeypatch.setattr(app, "MIN_SILENCE_TO_DROP", 2.0)
+    frame = int(app.VAD_FRAME_SECONDS * app.SAMPLE_RATE)
+    padding = frames(app.SPEECH_PADDING)
+    pattern = "v" * 20 + "." * frames(3) + "v" * 20
+    regions = app.find_speech_regions(energy(pattern), len(pattern) * frame)
+
+    assert regions == [(0, (20 + padding) * frame), ((20 + frames(3) - padding) * frame, len(pattern) * frame)]
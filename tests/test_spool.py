@@ -0,0 +1,167 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import app
+
+
+def make_store(root, owner, lease_seconds=30):
+    store = app.SpoolJobStore(str(root), lease_seconds)
+    store.owner = owner
+    return store
+
+
+def expire_lease(store, job_id):
+    """Simula un worker que dejó de renovar el lease hace más de lease_seconds"""
+    path = store._path("leased", job_id)
+    past = time.time() - store.lease_seconds - 1
+    os.utime(path, (past, past))
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return make_store(tmp_path, "worker-a"), make_store(tmp_path, "worker-b")
+
+
+def create(store, job_id, **kwargs):
+    store.create(job_id, f"{job_id}.m4a", f"/uploads/{job_id}.m4a", client="web", **kwargs)
+
+
+def test_jobs_are_claimed_oldest_first_and_only_once(spool):
+    a, b = spool
+    create(a, "1" * 32)
+    create(a, "2" * 32)
+
+    assert a.claim_next()["id"] == "1" * 32
+    assert b.claim_next()["id"] == "2" * 32
+    assert a.claim_next() is None
+    assert a.get("1" * 32)["status"] == "running"
+    assert a.count("running") == 2
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(spool):
+    a, b = spool
+    create(a, "1" * 32)
+    a.claim_next()
+    a.update_progress("1" * 32, 3, 10)
+
+    # Mientras el lease está vigente nadie más lo reclama
+    assert b.claim_next() is None
+
+    expire_lease(a, "1" * 32)
+    job = b.claim_next()
+    assert job["id"] == "1" * 32
+    assert job["lease_owner"] == "worker-b"
+    assert job["segments_done"] == 0
+    # El worker original ya no puede renovarlo ni informar progreso
+    assert not a.renew("1" * 32)
+    a.update_progress("1" * 32, 4, 10)
+    assert b.get("1" * 32)["segments_done"] == 0
+    assert b.renew("1" * 32)
+
+
+def test_renewed_lease_is_not_reclaimed(spool):
+    a, b = spool
+    create(a, "1" * 32)
+    a.claim_next()
+    expire_lease(a, "1" * 32)
+
+    assert a.renew("1" * 32)
+    assert b.requeue_interrupted() == 0
+    assert b.claim_next() is None
+
+
+def test_released_job_goes_back_to_the_queue(spool):
+    a, b = spool
+    create(a, "1" * 32)
+    a.claim_next()
+
+    # Solo el dueño del lease puede devolverlo
+    b.release("1" * 32)
+    assert a.get("1" * 32)["status"] == "running"
+
+    a.release("1" * 32)
+    assert a.get("1" * 32)["status"] == "queued"
+    assert b.claim_next()["lease_owner"] == "worker-b"
+
+
+def test_first_worker_to_finish_wins(spool):
+    a, b = spool
+    create(a, "1" * 32)
+    a.claim_next()
+    expire_lease(a, "1" * 32)
+    b.claim_next()
+
+    b.complete("1" * 32, {"transcription": "b"})
+    a.complete("1" * 32, {"transcription": "a"})
+
+    job = a.get("1" * 32)
+    assert job["status"] == "completed"
+    assert job["result"] == '{"transcription": "b"}'
+    assert a.count("running") == 0
+    assert a.count("completed") == 1
+
+
+def test_finished_jobs_record_whether_the_quota_is_refunded(spool):
+    a, _ = spool
+    for job_id in ("1" * 32, "2" * 32, "3" * 32):
+        create(a, job_id)
+        a.claim_next()
+    a.complete("1" * 32, {}, refunded=False)
+    a.complete("2" * 32, {}, refunded=True)
+    a.fail("3" * 32, "error")
+
+    assert [a.get(job_id)["quota_refunded"] for job_id in ("1" * 32, "2" * 32, "3" * 32)] == [False, True, True]
+
+
+def test_api_refunds_charges_of_jobs_finished_without_result(spool, monkeypatch):
+    a, _ = spool
+    client = app.ApiClient("web", "k", 100.0, 1.0)
+    ledger = app.QuotaLedger(3600)
+    monkeypatch.setattr(app, "job_store", a)
+    monkeypatch.setattr(app, "quota_ledger", ledger)
+    monkeypatch.setattr(app, "job_charges", {})
+    for job_id in ("1" * 32, "2" * 32, "3" * 32):
+        create(a, job_id)
+        app.job_charges[job_id] = ledger.admit(client, 30)
+        a.claim_next()
+    a.complete("1" * 32, {})
+    a.fail("2" * 32, "error")
+
+    assert app.settle_job_charges() == 1
+    assert ledger.used(client) == 60
+    # El trabajo en curso conserva su cargo hasta que termine
+    assert list(app.job_charges) == ["3" * 32]
+
+
+def test_sqlite_store_records_whether_the_quota_is_refunded(tmp_path):
+    store = app.JobStore(str(tmp_path / "jobs.db"))
+    for job_id in ("1" * 32, "2" * 32, "3" * 32):
+        create(store, job_id)
+        store.claim_next()
+    store.complete("1" * 32, {}, refunded=False)
+    store.complete("2" * 32, {}, refunded=True)
+    store.fail("3" * 32, "error")
+
+    assert [store.get(job_id)["quota_refunded"] for job_id in ("1" * 32, "2" * 32, "3" * 32)] == [0, 1, 1]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_run_job_refunds_results_served_from_the_cache(spool, monkeypatch, cached):
+    a, _ = spool
+    monkeypatch.setattr(app, "job_store", a)
+    monkeypatch.setattr(app, "SPOOL_DIR", a.root)
+    monkeypatch.setattr(app, "inference_pool", app.InferencePool(1, 0))
+
+    async def run_transcription_pipeline(*args, **kwargs):
+        return {"cached": cached}
+
+    monkeypatch.setattr(app, "run_transcription_pipeline", run_transcription_pipeline)
+    create(a, "1" * 32)
+    asyncio.run(app.run_job(a.claim_next()))
+
+    job = a.get("1" * 32)
+    assert job["status"] == "completed"
+    assert job["quota_refunded"] is cached
@@ -0,0 +1,54 @@
+import pytest
+from fastapi.responses import JSONResponse
+from starlette.testclient import TestClient
+
+import app
+
+
+def respond_with(status):
+    async def endpoint(scope, receive, send):
+        await JSONResponse(status_code=status, content={})(scope, receive, send)
+    return endpoint
+
+
+@pytest.fixture
+def traces(monkeypatch):
+    store = app.TraceStore(10)
+    monkeypatch.setattr(app, "trace_store", store)
+    monkeypatch.setattr(app, "api_clients", {"k1": app.ApiClient("web", "k1", 0.0, 1.0)})
+    return store
+
+
+def post(status, key="k1"):
+    client = TestClient(app.TraceMiddleware(respond_with(status)))
+    return client.post("/transcribe", headers={"X-API-Key": key})
+
+
+def test_authenticated_request_is_traced(traces):
+    response = post(200)
+
+    trace = traces.get(response.headers["x-trace-id"])
+    assert trace is not None and trace.client == "web"
+
+
+def test_request_without_valid_key_is_not_traced(traces):
+    response = post(403, key="otra")
+
+    assert "x-trace-id" not in response.headers
+    assert traces.recent() == []
+
+
+@pytest.mark.parametrize("status", [401, 403, 413, 429])
+def test_rejected_request_is_not_traced(traces, status):
+    response = post(status)
+
+    assert "x-trace-id" not in response.headers
+    assert traces.recent() == []
+
+
+def test_rejections_do_not_evict_traces(traces):
+    traced = post(200).headers["x-trace-id"]
+    for _ in range(traces.capacity + 1):
+        post(429)
+
+    assert traces.get(traced) is not None
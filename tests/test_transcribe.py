@@ -0,0 +1,79 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+
+import app
+from conftest import API_KEY, http_client, multipart_body
+
+# Sin caja 'moov' al principio: se transcribe al terminar la subida
+AUDIO_SIZE = app.MP4_PROBE_BYTES + 1024
+AUDIO = b"\0" * AUDIO_SIZE
+
+
+@pytest.fixture
+def pipeline(monkeypatch, fake_model, api_client):
+    """Pool de un hueco sin cola y un pipeline simulado que registra los archivos transcritos"""
+    fake_model()
+    monkeypatch.setattr(app, "inference_pool", app.InferencePool(1, 0))
+    monkeypatch.setattr(app, "transcript_cache", None)
+    transcribed = []
+
+    async def run_transcription_pipeline(input_file_path, original_filename, *args, **kwargs):
+        transcribed.append(original_filename)
+        return {"original_filename": original_filename}
+
+    monkeypatch.setattr(app, "run_transcription_pipeline", run_transcription_pipeline)
+    return transcribed
+
+
+def test_stalled_upload_does_not_hold_the_inference_slot(pipeline):
+    content_type, body = multipart_body([("file", "lento.m4a", AUDIO)])
+    headers = {"X-API-Key": API_KEY, "Content-Type": content_type}
+    resume = asyncio.Event()
+
+    async def stalled_body():
+        yield body[:1024]
+        await resume.wait()
+        yield body[1024:]
+
+    async def run():
+        async with http_client() as http:
+            slow = asyncio.create_task(http.post("/transcribe", content=stalled_body(), headers=headers))
+            await asyncio.sleep(0.1)
+            fast = await http.post("/transcribe", content=body.replace(b"lento", b"veloz"), headers=headers)
+            resume.set()
+            return fast, await slow
+
+    fast, slow = asyncio.run(run())
+
+    assert fast.status_code == 200
+    assert slow.status_code == 200
+    assert pipeline == ["veloz.m4a", "lento.m4a"]
+
+
+def test_ffmpeg_errors_do_not_expose_server_paths():
+    stderr = "Error opening input file /srv/scratch/123-abc/input.m4a.\n/srv/scratch/123-abc/input.m4a: Invalid data\n"
+
+    message = app.ffmpeg_error(stderr, "/srv/scratch/123-abc/input.m4a")
+
+    assert "/srv/scratch" not in message
+    assert message == "Error opening input file input.m4a.\nInvalid data"
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="necesita ffmpeg")
+def test_undecodable_upload_is_a_client_error(fake_model, api_client, monkeypatch):
+    fake_model()
+    monkeypatch.setattr(app, "transcript_cache", None)
+    content_type, body = multipart_body([("file", "roto.m4a", os.urandom(AUDIO_SIZE))])
+
+    async def run():
+        async with http_client() as http:
+            return await http.post("/transcribe", content=body, headers={"X-API-Key": API_KEY, "Content-Type": content_type})
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 400
+    assert "ffmpeg no pudo decodificar el audio" in response.json()["detail"]
+    assert app.scratch_space.root not in response.json()["detail"]
@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI, Request
+
+import app
+from conftest import API_KEY, http_client
+
+LIMIT = 1000
+BATCH_LIMIT = 3000
+
+
+def limited_app():
+    """Aplicación que lee el cuerpo entero tras UploadSizeLimitMiddleware; anota lo que llega al endpoint"""
+    test_app = FastAPI()
+    test_app.state.received = []
+
+    @test_app.post("/{path:path}")
+    async def upload(request: Request):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            test_app.state.received.append(size)
+        return {"bytes": size}
+
+    test_app.add_middleware(app.UploadSizeLimitMiddleware, max_body_size=LIMIT, path_limits={"/batch": BATCH_LIMIT})
+    return test_app
+
+
+def post(test_app, path, content, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=test_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post(path, content=content, headers=headers)
+
+    return asyncio.run(run())
+
+
+def chunks(size, chunk_size=100):
+    """Cuerpo sin Content-Length (transfer-encoding chunked)"""
+    async def body():
+        for offset in range(0, size, chunk_size):
+            yield b"\0" * min(chunk_size, size - offset)
+    return body()
+
+
+def test_oversized_content_length_is_rejected_before_reading():
+    test_app = limited_app()
+
+    response = post(test_app, "/transcribe", b"\0" * (LIMIT + 1))
+
+    assert response.status_code == 413
+    assert "Tamaño máximo permitido" in response.json()["detail"]
+    assert test_app.state.received == []
+
+
+def test_chunked_body_is_cut_when_it_exceeds_the_limit():
+    test_app = limited_app()
+
+    response = post(test_app, "/transcribe", chunks(LIMIT * 5))
+
+    assert response.status_code == 413
+    assert max(test_app.state.received) <= LIMIT
+
+
+def test_bodies_within_the_limit_pass():
+    test_app = limited_app()
+
+    assert post(test_app, "/transcribe", chunks(LIMIT)).json() == {"bytes": LIMIT}
+    assert post(test_app, "/transcribe", b"\0" * LIMIT).json() == {"bytes": LIMIT}
+
+
+def test_batch_path_has_its_own_limit():
+    test_app = limited_app()
+
+    assert post(test_app, "/batch", chunks(BATCH_LIMIT)).json() == {"bytes": BATCH_LIMIT}
+    response = post(test_app, "/batch", chunks(BATCH_LIMIT + 1))
+    assert response.status_code == 413
+    assert "Petición demasiado grande" in response.json()["detail"]
+
+
+def test_batch_body_never_exceeds_the_scratch_quota():
+    assert app.BATCH_MAX_BODY_SIZE <= app.BATCH_MAX_FILES * app.MAX_FILE_SIZE + app.MULTIPART_OVERHEAD
+    if app.SCRATCH_QUOTA:
+        assert app.BATCH_MAX_BODY_SIZE <= app.SCRATCH_QUOTA + app.MULTIPART_OVERHEAD
+
+
+def test_api_rejects_oversized_transcription_uploads(api_client):
+    async def run():
+        async with http_client() as http:
+            return await http.post(
+                "/transcribe", content=b"\0" * 10,
+                headers={"X-API-Key": API_KEY, "Content-Length": str(app.MAX_FILE_SIZE + app.MULTIPART_OVERHEAD + 1)}
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 413
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Worker de transcripción independiente para AudioTrans
+Ejecuta los trabajos que la API encola en SPOOL_DIR con el mismo pipeline que app.py.
+Varios workers (en uno o varios contenedores con el volumen del spool montado en la misma ruta)
+se reparten la cola reclamando trabajos con renombrados atómicos; si uno muere, su lease expira
+y otro repite el trabajo
+
+Uso:
+    SPOOL_DIR=/spool python worker.py
+    SPOOL_DIR=/spool python worker.py --concurrency 2
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import time
+
+import app
+
+logger = logging.getLogger("worker")
+
+
+async def recover_expired_leases():
+    """Devuelve a la cola los trabajos de workers caídos aunque este worker esté ocupado"""
+    while True:
+        try:
+            app.job_store.requeue_interrupted()
+        except Exception as e:
+            logger.warning(f"Error recuperando leases expirados: {e}")
+        await asyncio.sleep(max(1, app.SPOOL_LEASE_SECONDS / 3))
+
+
+async def run_worker(concurrency):
+    loop = asyncio.get_running_loop()
+    current = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, current.cancel)
+
+    started = time.perf_counter()
+    await loop.run_in_executor(None, app.prepare_model)
+    app.startup_status.update(ready=True, phase="ready")
+    app.model_ready.set()
+    logger.info(
+        f"✅ Worker {app.job_store.owner} listo en {time.perf_counter() - started:.1f}s: "
+        f"{concurrency} trabajos a la vez desde {app.SPOOL_DIR}"
+    )
+
+    app.background_tasks.append(asyncio.create_task(recover_expired_leases()))
+    for worker_id in range(concurrency):
+        app.background_tasks.append(asyncio.create_task(app.job_worker(worker_id)))
+    try:
+        await asyncio.gather(*app.background_tasks)
+    except asyncio.CancelledError:
+        logger.info("Deteniendo worker: los trabajos en curso vuelven a la cola")
+        for task in app.background_tasks:
+            task.cancel()
+        # Esperar a que cada trabajo en curso libere su lease antes de salir
+        await asyncio.gather(*app.background_tasks, return_exceptions=True)
+    finally:
+        await app.shutdown_inference_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de transcripción de AudioTrans (consume SPOOL_DIR)")
+    parser.add_argument(
+        "--concurrency", type=int, default=max(1, app.JOB_WORKERS),
+        help="Trabajos ejecutados a la vez por este worker (por defecto JOB_WORKERS)"
+    )
+    args = parser.parse_args()
+
+    if not app.SPOOL_DIR:
+        print("SPOOL_DIR no está configurado: el worker necesita el directorio compartido con la API", file=sys.stderr)
+        return 2
+    if not app.INFERENCE_ENABLED:
+        print("INFERENCE_ENABLED=false: el worker necesita cargar el modelo", file=sys.stderr)
+        return 2
+
+    try:
+        asyncio.run(run_worker(max(1, args.concurrency)))
+    except asyncio.CancelledError:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())